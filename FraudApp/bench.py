@@ -0,0 +1,99 @@
+"""
+Load benchmark for a running FraudApp instance.
+
+Usage:
+    uvicorn main:app --port 8000 &
+    python bench.py --url http://localhost:8000/process --requests 32
+
+Prints p50/p99 latency, p50 time-to-first-byte and requests/sec for each
+concurrency level. Use --format ndjson/csv to exercise the streaming modes
+(with --chunked, scored chunk by chunk out of core), --transactions/--patterns
+to point at larger files, and --server-pid to report the server's peak RSS
+(Linux only).
+"""
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+TRANSACTIONS_CSV = os.path.join(ROOT, "transactions_cleaned.csv")
+PATTERNS_CSV = os.path.join(ROOT, "patterns_cleaned.csv")
+
+def peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+async def run_level(url: str, params: dict, concurrency: int, total: int, file1: bytes, file2: bytes) -> dict:
+    latencies = []
+    ttfbs = []
+    statuses = {}
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker(client: httpx.AsyncClient):
+        while not queue.empty():
+            queue.get_nowait()
+            files = {"file1": ("transactions.csv", file1), "file2": ("patterns.csv", file2)}
+            start = time.perf_counter()
+            first_byte = None
+            async with client.stream("POST", url, params=params, files=files) as resp:
+                async for _ in resp.aiter_raw():
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - start
+                        ttfbs.append(first_byte)
+                latencies.append(time.perf_counter() - start)
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "ttfb_p50_ms": float(np.percentile(ttfbs, 50) * 1000) if ttfbs else float("nan"),
+        "rps": total / elapsed,
+        "statuses": statuses,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000/process")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--format", choices=["json", "ndjson", "csv"], default="json")
+    parser.add_argument("--chunked", action="store_true")
+    parser.add_argument("--transactions", default=TRANSACTIONS_CSV)
+    parser.add_argument("--patterns", default=PATTERNS_CSV)
+    parser.add_argument("--server-pid", type=int)
+    args = parser.parse_args()
+
+    with open(args.transactions, "rb") as f:
+        file1 = f.read()
+    with open(args.patterns, "rb") as f:
+        file2 = f.read()
+
+    params = {"format": args.format}
+    if args.chunked:
+        params["chunked"] = "true"
+    for concurrency in args.concurrency:
+        result = await run_level(args.url, params, concurrency, args.requests, file1, file2)
+        print(
+            f"concurrency={result['concurrency']:>3}  p50={result['p50_ms']:.1f}ms  "
+            f"p99={result['p99_ms']:.1f}ms  ttfb_p50={result['ttfb_p50_ms']:.1f}ms  "
+            f"rps={result['rps']:.2f}  statuses={result['statuses']}"
+        )
+    if args.server_pid:
+        print(f"server peak RSS: {peak_rss_mb(args.server_pid):.1f} MB")
+
+if __name__ == "__main__":
+    asyncio.run(main())
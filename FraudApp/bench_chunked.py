@@ -0,0 +1,97 @@
+"""
+Out-of-core scoring benchmark: scores a synthetic transactions file with
+scoring.score_file_chunked under a fixed address-space limit.
+
+Usage (from the directory holding model.pkl and preprocessor.json):
+    python bench_chunked.py --rows 10000000 --memory-limit-mb 3072 [--in-memory]
+
+The input is transactions_cleaned.csv tiled until it has --rows rows, so
+the join hit rate matches the bundled data. Scoring runs in a child
+process with RLIMIT_AS set, and its throughput and peak RSS are reported.
+--in-memory also runs score_uploads on the same file under the same limit.
+
+RLIMIT_AS caps address space, not RSS: loading the model alone reserves
+about 1.8GB of address space (thread arenas, shared libraries) while
+touching about 250MB, so the limit has to leave room for that.
+"""
+import argparse
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def generate(path: str, rows: int):
+    with open(os.path.join(ROOT, "transactions_cleaned.csv"), "rb") as f:
+        header = f.readline()
+        body = f.readlines()
+    with open(path, "wb") as out:
+        out.write(header)
+        written = 0
+        while written < rows:
+            block = body[:rows - written]
+            out.writelines(block)
+            written += len(block)
+
+def limit_memory(memory_limit: int):
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+def score(path: str, out_path: str, chunk_rows: int, in_memory: bool) -> tuple:
+    import scoring
+    scoring.load_model()
+    with open(os.path.join(ROOT, "patterns_cleaned.csv"), "rb") as f:
+        patterns_content = f.read()
+    start = time.perf_counter()
+    if in_memory:
+        with open(path, "rb") as f:
+            scored = scoring.score_uploads(f.read(), patterns_content)
+        metrics = scored if isinstance(scored, dict) else scored[1]
+    else:
+        metrics = scoring.score_file_chunked(path, patterns_content, out_path, "ndjson", chunk_rows)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return metrics, elapsed, peak_rss
+
+def run(args, in_memory: bool):
+    label = "score_uploads" if in_memory else "score_file_chunked"
+    out_path = args.path + ".ndjson"
+    # a fresh process per run, so peak RSS and the limit only cover scoring
+    with ProcessPoolExecutor(max_workers=1, initializer=limit_memory, initargs=(args.memory_limit_mb * 1024 * 1024,)) as pool:
+        try:
+            metrics, elapsed, peak_rss = pool.submit(score, args.path, out_path, args.chunk_rows, in_memory).result()
+        except Exception as e:
+            print(f"{label}: failed under {args.memory_limit_mb}MB: {type(e).__name__}: {e}")
+            return
+    if "error" in metrics:
+        print(f"{label}: error: {metrics}")
+        return
+    rows = metrics["join"]["transactions"]
+    print(
+        f"{label}: rows={rows} limit={args.memory_limit_mb}MB "
+        f"{elapsed:.1f}s ({rows / elapsed:,.0f} rows/s), peak RSS {peak_rss / 2 ** 20:.0f}MB"
+    )
+    if os.path.exists(out_path):
+        print(f"output={os.path.getsize(out_path) / 2 ** 20:.0f}MB")
+        os.remove(out_path)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--chunk-rows", type=int, default=200_000)
+    parser.add_argument("--memory-limit-mb", type=int, default=3072)
+    parser.add_argument("--in-memory", action="store_true", help="also run score_uploads for comparison")
+    parser.add_argument("--path", default="/tmp/transactions_synthetic.csv")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        start = time.perf_counter()
+        generate(args.path, args.rows)
+        print(f"generated {args.rows} rows in {time.perf_counter() - start:.1f}s")
+    print(f"input={os.path.getsize(args.path) / 2 ** 20:.0f}MB chunk_rows={args.chunk_rows}")
+    run(args, in_memory=False)
+    if args.in_memory:
+        run(args, in_memory=True)
+
+if __name__ == "__main__":
+    main()
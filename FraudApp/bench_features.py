@@ -0,0 +1,46 @@
+"""
+Microbenchmark for preprocess_merged_data.
+
+Usage:
+    python bench_features.py --rows 10000 100000 1000000
+
+The bundled CSVs are merged once and tiled up to each row count. Run it on
+two commits to compare feature-engineering implementations.
+"""
+import argparse
+import os
+import time
+import pandas as pd
+from helpers import validate_transaction_data, validate_patterns_data, merge_transaction_pattern_data, preprocess_merged_data
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def load_merged() -> pd.DataFrame:
+    transactions = pd.read_csv(os.path.join(ROOT, "transactions_cleaned.csv"), encoding='cp1251')
+    patterns = pd.read_csv(os.path.join(ROOT, "patterns_cleaned.csv"), encoding='cp1251')
+    validate_transaction_data(transactions)
+    validate_patterns_data(patterns)
+    return merge_transaction_pattern_data(transactions=transactions, patterns=patterns)
+
+def tile(df: pd.DataFrame, rows: int) -> pd.DataFrame:
+    repeats = -(-rows // len(df))
+    return pd.concat([df] * repeats, ignore_index=True).iloc[:rows]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    merged = load_merged()
+    for rows in args.rows:
+        df = tile(merged, rows)
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            preprocess_merged_data(df)
+            best = min(best, time.perf_counter() - start)
+        print(f"rows={rows:>9}  best={best * 1000:.1f}ms  rows/s={rows / best:,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+CSV against Parquet and Arrow IPC uploads on synthetic data (see
+synth_data.py): upload size, parse time and /process end to end.
+
+Usage (from the directory holding model.pkl and preprocessor.json):
+    python bench_formats.py [--rows 1000000] [--repeat 3] [--data-dir synth]
+
+The synthetic CSVs are converted once with the types a columnar producer
+would store: ids and amounts as numbers, transdate and transdatetime as
+timestamps. Parquet uses pyarrow's default compression (snappy), Arrow IPC
+none. /process is timed with the response in the upload's format, and once
+more as Parquet in, NDJSON out; the result cache is disabled.
+"""
+import argparse
+import os
+import time
+import pyarrow
+from pyarrow import parquet
+from fastapi.testclient import TestClient
+import main
+import result_cache
+import synth_data
+from bench_pipeline import dataset, measure
+from helpers import read_upload_typed, parse_datetime
+
+def encode(content: bytes, fmt: str) -> bytes:
+    df = read_upload_typed(content)
+    if 'transdatetime' in df.columns:
+        df['transdatetime'] = parse_datetime(df['transdatetime'])
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    sink = pyarrow.BufferOutputStream()
+    if fmt == "parquet":
+        parquet.write_table(table, sink)
+    else:
+        with pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--patterns-ratio", type=float, default=None, help="pattern rows per transaction; defaults to the real files'")
+    parser.add_argument("--hit-rate", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data-dir", default="synth")
+    args = parser.parse_args()
+
+    real = synth_data.load_real()
+    if args.patterns_ratio is None:
+        args.patterns_ratio = len(real["patterns"]) / len(real["transactions"])
+    paths = dataset(args, args.rows, real)
+    uploads = {"csv": []}
+    for name in ("transactions_path", "patterns_path"):
+        with open(paths[name], "rb") as f:
+            uploads["csv"].append(f.read())
+    for fmt in ("parquet", "arrow"):
+        uploads[fmt] = [encode(content, fmt) for content in uploads["csv"]]
+
+    print(f"{args.rows} transactions")
+    for fmt, (transactions, patterns) in uploads.items():
+        _, parse = measure(lambda: read_upload_typed(transactions), args.repeat)
+        print(f"{fmt:<8} transactions {len(transactions) / 2 ** 20:8.1f} MB  patterns {len(patterns) / 2 ** 20:7.1f} MB  "
+              f"parse transactions median={parse['median_ms']:8.1f}ms  min={parse['min_ms']:8.1f}ms")
+
+    result_cache.RESULT_CACHE_ENTRIES = 0
+    with TestClient(main.app) as client:
+        while client.get("/ready").status_code != 200:
+            time.sleep(0.05)
+        for fmt, out in (("csv", "csv"), ("parquet", "parquet"), ("arrow", "arrow"), ("parquet", "ndjson")):
+            transactions, patterns = uploads[fmt]
+
+            def send():
+                response = client.post(f"/process?format={out}", files={
+                    "file1": ("transactions", transactions), "file2": ("patterns", patterns),
+                })
+                response.raise_for_status()
+                return len(response.content)
+            size, timing = measure(send, args.repeat)
+            print(f"/process {fmt:>7} -> {out:<7} median={timing['median_ms']:8.1f}ms  min={timing['min_ms']:8.1f}ms  response {size / 2 ** 20:7.1f} MB")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,83 @@
+"""
+predict_proba on the features frame against inference.CatBoostPredictor,
+on synthetic data (see synth_data.py).
+
+Usage (from the directory holding model.pkl and preprocessor.json):
+    python bench_inference.py [--rows 10000 100000 1000000] [--repeat 3] [--data-dir synth]
+
+For each size the transactions are joined and featurized as /process
+does. Only the predict step is timed: the frame call scoring used to make
+and the predictor, both on the same feature frame, with scores that must
+be identical. The predictor is then timed at several block sizes and
+thread counts on the largest size. On the smallest size, /score batch
+sizes are timed with and without the conversion (INFERENCE_MIN_ROWS).
+"""
+import argparse
+import numpy as np
+import model_registry
+import synth_data
+from bench_pipeline import dataset, measure
+from inference import CatBoostPredictor
+from helpers import read_csv_typed, build_patterns_index, join_transactions_patterns
+
+def features_for(paths: dict, version) -> tuple:
+    with open(paths["transactions_path"], "rb") as f:
+        transactions = read_csv_typed(f.read())
+    with open(paths["patterns_path"], "rb") as f:
+        patterns = read_csv_typed(f.read())
+    merged, _ = join_transactions_patterns(transactions, build_patterns_index(patterns))
+    features = version.preprocessor.transform(merged)
+    return features.drop(columns=['cst_dim_id', 'transdate', 'transdatetime', 'docno', 'target'], errors='ignore')
+
+def rate(rows: int, timing: dict) -> str:
+    return f"median={timing['median_ms']:8.1f}ms  {rows / timing['median_ms'] * 1000:12,.0f} rows/s"
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--patterns-ratio", type=float, default=None, help="pattern rows per transaction; defaults to the real files'")
+    parser.add_argument("--hit-rate", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data-dir", default="synth")
+    args = parser.parse_args()
+
+    real = synth_data.load_real()
+    if args.patterns_ratio is None:
+        args.patterns_ratio = len(real["patterns"]) / len(real["transactions"])
+    version = model_registry.load_version(model_registry.make_spec("bench", model_registry.MODEL_PATH, model_registry.PREPROCESSOR_PATH))
+    model = version.model
+    predictor = CatBoostPredictor(model)
+    print(f"predictor: {predictor.threads} threads, blocks of {predictor.block_rows} rows")
+
+    frames = {}
+    for rows in sorted(args.rows):
+        features = frames[rows] = features_for(dataset(args, rows, real), version)
+        before = features.copy()
+        expected, frame = measure(lambda: model.predict_proba(features)[:, 1], args.repeat)
+        predicted, native = measure(lambda: predictor.predict(features), args.repeat)
+        assert np.array_equal(expected, predicted), f"{rows} rows: scores differ by up to {np.abs(expected - predicted).max()}"
+        assert features.equals(before), "predict changed its input"
+        print(f"{len(features):8d} rows  predict_proba(frame) {rate(len(features), frame)}")
+        print(f"{'':14}predictor            {rate(len(features), native)}  x{frame['median_ms'] / native['median_ms']:.1f}")
+
+    features = frames[max(frames)]
+    for block_rows in (16384, 65536, 262144, len(features)):
+        _, timing = measure(lambda: CatBoostPredictor(model, block_rows=block_rows).predict(features), args.repeat)
+        print(f"{len(features)} rows, blocks of {block_rows:8d}  {rate(len(features), timing)}")
+    for threads in sorted({1, 2, predictor.threads}):
+        _, timing = measure(lambda: CatBoostPredictor(model, threads=threads).predict(features), args.repeat)
+        print(f"{len(features)} rows, {threads} threads         {rate(len(features), timing)}")
+
+    features = frames[min(frames)]
+    converting = CatBoostPredictor(model, min_rows=0)
+    for batch in (1, 100, 1000, 3000, len(features)):
+        sample = features.iloc[:batch]
+        _, frame = measure(lambda: model.predict_proba(sample)[:, 1], args.repeat * 10)
+        _, native = measure(lambda: predictor.predict(sample), args.repeat * 10)
+        _, converted = measure(lambda: converting.predict(sample), args.repeat * 10)
+        print(f"batch of {batch:5d}  predict_proba(frame) {frame['median_ms']:7.2f}ms  predictor {native['median_ms']:7.2f}ms  "
+              f"always converting {converted['median_ms']:7.2f}ms")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,60 @@
+"""
+Benchmark for CSV ingestion: the old inferred read_csv + validation path
+against read_csv_typed + validation.
+
+Usage:
+    python bench_ingest.py --scale 1 10 100
+
+The bundled CSV bodies are repeated --scale times (header kept once).
+Peak memory is the tracemalloc peak during the read.
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from io import BytesIO
+import pandas as pd
+from helpers import identify_separator, read_csv_typed, validate_transaction_data, validate_patterns_data
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def scaled(path: str, scale: int) -> bytes:
+    with open(path, "rb") as f:
+        header = f.readline()
+        body = f.read()
+    if not body.endswith(b"\n"):
+        body += b"\n"
+    return header + body * scale
+
+def read_inferred(content: bytes) -> pd.DataFrame:
+    sep = identify_separator(BytesIO(content))
+    return pd.read_csv(BytesIO(content), sep=sep, encoding='cp1251')
+
+def measure(reader, validator, content: bytes) -> tuple:
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = reader(content)
+    validator(df)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+
+    files = [
+        ("transactions", os.path.join(ROOT, "transactions_cleaned.csv"), validate_transaction_data),
+        ("patterns", os.path.join(ROOT, "patterns_cleaned.csv"), validate_patterns_data),
+    ]
+    for scale in args.scale:
+        for name, path, validator in files:
+            content = scaled(path, scale)
+            for label, reader in (("inferred", read_inferred), ("typed", read_csv_typed)):
+                elapsed, peak = measure(reader, validator, content)
+                print(f"{name:<12} x{scale:<4} {label:<8} {elapsed * 1000:8.1f}ms  peak={peak:8.1f}MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Join throughput: the old hash merge + dropna against build_patterns_index +
+join_transactions_patterns.
+
+Usage:
+    python bench_join.py --rows 13107 1000000 10000000
+
+Transactions are tiled from transactions_cleaned.csv, so the join hit rate
+matches the bundled data. The index build is timed separately since it can
+be reused across requests.
+"""
+import argparse
+import os
+import time
+import pandas as pd
+from helpers import read_csv_typed, validate_transaction_data, validate_patterns_data, build_patterns_index, join_transactions_patterns
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def merge_dropna(transactions: pd.DataFrame, patterns: pd.DataFrame) -> pd.DataFrame:
+    return transactions.merge(patterns, on=['cst_dim_id', 'transdate'], how='left').dropna()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[13_107, 1_000_000, 10_000_000])
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "transactions_cleaned.csv"), "rb") as f:
+        transactions = read_csv_typed(f.read())
+    with open(os.path.join(ROOT, "patterns_cleaned.csv"), "rb") as f:
+        patterns = read_csv_typed(f.read())
+    validate_transaction_data(transactions)
+    validate_patterns_data(patterns)
+
+    start = time.perf_counter()
+    patterns_index = build_patterns_index(patterns)
+    print(f"index build: {(time.perf_counter() - start) * 1000:.1f}ms for {len(patterns_index)} keys")
+
+    for rows in args.rows:
+        repeats = -(-rows // len(transactions))
+        batch = pd.concat([transactions] * repeats, ignore_index=True).iloc[:rows]
+
+        start = time.perf_counter()
+        merge_dropna(batch, patterns)
+        merge_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, stats = join_transactions_patterns(batch, patterns_index)
+        join_time = time.perf_counter() - start
+
+        print(
+            f"rows={rows:>9}  merge+dropna={merge_time * 1000:8.1f}ms ({rows / merge_time:,.0f} rows/s)  "
+            f"indexed join={join_time * 1000:8.1f}ms ({rows / join_time:,.0f} rows/s)  unmatched={stats['unmatched']}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Checks and benchmarks login_patterns.py.
+
+Usage:
+    python bench_login_patterns.py [--customers 300] [--days 90] [--events 1000000]
+
+1. File semantics: every relation between columns that the definitions in
+   login_patterns.py imply is checked on patterns_cleaned.csv, with the
+   rows that break it counted.
+2. Parity: synthetic logins are replayed in time order with a snapshot
+   at every midnight. Each snapshot is compared column by column with a
+   brute-force recomputation from the raw events.
+3. Serving: the last snapshot must pass validate_patterns_data and join
+   the synthetic transactions of that day.
+4. Throughput: events/sec for ingest_frame and ingest on --events logins,
+   and the time of a snapshot.
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from login_patterns import LoginAggregator, DAY
+from helpers import PATTERN_COLUMNS, validate_patterns_data, build_patterns_index, join_transactions_patterns
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+OS_NAMES = ["Android/12", "Android/13", "Android/14", "iOS/17.6.1", "iOS/18.5"]
+PHONES = ["Samsung SM-A556E", "Xiaomi_poco_f2_pro", "iPhone12,1", "iPhone16,1", "Vivo V2116", "OPPO CPH2477"]
+
+def check_file():
+    """
+    The relations the definitions imply, checked on the real file. var is
+    stored to 3 significant digits above 1e11 and login_frequency_30d
+    sometimes as 1.02 for 1.2, so those comparisons are loose or counted.
+    """
+    p = pd.read_csv(os.path.join(ROOT, "patterns_cleaned.csv"), encoding="cp1251")
+    l7, l30 = p['logins_last_7_days'], p['logins_last_30_days']
+    avg, std, var = p['avg_login_interval_30d'], p['std_login_interval_30d'], p['var_login_interval_30d']
+    has_std = std != -1
+    checks = {
+        "login_frequency_7d = l7 / 7": np.isclose(p['login_frequency_7d'], l7 / 7),
+        "login_frequency_30d = round(l30 / 30, 2)": np.isclose(p['login_frequency_30d'], (l30 / 30).round(2)),
+        "freq_change = (l7 / 7) / (l30 / 30) - 1": np.isclose(p['freq_change_7d_vs_mean'], (l7 / 7) / (l30 / 30) - 1),
+        "ratio = l7 / l30": np.isclose(p['logins_7d_over_30d_ratio'], l7 / l30),
+        "std = sqrt(var)": ~has_std | np.isclose(std, np.sqrt(var.clip(0)), rtol=5e-3),
+        "burstiness = (std - avg) / (std + avg)": ~has_std | np.isclose(p['burstiness_login_interval'], (std - avg) / (std + avg)),
+        "fano = var / avg": ~has_std | np.isclose(p['fano_factor_login_interval'], var / avg, rtol=5e-3),
+        "std, var, burstiness, fano -1 together": (has_std == (var != -1)) & (has_std == (p['burstiness_login_interval'] != -1)) & (has_std == (p['fano_factor_login_interval'] != -1)),
+        "avg -1 only with 1 login in 30d": (avg != -1) | (l30 == 1),
+        "std -1 only with <= 2 logins in 30d": has_std | (l30 <= 2),
+        "ewm -1 iff < 2 logins in 7d": (p['ewm_login_interval_7d'] == -1) == (l7 < 2),
+        "zscore -1 iff < 2 logins in 7d or std -1": (p['zscore_avg_login_interval_7d'] == -1) == ((l7 < 2) | ~has_std),
+        "ewm = the interval with 2 logins in 7d": ~(l7 == 2) | ~has_std | np.isclose(avg + p['zscore_avg_login_interval_7d'] * std, p['ewm_login_interval_7d']),
+        "distinct os / phones <= l30": (p['monthly_os_changes'] <= l30) & (p['monthly_phone_model_changes'] <= l30),
+    }
+    print(f"1. relations on patterns_cleaned.csv ({len(p)} rows):")
+    for name, ok in checks.items():
+        print(f"   {name:<48} {len(p) - int(np.sum(ok)):5d} rows break it")
+
+def synthetic_logins(customers: int, days: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Bursty logins: each customer has a daily rate drawn to match the file's
+    spread of logins_last_30_days, logs in in sessions of a few logins,
+    and now and then switches phone or OS.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2025-01-01").value / 1e9
+    frames = []
+    for cst in range(customers):
+        rate = rng.lognormal(0, 1)
+        sessions = rng.poisson(rate * days / 2)
+        times = np.sort(start + rng.random(sessions) * days * DAY)
+        times = np.repeat(times, rng.integers(1, 4, sessions))
+        times = np.sort(times + rng.random(len(times)) * 600)
+        switches = np.cumsum(rng.random(len(times)) < 0.02)
+        frames.append(pd.DataFrame({
+            'cst_dim_id': float(450_000_000 + cst),
+            'logindatetime': pd.to_datetime(times * 1e9),
+            'os': [OS_NAMES[(cst + s) % len(OS_NAMES)] for s in switches],
+            'phone_model': [PHONES[(cst + s // 2) % len(PHONES)] for s in switches],
+        }))
+    return pd.concat(frames, ignore_index=True).sort_values('logindatetime', kind='stable').reset_index(drop=True)
+
+def reference(logins: pd.DataFrame, as_of: pd.Timestamp) -> pd.DataFrame:
+    """
+    The same features straight from the definitions, customer by customer.
+    """
+    t = as_of.value / 1e9
+    rows = []
+    for cst, group in logins.groupby('cst_dim_id', sort=False):
+        times = group['logindatetime'].to_numpy('datetime64[ns]').astype(np.int64) / 1e9
+        past = times <= t
+        times, os_names, phones = times[past], group['os'].to_numpy()[past], group['phone_model'].to_numpy()[past]
+        in30, in7 = times > t - 30 * DAY, times > t - 7 * DAY
+        if not in30.any():
+            continue
+        intervals = np.diff(times, prepend=np.nan)
+        i30 = intervals[in30][~np.isnan(intervals[in30])]
+        i7 = np.diff(times[in7])
+        l7, l30 = int(in7.sum()), int(in30.sum())
+        avg = i30.mean() if len(i30) else -1.0
+        std = i30.std(ddof=1) if len(i30) >= 2 else -1.0
+        var = i30.var(ddof=1) if len(i30) >= 2 else -1.0
+        rows.append({
+            'transdate': as_of.normalize(), 'cst_dim_id': cst,
+            'monthly_os_changes': len(set(os_names[in30])), 'monthly_phone_model_changes': len(set(phones[in30])),
+            'last_phone_model_categorical': phones[-1], 'last_os_categorical': os_names[-1],
+            'logins_last_7_days': l7, 'logins_last_30_days': l30,
+            'login_frequency_7d': l7 / 7, 'login_frequency_30d': round(l30 / 30, 2),
+            'freq_change_7d_vs_mean': (l7 / 7) / (l30 / 30) - 1, 'logins_7d_over_30d_ratio': l7 / l30,
+            'avg_login_interval_30d': avg, 'std_login_interval_30d': std, 'var_login_interval_30d': var,
+            'ewm_login_interval_7d': pd.Series(i7).ewm(span=7).mean().iloc[-1] if len(i7) else -1.0,
+            'burstiness_login_interval': (std - avg) / (std + avg) if std != -1 else -1.0,
+            'fano_factor_login_interval': var / avg if std != -1 else -1.0,
+            'zscore_avg_login_interval_7d': (i7.mean() - avg) / std if len(i7) and std > 0 else -1.0,
+        })
+    return pd.DataFrame(rows, columns=list(PATTERN_COLUMNS))
+
+def check_parity(customers: int, days: int) -> pd.DataFrame:
+    logins = synthetic_logins(customers, days)
+    aggregator = LoginAggregator()
+    midnights = pd.date_range(logins['logindatetime'].min().normalize() + pd.Timedelta(days=1), logins['logindatetime'].max(), freq="D")
+    bounds = np.searchsorted(logins['logindatetime'].to_numpy(), midnights.to_numpy(), side="right")
+    worst = {}
+    fed = 0
+    snapshot = None
+    for as_of, bound in zip(midnights, bounds):
+        aggregator.ingest_frame(logins.iloc[fed:bound])
+        fed = bound
+        snapshot = aggregator.snapshot(as_of).sort_values('cst_dim_id', ignore_index=True)
+        expected = reference(logins.iloc[:bound], as_of).sort_values('cst_dim_id', ignore_index=True)
+        assert len(snapshot) == len(expected), (as_of, len(snapshot), len(expected))
+        for name in PATTERN_COLUMNS:
+            if snapshot[name].dtype == object or name == 'transdate':
+                assert (snapshot[name] == expected[name]).all(), (as_of, name)
+                continue
+            a, b = snapshot[name].to_numpy(np.float64), expected[name].to_numpy(np.float64)
+            worst[name] = max(worst.get(name, 0.0), float(np.max(np.abs(a - b) / np.maximum(1.0, np.abs(b)), initial=0.0)))
+    print(f"2. parity with the brute-force reference: {len(logins)} logins, {customers} customers, {len(midnights)} daily snapshots")
+    for name, error in worst.items():
+        print(f"   {name:<32} max relative error {error:.1e}")
+    if max(worst.values()) > 1e-6:
+        raise SystemExit("parity check failed")
+    return snapshot
+
+def check_serving(snapshot: pd.DataFrame):
+    result = validate_patterns_data(snapshot)
+    transactions = pd.DataFrame({
+        'cst_dim_id': snapshot['cst_dim_id'], 'transdate': snapshot['transdate'],
+        'transdatetime': "'2025-01-01 12:00:00.000'", 'amount': 100.0, 'docno': np.arange(len(snapshot)), 'direction': "x", 'target': 0,
+    })
+    merged, stats = join_transactions_patterns(transactions, build_patterns_index(snapshot))
+    print(f"3. serving: validate_patterns_data -> {result['status']}, {stats['matched']} of {len(transactions)} transactions joined")
+
+def throughput(events: int):
+    customers = max(1, events // 400)
+    rng = np.random.default_rng(1)
+    logins = pd.DataFrame({
+        'cst_dim_id': rng.integers(0, customers, events).astype(np.float64),
+        'logindatetime': pd.to_datetime(np.sort(rng.random(events)) * 120 * DAY * 1e9 + pd.Timestamp("2025-01-01").value),
+        'os': rng.choice(OS_NAMES, events),
+        'phone_model': rng.choice(PHONES, events),
+    })
+    aggregator = LoginAggregator()
+    start = time.perf_counter()
+    aggregator.ingest_frame(logins)
+    frame_s = time.perf_counter() - start
+
+    aggregator = LoginAggregator()
+    seconds = (logins['logindatetime'].astype(np.int64) / 1e9).tolist()
+    rows = list(zip(logins['cst_dim_id'].tolist(), seconds, logins['os'].tolist(), logins['phone_model'].tolist()))
+    start = time.perf_counter()
+    for row in rows:
+        aggregator.ingest(*row)
+    single_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    snapshot = aggregator.snapshot(logins['logindatetime'].max())
+    snapshot_s = time.perf_counter() - start
+    print(f"4. throughput on {events} logins over {customers} customers (120 days):")
+    print(f"   ingest_frame {events / frame_s:12,.0f} events/s")
+    print(f"   ingest       {events / single_s:12,.0f} events/s")
+    print(f"   snapshot     {snapshot_s * 1000:12.1f} ms for {len(snapshot)} customers")
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=300)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    args = parser.parse_args()
+    check_file()
+    check_serving(check_parity(args.customers, args.days))
+    throughput(args.events)
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,65 @@
+"""
+Memory report for the default and compact (COMPACT_FRAMES=1) frames.
+
+Usage:
+    python bench_memory.py [--model model.pkl]
+
+Prints bytes per row of each pipeline stage in both modes. When the model
+is available it also checks that compact predictions stay within
+--tolerance of the default ones and exits non-zero if they don't.
+"""
+import argparse
+import os
+import sys
+import numpy as np
+from helpers import read_csv_typed, validate_transaction_data, validate_patterns_data, compact_frame, merge_transaction_pattern_data, preprocess_merged_data
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def bytes_per_row(df) -> float:
+    return df.memory_usage(deep=True).sum() / max(len(df), 1)
+
+def run(compact: bool) -> dict:
+    with open(os.path.join(ROOT, "transactions_cleaned.csv"), "rb") as f:
+        transactions = read_csv_typed(f.read())
+    with open(os.path.join(ROOT, "patterns_cleaned.csv"), "rb") as f:
+        patterns = read_csv_typed(f.read())
+    validate_transaction_data(transactions)
+    validate_patterns_data(patterns)
+    if compact:
+        compact_frame(transactions)
+        compact_frame(patterns)
+    merged = merge_transaction_pattern_data(transactions=transactions, patterns=patterns)
+    features = preprocess_merged_data(merged)
+    if compact:
+        compact_frame(features, downcast_ints=True)
+    return {"transactions": transactions, "patterns": patterns, "merged": merged, "features": features}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="model.pkl")
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    default = run(compact=False)
+    compact = run(compact=True)
+    for stage in default:
+        before = bytes_per_row(default[stage])
+        after = bytes_per_row(compact[stage])
+        print(f"{stage:<13} {before:8.1f} B/row -> {after:8.1f} B/row  ({after / before:.0%})")
+
+    if not os.path.exists(args.model):
+        print(f"{args.model} not found, skipping prediction check")
+        return
+    import joblib
+    model = joblib.load(args.model)
+    drop = ['cst_dim_id', 'transdate', 'transdatetime', 'docno', 'target']
+    p_default = model.predict_proba(default["features"].drop(columns=drop, errors='ignore'))[:, 1]
+    p_compact = model.predict_proba(compact["features"].drop(columns=drop, errors='ignore'))[:, 1]
+    diff = float(np.abs(p_default - p_compact).max())
+    print(f"max |proba diff| = {diff:.2e}")
+    if diff > args.tolerance:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Checks and benchmarks scoring.threshold_sweep.
+
+Usage (from the directory holding model.pkl and preprocessor.json):
+    python bench_metrics.py [--rows 1000000] [--points 101] [--repeat 3] [--data-dir synth]
+
+1. Correctness on labels and probabilities with many ties: every point
+   of the curve against report_from_counts at that threshold, the best F1
+   against a brute-force scan of every distinct probability, PR-AUC and
+   ROC-AUC against sklearn's average_precision_score and roc_auc_score.
+2. Cost on --rows rows: threshold_sweep against one report at one
+   threshold, with report_from_counts and with sklearn's
+   classification_report (what /process used to call).
+3. /process end to end on --rows synthetic transactions (Parquet in and
+   out), with and without ?sweep=--points; the result cache is disabled.
+"""
+import argparse
+import time
+import numpy as np
+from fastapi.testclient import TestClient
+import main
+import result_cache
+import synth_data
+from bench_formats import encode
+from bench_pipeline import dataset, measure
+from scoring import threshold_sweep, confusion_counts, report_from_counts
+
+def labelled_scores(rows: int, seed: int = 0) -> tuple:
+    """
+    About 1% positives scoring higher on average, probabilities rounded to
+    3 decimals so that many rows tie.
+    """
+    rng = np.random.default_rng(seed)
+    y = rng.random(rows) < 0.01
+    p = np.clip(rng.normal(0.2, 0.15, rows) + y * 0.3, 0, 1).round(3).astype(np.float32)
+    return y.astype(np.int64), p
+
+def check_correctness(points: int):
+    from sklearn.metrics import average_precision_score, roc_auc_score
+    y, p = labelled_scores(100_000)
+    sweep = threshold_sweep(y, p, points)
+    # compared in float64 like target and the sweep; numpy would compare float32 with a float in float32
+    p = p.astype(np.float64)
+    worst = 0.0
+    for i, threshold in enumerate(sweep["thresholds"]):
+        report = report_from_counts(*confusion_counts(y, p > threshold))['1']
+        assert sweep["flagged"][i] == int((p > threshold).sum())
+        for name, key in (("precision", "precision"), ("recall", "recall"), ("f1", "f1-score")):
+            worst = max(worst, abs(sweep[name][i] - report[key]))
+    best = max(report_from_counts(*confusion_counts(y, p > t))['1']["f1-score"] for t in np.unique(np.concatenate(([-1.0], p))))
+    print(f"1. correctness on {len(y)} rows, {len(np.unique(p))} distinct probabilities:")
+    print(f"   curve vs report_from_counts at {len(sweep['thresholds'])} thresholds  max abs error {worst:.1e}")
+    print(f"   best F1 {sweep['best_f1']['f1']:.6f} at > {sweep['best_f1']['threshold']:.6f}  brute force {best:.6f}")
+    print(f"   PR-AUC  {sweep['pr_auc']:.12f}  sklearn {average_precision_score(y, p):.12f}")
+    print(f"   ROC-AUC {sweep['roc_auc']:.12f}  sklearn {roc_auc_score(y, p):.12f}")
+    assert worst < 1e-6 and abs(sweep['best_f1']['f1'] - best) < 1e-12
+    assert abs(sweep['pr_auc'] - average_precision_score(y, p)) < 1e-9 and abs(sweep['roc_auc'] - roc_auc_score(y, p)) < 1e-9
+    edge = threshold_sweep([0, 0], [0.1, 0.2], points)
+    assert edge["pr_auc"] is None and edge["roc_auc"] is None and edge["best_f1"]["f1"] == 0.0
+    assert threshold_sweep([], [], points)["best_f1"] is None
+
+def bench_cost(rows: int, points: int, repeat: int):
+    from sklearn.metrics import classification_report
+    y, p = labelled_scores(rows, seed=1)
+    predicted = (p > 0.3).astype(int)
+    _, sweep = measure(lambda: threshold_sweep(y, p, points), repeat)
+    _, counts = measure(lambda: report_from_counts(*confusion_counts(y, predicted)), repeat)
+    _, sklearn = measure(lambda: classification_report(y, predicted, output_dict=True, zero_division=0), repeat)
+    print(f"2. cost on {rows} rows:")
+    print(f"   threshold_sweep, {points} thresholds + AUCs  median={sweep['median_ms']:8.1f}ms")
+    print(f"   report_from_counts, 1 threshold          median={counts['median_ms']:8.1f}ms")
+    print(f"   classification_report, 1 threshold      median={sklearn['median_ms']:8.1f}ms")
+
+def bench_endpoint(args):
+    real = synth_data.load_real()
+    if args.patterns_ratio is None:
+        args.patterns_ratio = len(real["patterns"]) / len(real["transactions"])
+    paths = dataset(args, args.rows, real)
+    uploads = []
+    for name in ("transactions_path", "patterns_path"):
+        with open(paths[name], "rb") as f:
+            uploads.append(encode(f.read(), "parquet"))
+
+    result_cache.RESULT_CACHE_ENTRIES = 0
+    print(f"3. /process on {args.rows} transactions, Parquet in and out:")
+    with TestClient(main.app) as client:
+        while client.get("/ready").status_code != 200:
+            time.sleep(0.05)
+        for query in ("", f"&sweep={args.points}", f"&sweep={args.points}&probabilities=true"):
+            def send():
+                response = client.post(f"/process?format=parquet{query}", files={"file1": ("transactions", uploads[0]), "file2": ("patterns", uploads[1])})
+                response.raise_for_status()
+                return response
+            response, timing = measure(send, args.repeat)
+            print(f"   {query or '(no options)':<36} median={timing['median_ms']:8.1f}ms  min={timing['min_ms']:8.1f}ms  "
+                  f"X-Metrics {len(response.headers['X-Metrics']) / 1024:5.1f} KB  response {len(response.content) / 2 ** 20:5.1f} MB")
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--points", type=int, default=101)
+    parser.add_argument("--patterns-ratio", type=float, default=None, help="pattern rows per transaction; defaults to the real files'")
+    parser.add_argument("--hit-rate", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--data-dir", default="synth")
+    args = parser.parse_args()
+    check_correctness(args.points)
+    bench_cost(args.rows, args.points, args.repeat)
+    bench_endpoint(args)
+
+if __name__ == "__main__":
+    run()
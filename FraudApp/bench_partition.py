@@ -0,0 +1,70 @@
+"""
+Partitioned scoring benchmark: featurize+predict on a tiled input with
+score_frame in-process, then with score_partitioned on 1..N workers.
+
+Usage (from the directory holding model.pkl):
+    python bench_partition.py --rows 1000000 --workers 1 2 4 8
+
+Each worker count gets a fresh pool that is warmed up before timing, so
+model loading isn't counted. Every partitioned result is checked against
+the in-process one. The input partitions are also sent through a no-op
+task and back, a lower bound on the pickling and pipe cost the pool adds
+(the scored frames coming back are about twice the size of the input).
+"""
+import argparse
+import os
+import time
+import pandas as pd
+import scoring
+from helpers import read_csv_typed, validate_transaction_data, validate_patterns_data, build_patterns_index, join_transactions_patterns
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def echo(df: pd.DataFrame) -> pd.DataFrame:
+    return df
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "transactions_cleaned.csv"), "rb") as f:
+        transactions = read_csv_typed(f.read())
+    with open(os.path.join(ROOT, "patterns_cleaned.csv"), "rb") as f:
+        patterns = read_csv_typed(f.read())
+    validate_transaction_data(transactions)
+    validate_patterns_data(patterns)
+    repeats = -(-args.rows // len(transactions))
+    transactions = pd.concat([transactions] * repeats, ignore_index=True).iloc[:args.rows]
+    merged_df, _ = join_transactions_patterns(transactions, build_patterns_index(patterns))
+
+    version = scoring.load_model()
+    start = time.perf_counter()
+    expected = scoring.score_frame(merged_df, version)
+    baseline = time.perf_counter() - start
+    print(f"in-process: {baseline:.2f}s ({len(merged_df) / baseline:,.0f} rows/s)")
+
+    for workers in sorted(set(args.workers)):
+        scoring.shutdown_partition_pool()
+        scoring.PARTITION_WORKERS = workers
+        scoring.score_partitioned(merged_df.iloc[:1000], version)
+        start = time.perf_counter()
+        scored = scoring.score_partitioned(merged_df, version)
+        elapsed = time.perf_counter() - start
+        pd.testing.assert_frame_equal(scored, expected)
+
+        buckets = pd.util.hash_array(merged_df['cst_dim_id'].to_numpy()) % workers
+        start = time.perf_counter()
+        pool = scoring.partition_pool()
+        futures = [pool.submit(echo, merged_df[buckets == bucket]) for bucket in range(workers)]
+        [future.result() for future in futures]
+        round_trip = time.perf_counter() - start
+        print(
+            f"workers={workers}: {elapsed:.2f}s ({len(merged_df) / elapsed:,.0f} rows/s), "
+            f"speedup {baseline / elapsed:.2f}x, no-op round trip {round_trip:.2f}s"
+        )
+    scoring.shutdown_partition_pool()
+
+if __name__ == "__main__":
+    main()
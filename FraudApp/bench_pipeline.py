@@ -0,0 +1,198 @@
+"""
+Benchmark of the whole fraud pipeline on synthetic data (see synth_data.py):
+each helpers.py stage on its own, then /process end to end through
+FastAPI's TestClient. Results go to a JSON file, so two commits can be
+compared.
+
+Usage (from the directory holding model.pkl and preprocessor.json):
+    python bench_pipeline.py --rows 10000 100000 1000000 [--repeat 3] [--out results.json]
+    python bench_pipeline.py --rows 10000 100000 --compare bench_results/abc1234.json
+
+Generated files are kept in --data-dir and reused by later runs with the
+same sizes, hit rate and seed. Each stage is run --repeat times on the
+same input; the median and the minimum are recorded. --compare prints
+each stage's median against the baseline file and exits with status 1
+if any is slower by more than --tolerance (and --min-delta-ms). The result cache is disabled,
+so every /process call scores.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+import main
+import result_cache
+import scoring
+import synth_data
+from scoring import confusion_counts, report_from_counts
+from main import render_json
+from helpers import read_csv_typed, validate_transaction_data, validate_patterns_data, build_patterns_index, join_transactions_patterns, preprocess_merged_data
+
+def git_commit() -> dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+def machine() -> dict:
+    import catboost
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "catboost": catboost.__version__,
+    }
+
+def measure(func, repeat: int) -> tuple:
+    """
+    Runs func repeat times and returns its last result with the median and
+    minimum wall time in milliseconds.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, {"median_ms": float(np.median(times)), "min_ms": float(min(times))}
+
+def dataset(args, rows: int, real: dict) -> dict:
+    patterns = max(1, round(rows * args.patterns_ratio))
+    hit_rate = real["hit_rate"] if args.hit_rate is None else args.hit_rate
+    out_dir = os.path.join(args.data_dir, f"{rows}-{patterns}-{hit_rate:.4f}-{args.seed}")
+    paths = {"transactions_path": os.path.join(out_dir, "transactions.csv"), "patterns_path": os.path.join(out_dir, "patterns.csv")}
+    if not all(os.path.exists(path) for path in paths.values()):
+        start = time.perf_counter()
+        synth_data.generate(rows, patterns, out_dir, hit_rate, args.seed, real)
+        print(f"generated {rows} transactions and ~{patterns} pattern rows in {time.perf_counter() - start:.1f}s")
+    return paths
+
+def bench_stages(transactions: bytes, patterns: bytes, version, repeat: int) -> dict:
+    stages = {}
+    df1, stages["read_transactions"] = measure(lambda: read_csv_typed(transactions), repeat)
+    df2, stages["read_patterns"] = measure(lambda: read_csv_typed(patterns), repeat)
+    _, stages["validate_transactions"] = measure(lambda: validate_transaction_data(df1), repeat)
+    _, stages["validate_patterns"] = measure(lambda: validate_patterns_data(df2), repeat)
+    index, stages["build_patterns_index"] = measure(lambda: build_patterns_index(df2), repeat)
+    (merged, _), stages["join"] = measure(lambda: join_transactions_patterns(df1, index), repeat)
+    if version.preprocessor is not None:
+        features, stages["featurize"] = measure(lambda: version.preprocessor.transform(merged), repeat)
+    else:
+        features, stages["featurize"] = measure(lambda: preprocess_merged_data(merged), repeat)
+    X = features.drop(columns=['cst_dim_id', 'transdate', 'transdatetime', 'docno', 'target'], errors='ignore')
+    proba, stages["predict"] = measure(lambda: version.model.predict_proba(X)[:, 1], repeat)
+    del X
+    predicted = (proba > version.threshold).astype(int)
+    _, stages["metrics"] = measure(lambda: report_from_counts(*confusion_counts(features['target'], predicted)), repeat)
+    scored = features.rename(columns={'target': "expected_target"})
+    scored['target'] = predicted
+    records, stages["to_records"] = measure(lambda: scored.to_dict(orient='records'), repeat)
+    _, stages["render_json"] = measure(lambda: render_json({"predictions": records, "metrics": {}}), repeat)
+    return stages
+
+def bench_endpoint(client: TestClient, transactions: bytes, patterns: bytes, formats: list, repeat: int) -> dict:
+    stages = {}
+    for fmt in formats:
+        def send():
+            response = client.post(f"/process?format={fmt}", files={
+                "file1": ("transactions.csv", transactions), "file2": ("patterns.csv", patterns),
+            })
+            response.raise_for_status()
+            return len(response.content)
+        _, stages[f"process_{fmt}"] = measure(send, repeat)
+    return stages
+
+def compare(results: dict, baseline_path: str, tolerance: float, min_delta_ms: float) -> bool:
+    """
+    Prints each stage's median next to the baseline's. Returns whether any
+    stage got slower by more than tolerance and min_delta_ms both; the
+    absolute floor keeps sub-millisecond stages from flagging on noise.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\ncompared with {baseline['commit']} ({baseline_path}):")
+    regressed = False
+    for rows, entry in results["results"].items():
+        old = baseline["results"].get(rows)
+        if old is None:
+            continue
+        for stage, timing in entry["stages"].items():
+            if stage not in old["stages"]:
+                continue
+            ratio = timing["median_ms"] / old["stages"][stage]["median_ms"]
+            flag = ""
+            if ratio > 1 + tolerance and timing["median_ms"] - old["stages"][stage]["median_ms"] > min_delta_ms:
+                flag = "  REGRESSION"
+                regressed = True
+            print(f"rows={rows:>9}  {stage:<22} {old['stages'][stage]['median_ms']:10.1f}ms -> {timing['median_ms']:10.1f}ms  x{ratio:.2f}{flag}")
+    return regressed
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--patterns-ratio", type=float, default=None, help="pattern rows per transaction; defaults to the real files'")
+    parser.add_argument("--hit-rate", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--formats", nargs="*", default=["json", "ndjson"], help="/process response modes to time; none skips the endpoint")
+    parser.add_argument("--data-dir", default="synth")
+    parser.add_argument("--out", default=None, help="defaults to bench_results/<commit>.json")
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument("--min-delta-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    real = synth_data.load_real()
+    if args.patterns_ratio is None:
+        args.patterns_ratio = len(real["patterns"]) / len(real["transactions"])
+    version = scoring.load_model()
+    results = {
+        **git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "machine": machine(),
+        "params": {"patterns_ratio": args.patterns_ratio, "hit_rate": args.hit_rate, "seed": args.seed, "repeat": args.repeat},
+        "results": {},
+    }
+
+    result_cache.RESULT_CACHE_ENTRIES = 0
+    # one client for every size: leaving it runs the app's shutdown, which stops the executor
+    with TestClient(main.app) as client:
+        while client.get("/ready").status_code != 200:
+            time.sleep(0.05)
+        for rows in args.rows:
+            paths = dataset(args, rows, real)
+            with open(paths["transactions_path"], "rb") as f:
+                transactions = f.read()
+            with open(paths["patterns_path"], "rb") as f:
+                patterns = f.read()
+            stages = bench_stages(transactions, patterns, version, args.repeat)
+            if args.formats:
+                stages.update(bench_endpoint(client, transactions, patterns, args.formats, args.repeat))
+            for timing in stages.values():
+                timing["rows_per_s"] = rows / timing["median_ms"] * 1000
+            results["results"][str(rows)] = {"transactions_bytes": len(transactions), "patterns_bytes": len(patterns), "stages": stages}
+            for stage, timing in stages.items():
+                print(f"rows={rows:>9}  {stage:<22} median={timing['median_ms']:10.1f}ms  min={timing['min_ms']:10.1f}ms  rows/s={timing['rows_per_s']:,.0f}")
+
+    out = args.out or os.path.join("bench_results", f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"wrote {out}")
+
+    if args.compare and compare(results, args.compare, args.tolerance, args.min_delta_ms):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,150 @@
+"""
+Hot-reload check: /score and /process traffic from several threads while
+the active model version is switched back and forth through POST /models.
+
+Usage (from the directory holding the models directory with model.cbm
+and preprocessor.json, and a loaded patterns store):
+    MODEL_ADMIN_TOKEN=... python bench_reload.py [--model-b models/model.cbm] [--threshold-b 0.0001] [--seconds 20]
+
+The two versions differ in threshold (the model's probabilities are far
+apart, hence the tiny default), so their decisions differ. Every
+response must be a 200 whose decisions are exactly those of the version
+it reports, computed up front; any mix of the two within one response is
+a failure. Reports how many requests ran, how many swaps happened
+meanwhile, and the latency under reloads.
+"""
+import argparse
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+import main
+import model_registry
+import scoring
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def sample(path: str, rows: int) -> bytes:
+    with open(path, "rb") as f:
+        lines = f.readlines()
+    return lines[0] + b"".join(lines[1:1 + rows])
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-a", default=os.path.join(model_registry.MODELS_DIR, "model.cbm"))
+    parser.add_argument("--model-b", default=os.path.join(model_registry.MODELS_DIR, "model.cbm"))
+    parser.add_argument("--preprocessor", default=os.path.join(model_registry.MODELS_DIR, "preprocessor.json"))
+    parser.add_argument("--threshold-b", type=float, default=0.0001)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--swap-interval", type=float, default=0.5)
+    args = parser.parse_args()
+
+    specs = [
+        model_registry.make_spec("a", args.model_a, args.preprocessor),
+        model_registry.make_spec("b", args.model_b, args.preprocessor, args.threshold_b),
+    ]
+    transactions = sample(os.path.join(ROOT, "transactions_cleaned.csv"), args.rows)
+    with open(os.path.join(ROOT, "patterns_cleaned.csv"), "rb") as f:
+        patterns = f.read()
+    frame = pd.read_csv(os.path.join(ROOT, "transactions_cleaned.csv"), encoding='cp1251', nrows=args.rows)
+    records = [
+        {
+            "cst_dim_id": row.cst_dim_id,
+            "transdatetime": row.transdatetime.strip("'"),
+            "transdate": None,
+            "amount": row.amount,
+            "docno": int(row.docno),
+            "direction": row.direction,
+        }
+        for row in frame.itertuples()
+    ]
+    # the /score batch leads with transactions the two versions decide differently
+    decided = [{r["docno"]: r["target"] for r in scoring.score_transactions(records, spec)["results"]} for spec in specs]
+    differing = [r for r in records if r["docno"] in decided[0] and decided[0][r["docno"]] != decided[1][r["docno"]]]
+    records = (differing + records)[:args.batch]
+
+    expected_score = {}
+    expected_process = {}
+    for spec in specs:
+        expected_score[spec["version"]] = [r["target"] for r in scoring.score_transactions(records, spec)["results"]]
+        expected_process[spec["version"]] = [p["target"] for p in scoring.process_uploads(transactions, patterns, spec)["predictions"]]
+    for kind, expected in (("/score", expected_score), ("/process", expected_process)):
+        if expected["a"] == expected["b"]:
+            raise SystemExit(f"versions a and b make the same {kind} decisions, pick another --threshold-b")
+
+    counts = {"/score": 0, "/process": 0, "swaps": 0}
+    failures = []
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    with TestClient(main.app) as client:
+        while client.get("/ready").status_code != 200:
+            time.sleep(0.05)
+
+        def traffic(n: int):
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                if n % 2:
+                    response = client.post("/score", json=records)
+                    kind = "/score"
+                else:
+                    response = client.post("/process", files={
+                        "file1": ("transactions.csv", transactions), "file2": ("patterns.csv", patterns),
+                    })
+                    kind = "/process"
+                elapsed = time.perf_counter() - start
+                with lock:
+                    counts[kind] += 1
+                    latencies.append(elapsed)
+                    if response.status_code != 200:
+                        failures.append(f"{kind}: HTTP {response.status_code} {response.text[:200]}")
+                        continue
+                    body = response.json()
+                    if kind == "/score":
+                        version, decisions, expected = body["model"], [r["target"] for r in body["results"]], expected_score
+                    else:
+                        version, decisions, expected = body["metrics"]["model"]["version"], [p["target"] for p in body["predictions"]], expected_process
+                    if decisions != expected[version]:
+                        failures.append(f"{kind}: decisions don't match version {version}")
+
+        def swaps():
+            i = 0
+            while time.perf_counter() < deadline:
+                spec = specs[i % 2]
+                response = client.post("/models", json={
+                    "version": spec["version"], "model_path": spec["model_path"],
+                    "preprocessor_path": spec["preprocessor_path"], "threshold": spec["threshold"],
+                }, headers={"X-Admin-Token": main.MODEL_ADMIN_TOKEN or ""})
+                if response.status_code != 200 or response.json()["active"]["version"] != spec["version"]:
+                    failures.append(f"publish {spec['version']}: {response.text[:200]}")
+                counts["swaps"] += 1
+                i += 1
+                time.sleep(args.swap_interval)
+
+        threads = [threading.Thread(target=traffic, args=(n,)) for n in range(args.threads)]
+        threads.append(threading.Thread(target=swaps))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = client.get("/models").json()["versions"]
+
+    os.remove(model_registry.MODEL_REGISTRY_PATH)
+    print(
+        f"{counts['/score']} /score and {counts['/process']} /process requests during {counts['swaps']} swaps, "
+        f"p50={np.percentile(latencies, 50) * 1000:.1f}ms  p99={np.percentile(latencies, 99) * 1000:.1f}ms"
+    )
+    print({version: kinds["requests"]["count"] for version, kinds in stats.items()})
+    if failures:
+        print("\n".join(failures[:20]))
+        raise SystemExit(f"{len(failures)} failures")
+    print("every response matched the version it reported")
+
+if __name__ == "__main__":
+    run()
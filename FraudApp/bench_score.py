@@ -0,0 +1,64 @@
+"""
+Latency benchmark for /score.
+
+Usage (from the directory holding model.pkl, preprocessor.json and a
+loaded patterns store):
+    python bench_score.py --requests 1000 --batch 1
+
+Reports p50/p99 of scoring.score_transactions alone and of the full HTTP
+round trip through FastAPI's TestClient.
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+import main
+import scoring
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def percentiles(times: list) -> str:
+    return f"p50={np.percentile(times, 50) * 1000:.2f}ms  p99={np.percentile(times, 99) * 1000:.2f}ms"
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=1)
+    args = parser.parse_args()
+
+    transactions = pd.read_csv(os.path.join(ROOT, "transactions_cleaned.csv"), encoding='cp1251', nrows=args.requests * args.batch)
+    records = [
+        {
+            "cst_dim_id": row.cst_dim_id,
+            "transdatetime": row.transdatetime.strip("'"),
+            "transdate": None,
+            "amount": row.amount,
+            "docno": int(row.docno),
+            "direction": row.direction,
+        }
+        for row in transactions.itertuples()
+    ]
+    batches = [records[i:i + args.batch] for i in range(0, len(records), args.batch)]
+
+    scoring.score_transactions(batches[0])
+    times = []
+    for batch in batches:
+        start = time.perf_counter()
+        scoring.score_transactions(batch)
+        times.append(time.perf_counter() - start)
+    print(f"score_transactions, batch={args.batch}: {percentiles(times)}")
+
+    times = []
+    with TestClient(main.app) as client:
+        while client.get("/ready").status_code != 200:
+            time.sleep(0.05)
+        for batch in batches:
+            start = time.perf_counter()
+            client.post("/score", json=batch)
+            times.append(time.perf_counter() - start)
+    print(f"POST /score via TestClient, batch={args.batch}: {percentiles(times)}")
+
+if __name__ == "__main__":
+    run()
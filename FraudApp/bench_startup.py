@@ -0,0 +1,80 @@
+"""
+Startup benchmark: time from launching uvicorn until the service is ready,
+and the latency of the first and second /process requests.
+
+Usage (from the directory holding model.pkl):
+    python bench_startup.py [--app-dir /path/to/FraudApp] [--rows 100] [--runs 3]
+
+Readiness is the first 200 from /ready; servers without that endpoint are
+considered ready on the first HTTP response of any kind.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import httpx
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def sample(path: str, rows: int, skip: int = 0) -> bytes:
+    with open(path, "rb") as f:
+        lines = f.readlines()
+    return lines[0] + b"".join(lines[1 + skip:1 + skip + rows])
+
+def run_once(args, requests: list) -> tuple:
+    env = {**os.environ, "PYTHONPATH": args.app_dir}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", args.app_dir, "--port", str(args.port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        with httpx.Client(timeout=60) as client:
+            while True:
+                try:
+                    response = client.get(url + "/ready")
+                    if response.status_code in (200, 404):
+                        break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+            ready = time.perf_counter() - start
+
+            latencies = []
+            # different bodies, so the second request isn't a result cache hit
+            for files in requests:
+                request_start = time.perf_counter()
+                response = client.post(url + "/process", files=files)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - request_start)
+        return ready, latencies[0], latencies[1]
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--app-dir", default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "patterns_cleaned.csv"), "rb") as f:
+        patterns = f.read()
+    requests = [
+        {
+            "file1": ("transactions.csv", sample(os.path.join(ROOT, "transactions_cleaned.csv"), args.rows, skip)),
+            "file2": ("patterns.csv", patterns),
+        }
+        for skip in (0, args.rows)
+    ]
+    results = np.array([run_once(args, requests) for _ in range(args.runs)])
+    ready, first, second = np.median(results, axis=0) * 1000
+    print(f"median of {args.runs}: ready={ready:.0f}ms  first /process={first:.1f}ms  second /process={second:.1f}ms")
+
+if __name__ == "__main__":
+    main()
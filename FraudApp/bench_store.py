@@ -0,0 +1,72 @@
+"""
+Patterns store benchmark: cold-start load time and per-request lookup
+latency, compared with parsing and indexing patterns_cleaned.csv on every
+request as /process does when file2 is uploaded.
+
+Usage:
+    python bench_store.py [--scale 10] [--path /tmp/patterns_store.parquet]
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import patterns_store
+from helpers import read_csv_typed, validate_transaction_data, validate_patterns_data, build_patterns_index, join_transactions_patterns
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def timed(fn, repeat: int) -> list:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=int, default=1, help="repeat patterns with shifted ids to grow the store")
+    parser.add_argument("--path", default="/tmp/patterns_store.parquet")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "patterns_cleaned.csv"), "rb") as f:
+        patterns_csv = f.read()
+    with open(os.path.join(ROOT, "transactions_cleaned.csv"), "rb") as f:
+        transactions = read_csv_typed(f.read())
+    validate_transaction_data(transactions)
+    patterns = read_csv_typed(patterns_csv)
+    validate_patterns_data(patterns)
+    if args.scale > 1:
+        shifted = [patterns.assign(cst_dim_id=patterns['cst_dim_id'] + i * 10 ** 10) for i in range(args.scale)]
+        patterns = pd.concat(shifted, ignore_index=True)
+
+    if os.path.exists(args.path):
+        os.remove(args.path)
+    start = time.perf_counter()
+    patterns_store.upsert_patterns(patterns, replace=True, path=args.path)
+    print(f"initial load of {len(patterns)} rows: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    patterns_store._loaded_mtime = None
+    start = time.perf_counter()
+    patterns_store.get_patterns_index(args.path)
+    print(f"cold start from parquet: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    def per_request_csv():
+        df = read_csv_typed(patterns_csv)
+        validate_patterns_data(df)
+        join_transactions_patterns(transactions, build_patterns_index(df))
+
+    single = transactions.iloc[:1]
+    cases = [
+        ("csv patterns per request, 13k txns", per_request_csv),
+        ("store lookup, 13k txns", lambda: join_transactions_patterns(transactions, patterns_store.get_patterns_index(args.path))),
+        ("store lookup, 1 txn", lambda: join_transactions_patterns(single, patterns_store.get_patterns_index(args.path))),
+    ]
+    for label, fn in cases:
+        times = timed(fn, args.repeat)
+        print(f"{label:<38} p50={np.percentile(times, 50):7.2f}ms  p99={np.percentile(times, 99):7.2f}ms")
+
+if __name__ == "__main__":
+    main()
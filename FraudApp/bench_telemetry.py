@@ -0,0 +1,78 @@
+"""
+Overhead of the stage timers and /metrics histograms (see telemetry.py):
+/score and /process latency with STAGE_TIMING on and off.
+
+Usage (from the directory holding model.pkl, preprocessor.json and a
+loaded patterns store):
+    python bench_telemetry.py [--requests 500] [--rows 1000]
+
+On and off alternate request by request, so drift in machine load hits
+both sides equally. The result cache is disabled so every /process
+request is scored.
+"""
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+import main
+import result_cache
+import telemetry
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def percentiles(times: list) -> str:
+    return f"p50={np.percentile(times, 50) * 1000:.3f}ms  p99={np.percentile(times, 99) * 1000:.3f}ms"
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    frame = pd.read_csv(os.path.join(ROOT, "transactions_cleaned.csv"), encoding='cp1251', nrows=1)
+    record = {
+        "cst_dim_id": frame.cst_dim_id[0],
+        "transdatetime": frame.transdatetime[0].strip("'"),
+        "transdate": None,
+        "amount": frame.amount[0],
+        "docno": int(frame.docno[0]),
+        "direction": frame.direction[0],
+    }
+    with open(os.path.join(ROOT, "transactions_cleaned.csv"), "rb") as f:
+        lines = f.readlines()
+    transactions = lines[0] + b"".join(lines[1:1 + args.rows])
+    with open(os.path.join(ROOT, "patterns_cleaned.csv"), "rb") as f:
+        patterns = f.read()
+    result_cache.RESULT_CACHE_ENTRIES = 0
+
+    requests = {
+        "/score": lambda client: client.post("/score", json=[record]),
+        "/process": lambda client: client.post("/process", files={
+            "file1": ("transactions.csv", transactions), "file2": ("patterns.csv", patterns),
+        }),
+    }
+    with TestClient(main.app) as client:
+        while client.get("/ready").status_code != 200:
+            time.sleep(0.05)
+        for endpoint, send in requests.items():
+            times = {True: [], False: []}
+            for i in range(args.requests * 2 + 20):
+                enabled = i % 2 == 0
+                telemetry.STAGE_TIMING = enabled
+                start = time.perf_counter()
+                send(client).raise_for_status()
+                # the first requests only warm up
+                if i >= 20:
+                    times[enabled].append(time.perf_counter() - start)
+            on, off = np.median(times[True]), np.median(times[False])
+            print(f"{endpoint} timing off: {percentiles(times[False])}")
+            print(f"{endpoint} timing on:  {percentiles(times[True])}  median overhead {(on - off) * 1e6:.0f}us ({(on - off) / off:+.1%})")
+        telemetry.STAGE_TIMING = True
+        start = time.perf_counter()
+        client.get("/metrics")
+        print(f"GET /metrics: {(time.perf_counter() - start) * 1000:.2f}ms")
+
+if __name__ == "__main__":
+    run()
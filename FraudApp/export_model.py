@@ -0,0 +1,41 @@
+"""
+Converts the pickled CatBoost model to CatBoost's native .cbm format, which the
+model registry loads without unpickling. Point MODEL_PATH at the
+result to use it.
+
+Usage:
+    python export_model.py [--model model.pkl] [--out model.cbm]
+
+The exported model must give the same probabilities as the pickled one on
+the bundled warm-up sample.
+"""
+import argparse
+import json
+import joblib
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier
+from scoring import MODEL_PATH, WARMUP_SAMPLE_PATH
+from helpers import preprocess_merged_data
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--out", default="model.cbm")
+    args = parser.parse_args()
+
+    model = joblib.load(args.model)
+    if not isinstance(model, CatBoostClassifier):
+        raise SystemExit(f"{args.model} holds a {type(model).__name__}, only CatBoostClassifier can be exported")
+    model.save_model(args.out, format="cbm")
+
+    exported = CatBoostClassifier()
+    exported.load_model(args.out)
+    with open(WARMUP_SAMPLE_PATH) as f:
+        features = preprocess_merged_data(pd.DataFrame.from_records(json.load(f)))
+    features = features.drop(columns=['cst_dim_id', 'docno'])
+    np.testing.assert_array_equal(model.predict_proba(features), exported.predict_proba(features))
+    print(f"wrote {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Fits the FeaturePreprocessor on reference data and saves it next to the
+model, where /process and /score pick it up.
+
+Usage:
+    python fit_preprocessor.py ../transactions_cleaned.csv ../patterns_cleaned.csv [--out preprocessor.json]
+
+Before saving, the reference data is transformed whole and in chunks of
+--chunk-rows rows; the two results must be identical.
+"""
+import argparse
+import pandas as pd
+from helpers import read_csv_typed, validate_transaction_data, validate_patterns_data, merge_transaction_pattern_data, FeaturePreprocessor
+from scoring import PREPROCESSOR_PATH
+
+def check_chunked(preprocessor: FeaturePreprocessor, merged_df: pd.DataFrame, chunk_rows: int):
+    whole = preprocessor.transform(merged_df)
+    chunks = [preprocessor.transform(merged_df.iloc[start:start + chunk_rows]) for start in range(0, len(merged_df), chunk_rows)]
+    pd.testing.assert_frame_equal(whole, pd.concat(chunks), check_exact=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("transactions")
+    parser.add_argument("patterns")
+    parser.add_argument("--out", default=PREPROCESSOR_PATH)
+    parser.add_argument("--chunk-rows", type=int, default=1000)
+    args = parser.parse_args()
+
+    with open(args.transactions, "rb") as f:
+        transactions = read_csv_typed(f.read())
+    with open(args.patterns, "rb") as f:
+        patterns = read_csv_typed(f.read())
+    for result in (validate_transaction_data(transactions), validate_patterns_data(patterns)):
+        if result["status"] == "error":
+            raise SystemExit(result["message"])
+
+    merged_df = merge_transaction_pattern_data(transactions=transactions, patterns=patterns)
+    preprocessor = FeaturePreprocessor().fit(merged_df)
+    check_chunked(preprocessor, merged_df, args.chunk_rows)
+    preprocessor.save(args.out)
+    print(f"wrote {args.out}: {preprocessor.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,76 @@
+from io import BytesIO
 from fastapi import UploadFile
+import json
+import logging
+import numpy as np
 import pandas as pd
 
+# validation notes; they fire on every request, so only at debug level
+logger = logging.getLogger(__name__)
+
 FLOAT_DTYPES = ['cst_dim_id', 'login_frequency_7d', 'login_frequency_30d', 'freq_change_7d_vs_mean',
                     'logins_7d_over_30d_ratio', 'avg_login_interval_30d', 'std_login_interval_30d',
                     'var_login_interval_30d', 'ewm_login_interval_7d', 'burstiness_login_interval',
                     'fano_factor_login_interval', 'zscore_avg_login_interval_7d']
 
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# parsed by read_csv_typed after reading, since they may be quoted
+DATE_COLUMNS = ['transdate']
+
+TRANSACTION_COLUMNS = {
+    'cst_dim_id': 'float64',
+    'transdate': 'datetime64[ns]',
+    'transdatetime': object,
+    'amount': 'float64',
+    'docno': 'int64',
+    'direction': object,
+    'target': 'int64'
+}
+
+# logins_last_7_days;logins_last_30_days;login_frequency_7d;login_frequency_30d;freq_change_7d_vs_mean;logins_7d_over_30d_ratio;avg_login_interval_30d;std_login_interval_30d;var_login_interval_30d;ewm_login_interval_7d;burstiness_login_interval;fano_factor_login_interval;zscore_avg_login_interval_7d
+PATTERN_COLUMNS = {
+    'transdate': 'datetime64[ns]',
+    'cst_dim_id': 'float64',
+    'monthly_os_changes': 'int64',
+    'monthly_phone_model_changes': 'int64',
+    'last_phone_model_categorical': object,
+    'last_os_categorical': object,
+    'logins_last_7_days': 'int64',
+    'logins_last_30_days': 'int64',
+    'login_frequency_7d': 'float64',
+    'login_frequency_30d': 'float64',
+    'freq_change_7d_vs_mean': 'float64',
+    'logins_7d_over_30d_ratio': 'float64',
+    'avg_login_interval_30d': 'float64',
+    'std_login_interval_30d': 'float64',
+    'var_login_interval_30d': 'float64',
+    'ewm_login_interval_7d': 'float64',
+    'burstiness_login_interval': 'float64',
+    'fano_factor_login_interval': 'float64',
+    'zscore_avg_login_interval_7d': 'float64'
+}
+
+# low bits of the packed join key, holding days since epoch
+JOIN_DAY_BITS = 20
+# largest customer id that fits in the bits above them
+JOIN_MAX_ID = 2 ** (63 - JOIN_DAY_BITS) - 1
+
+# string columns stored as pandas categoricals by compact_frame
+CATEGORICAL_COLUMNS = ['direction', 'last_phone_model_categorical', 'last_os_categorical', 'part_of_day']
+
+try:
+    import pyarrow
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    pyarrow = None
+    CSV_ENGINE = 'c'
+
+# magic bytes at the start of binary uploads; anything else is read as CSV
+PARQUET_MAGIC = b"PAR1"
+ARROW_FILE_MAGIC = b"ARROW1"
+# Arrow IPC streams start with a continuation marker
+ARROW_STREAM_MAGIC = b"\xff\xff\xff\xff"
+
 def identify_separator(file: UploadFile) -> str:
     """
     Identifies the separator used in a CSV file by reading the first line.
@@ -23,6 +88,238 @@ def identify_separator(file: UploadFile) -> str:
     file.seek(0) 
     return identified_separator
 
+def pick_schema(names: list) -> dict:
+    """
+    Returns TRANSACTION_COLUMNS or PATTERN_COLUMNS, whichever shares more
+    column names with names.
+    """
+    pattern_hits = len(PATTERN_COLUMNS.keys() & set(names))
+    transaction_hits = len(TRANSACTION_COLUMNS.keys() & set(names))
+    return PATTERN_COLUMNS if pattern_hits > transaction_hits else TRANSACTION_COLUMNS
+
+def csv_schema(head: bytes) -> tuple:
+    """
+    Works out how to read a CSV from its first line: the separator, which
+    schema it follows (transactions or patterns, whichever shares more
+    column names with the header) and the matching usecols and dtype
+    arguments for read_csv.
+
+    Parameters:
+    head (bytes): The start of the raw cp1251-encoded file, at least its first line.
+
+    Returns:
+    tuple: (sep, schema, usecols, dtype).
+    """
+    sep = identify_separator(BytesIO(head))
+    header = head.split(b'\n', 1)[0].decode('cp1251').strip().split(sep)
+    header = [name.strip().strip('"') for name in header]
+    schema = pick_schema(header)
+
+    usecols = [name for name in header if name in schema] or None
+    dtype = {name: schema[name] for name in usecols or [] if name not in DATE_COLUMNS}
+    return sep, schema, usecols, dtype
+
+def parse_date_columns(df: pd.DataFrame) -> pd.DataFrame:
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            try:
+                df[column] = parse_datetime(df[column])
+            except (ValueError, TypeError):
+                pass
+    return df
+
+def read_csv_typed(content: bytes) -> pd.DataFrame:
+    """
+    Reads an uploaded CSV with the schema of whichever file it looks like
+    (see csv_schema). dtypes and usecols are passed to the reader up front
+    so pandas does no type inference, and the pyarrow engine is used when
+    installed.
+
+    Falls back to an untyped read if the typed one fails (e.g. missing
+    values in an int column), leaving validate_*_data to report the problem.
+
+    Parameters:
+    content (bytes): The raw cp1251-encoded file body.
+
+    Returns:
+    pd.DataFrame: The parsed data with DATE_COLUMNS already converted.
+    """
+    sep, _, usecols, dtype = csv_schema(content[:65536])
+    try:
+        df = pd.read_csv(BytesIO(content), sep=sep, encoding='cp1251', engine=CSV_ENGINE, usecols=usecols, dtype=dtype)
+    except (ValueError, TypeError):
+        df = pd.read_csv(BytesIO(content), sep=sep, encoding='cp1251')
+    return parse_date_columns(df)
+
+def iter_csv_typed(path: str, chunk_rows: int):
+    """
+    Reads a CSV file from disk chunk_rows rows at a time with the same typed
+    options as read_csv_typed. Uses the C engine, which supports chunking.
+
+    Like read_csv_typed, falls back to an untyped read if a chunk fails to
+    read typed, and goes on from that chunk, so validate_*_data reports the
+    problem instead of the reader raising.
+
+    Yields:
+    pd.DataFrame: Consecutive chunks with DATE_COLUMNS already converted.
+    """
+    with open(path, "rb") as f:
+        head = f.readline()
+    sep, _, usecols, dtype = csv_schema(head)
+    done = 0
+    try:
+        for chunk in pd.read_csv(path, sep=sep, encoding='cp1251', usecols=usecols, dtype=dtype, chunksize=chunk_rows):
+            yield parse_date_columns(chunk)
+            done += 1
+    except (ValueError, TypeError):
+        for i, chunk in enumerate(pd.read_csv(path, sep=sep, encoding='cp1251', chunksize=chunk_rows)):
+            if i >= done:
+                yield parse_date_columns(chunk)
+
+def upload_format(head: bytes) -> str:
+    """
+    Tells an upload's format from its first bytes: "parquet", "arrow" (an
+    Arrow IPC file, which includes Feather v2), "arrow_stream" or "csv".
+    """
+    if head[:4] == PARQUET_MAGIC:
+        return "parquet"
+    if head[:6] == ARROW_FILE_MAGIC:
+        return "arrow"
+    if head[:4] == ARROW_STREAM_MAGIC:
+        return "arrow_stream"
+    return "csv"
+
+def arrow_reader(source, fmt: str):
+    """
+    Opens a Parquet or Arrow IPC upload without reading its data.
+
+    Parameters:
+    source: The body as bytes, a path (memory-mapped) or a seekable file object.
+    fmt (str): As returned by upload_format.
+
+    Returns:
+    A pyarrow ParquetFile, RecordBatchFileReader or RecordBatchStreamReader.
+    """
+    if pyarrow is None:
+        raise ValueError("Parquet and Arrow uploads need pyarrow installed")
+    if isinstance(source, str):
+        source = pyarrow.memory_map(source)
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        source = pyarrow.BufferReader(source)
+    if fmt == "parquet":
+        from pyarrow import parquet
+        return parquet.ParquetFile(source)
+    if fmt == "arrow":
+        return pyarrow.ipc.open_file(source)
+    return pyarrow.ipc.open_stream(source)
+
+def arrow_schema(reader):
+    return reader.schema_arrow if hasattr(reader, "schema_arrow") else reader.schema
+
+def arrow_casts(schema) -> tuple:
+    """
+    Plans how to read a Parquet or Arrow file from its schema alone: which
+    columns to read, and the Arrow type each is cast to so it converts to
+    the dtype validate_*_data expects. Nothing is inferred or parsed from
+    text. A column whose stored type doesn't fit (say, amount stored as
+    a string) gets no cast and is reported by validate_*_data as usual.
+
+    Parameters:
+    schema (pyarrow.Schema): The file's schema.
+
+    Returns:
+    tuple: (usecols, casts), casts mapping column name to Arrow type.
+    """
+    types = pyarrow.types
+    expected = pick_schema(schema.names)
+    usecols = [name for name in schema.names if name in expected]
+    casts = {}
+    for name in usecols:
+        stored = schema.field(name).type
+        if types.is_dictionary(stored):
+            stored = stored.value_type
+        dtype = expected[name]
+        if dtype == 'float64' and (types.is_floating(stored) or types.is_integer(stored)):
+            casts[name] = pyarrow.float64()
+        elif dtype == 'int64' and types.is_integer(stored):
+            casts[name] = pyarrow.int64()
+        elif (dtype == 'datetime64[ns]' or name == 'transdatetime') and (types.is_timestamp(stored) or types.is_date(stored)):
+            casts[name] = pyarrow.timestamp('ns')
+        elif types.is_string(stored) or types.is_large_string(stored):
+            # dates stored as text are parsed like CSV ones
+            casts[name] = pyarrow.string()
+    return usecols, casts
+
+def arrow_to_frame(table, casts: dict) -> pd.DataFrame:
+    for name, arrow_type in casts.items():
+        index = table.schema.get_field_index(name)
+        if table.schema.field(index).type != arrow_type:
+            table = table.set_column(index, name, table.column(index).cast(arrow_type))
+    return parse_date_columns(table.to_pandas())
+
+def read_upload_typed(content: bytes) -> pd.DataFrame:
+    """
+    Reads an uploaded transactions or patterns file in any supported
+    format, told apart by its magic bytes: CSV through read_csv_typed,
+    Parquet and Arrow IPC with the types stored in the file (see
+    arrow_casts).
+
+    Parameters:
+    content (bytes): The raw file body.
+
+    Returns:
+    pd.DataFrame: The parsed data with DATE_COLUMNS already converted.
+    """
+    fmt = upload_format(content[:8])
+    if fmt == "csv":
+        return read_csv_typed(content)
+    reader = arrow_reader(content, fmt)
+    usecols, casts = arrow_casts(arrow_schema(reader))
+    table = reader.read(columns=usecols) if fmt == "parquet" else reader.read_all().select(usecols)
+    return arrow_to_frame(table, casts)
+
+def iter_upload_typed(path: str, chunk_rows: int):
+    """
+    iter_csv_typed for an upload of any supported format on disk. Parquet
+    is read chunk_rows rows at a time; Arrow IPC is memory-mapped and
+    sliced, which copies nothing until a slice is converted.
+
+    Yields:
+    pd.DataFrame: Consecutive chunks with DATE_COLUMNS already converted.
+    """
+    with open(path, "rb") as f:
+        fmt = upload_format(f.read(8))
+    if fmt == "csv":
+        yield from iter_csv_typed(path, chunk_rows)
+        return
+    reader = arrow_reader(path, fmt)
+    usecols, casts = arrow_casts(arrow_schema(reader))
+    if fmt == "parquet":
+        for batch in reader.iter_batches(batch_size=chunk_rows, columns=usecols):
+            yield arrow_to_frame(pyarrow.Table.from_batches([batch]), casts)
+        return
+    table = reader.read_all().select(usecols)
+    for start in range(0, table.num_rows, chunk_rows):
+        yield arrow_to_frame(table.slice(start, chunk_rows), casts)
+
+def upload_schema(file, head: bytes) -> dict:
+    """
+    Returns TRANSACTION_COLUMNS or PATTERN_COLUMNS for an upload of any
+    format, from its header or file metadata.
+
+    Parameters:
+    file: The upload as a seekable file object; only read for binary formats.
+    head (bytes): The first bytes of the upload, at least its first line.
+    """
+    fmt = upload_format(head)
+    if fmt == "csv":
+        return csv_schema(head)[1]
+    try:
+        schema = arrow_schema(arrow_reader(file, fmt))
+    finally:
+        file.seek(0)
+    return pick_schema(schema.names)
+
 def validate_transaction_data(df: pd.DataFrame) -> object:
     """
     Validates the transaction DataFrame to ensure it contains the required columns
@@ -34,29 +331,20 @@ def validate_transaction_data(df: pd.DataFrame) -> object:
     Returns:
     bool: True if validation passes, False otherwise.
     """
-    required_columns = {
-        'cst_dim_id': 'float64',
-        'transdate': 'datetime64[ns]',
-        'transdatetime': object,
-        'amount': 'float64',
-        'docno': 'int64',
-        'direction': object,
-        'target': 'int64'
-    }
     missing_columns = []
     incorrect_types = []
     try:
-        df['transdate'] = pd.to_datetime(df['transdate'])
+        df['transdate'] = parse_datetime(df['transdate'])
     except Exception as e:
-        try:
-            df['transdate'] = pd.to_datetime(df['transdate'].astype(str).str.replace("'", ""))
-        except Exception as e:
-            incorrect_types.append(('transdate', 'datetime64[ns]', 'invalid format'))
-    for column, dtype in required_columns.items():
+        incorrect_types.append(('transdate', 'datetime64[ns]', 'invalid format'))
+    for column, dtype in TRANSACTION_COLUMNS.items():
         if column not in df.columns:
             missing_columns.append(column)
         elif column in FLOAT_DTYPES and pd.api.types.is_integer_dtype(df[column].dtype):
-            print("skipping float check for integer column:", column)
+            logger.debug("skipping float check for integer column: %s", column)
+            continue
+        elif column == 'transdatetime' and pd.api.types.is_datetime64_any_dtype(df[column].dtype):
+            # Parquet and Arrow uploads carry it as a timestamp, already parsed
             continue
         elif not pd.api.types.is_dtype_equal(df[column].dtype, dtype):
             incorrect_types.append((column, dtype, df[column].dtype))
@@ -91,41 +379,15 @@ def validate_patterns_data(df: pd.DataFrame) -> object:
     Returns:
     bool: True if validation passes, False otherwise.
     """
-
-    # logins_last_7_days;logins_last_30_days;login_frequency_7d;login_frequency_30d;freq_change_7d_vs_mean;logins_7d_over_30d_ratio;avg_login_interval_30d;std_login_interval_30d;var_login_interval_30d;ewm_login_interval_7d;burstiness_login_interval;fano_factor_login_interval;zscore_avg_login_interval_7d
-    required_columns = {
-        'transdate': 'datetime64[ns]',
-        'cst_dim_id': 'float64',
-        'monthly_os_changes': 'int64', 
-        'monthly_phone_model_changes': 'int64',
-        'last_phone_model_categorical': object,
-        'last_os_categorical': object,
-        'logins_last_7_days': 'int64',
-        'logins_last_30_days': 'int64',
-        'login_frequency_7d': 'float64',
-        'login_frequency_30d': 'float64',
-        'freq_change_7d_vs_mean': 'float64',
-        'logins_7d_over_30d_ratio': 'float64',
-        'avg_login_interval_30d': 'float64',
-        'std_login_interval_30d': 'float64',
-        'var_login_interval_30d': 'float64',
-        'ewm_login_interval_7d': 'float64',
-        'burstiness_login_interval': 'float64',
-        'fano_factor_login_interval': 'float64',
-        'zscore_avg_login_interval_7d': 'float64'
-    }
-    try:
-        df['transdate'] = pd.to_datetime(df['transdate'])
-    except Exception as e:
-        try:
-            df['transdate'] = pd.to_datetime(df['transdate'].astype(str).str.replace("'", ""))
-        except Exception as e:
-            incorrect_types.append(('transdate', 'datetime64[ns]', 'invalid format'))
     missing_columns = []
     incorrect_types = []
-    for column, dtype in required_columns.items():
+    try:
+        df['transdate'] = parse_datetime(df['transdate'])
+    except Exception as e:
+        incorrect_types.append(('transdate', 'datetime64[ns]', 'invalid format'))
+    for column, dtype in PATTERN_COLUMNS.items():
         if column in FLOAT_DTYPES and pd.api.types.is_integer_dtype(df[column].dtype):
-            print("skipping float check for integer column:", column)
+            logger.debug("skipping float check for integer column: %s", column)
             continue
         if column not in df.columns:
             missing_columns.append(column)
@@ -150,91 +412,357 @@ def validate_patterns_data(df: pd.DataFrame) -> object:
         "message": "Validation passed"
     }
 
+def compact_frame(df: pd.DataFrame, downcast_ints: bool = False) -> pd.DataFrame:
+    """
+    Converts df in place to a compact representation: CATEGORICAL_COLUMNS
+    become categoricals, floats become float32 and cst_dim_id becomes an
+    int64 key. With downcast_ints, integer columns (the 0/1 flags and small
+    counts produced by preprocess_merged_data) are downcast to the smallest
+    integer type that holds them.
+
+    Count columns are left alone on the input frames because
+    preprocess_merged_data multiplies them together and a narrow int type
+    could overflow.
+
+    Parameters:
+    df (pd.DataFrame): A validated input frame or a preprocessed feature frame.
+    downcast_ints (bool): Whether to downcast integer columns too.
+
+    Returns:
+    pd.DataFrame: The same frame, for chaining.
+    """
+    for column in df.columns:
+        dtype = df[column].dtype
+        if column == 'cst_dim_id':
+            if pd.api.types.is_float_dtype(dtype) and not df[column].isna().any():
+                df[column] = df[column].astype('int64')
+        elif column in CATEGORICAL_COLUMNS:
+            if not isinstance(dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype('category')
+        elif pd.api.types.is_float_dtype(dtype):
+            df[column] = df[column].astype('float32')
+        elif downcast_ints and pd.api.types.is_integer_dtype(dtype):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+    return df
+
+def join_key_parts(cst_dim_id: pd.Series, transdate: pd.Series) -> tuple:
+    """
+    Splits the join key into arrays: cst_dim_id as float64, the day number
+    since epoch, and whether the row has both.
+    """
+    ids = pd.to_numeric(cst_dim_id).to_numpy(dtype='float64', na_value=np.nan)
+    dates = transdate.to_numpy(dtype='datetime64[ns]')
+    valid = ~np.isnan(ids) & ~np.isnat(dates)
+    days = np.zeros(len(ids), dtype='int64')
+    days[valid] = dates[valid].astype('datetime64[D]').astype('int64')
+    return ids, days, valid
+
+def packable(ids: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """
+    Marks the keys join_key can pack without collisions: whole ids from 0 to
+    JOIN_MAX_ID and days from 1970 on that fit in JOIN_DAY_BITS.
+    """
+    with np.errstate(invalid='ignore'):
+        return (ids >= 0) & (ids <= JOIN_MAX_ID) & (ids == np.floor(ids)) & (days >= 0) & (days < 2 ** JOIN_DAY_BITS)
+
+def join_key(cst_dim_id: pd.Series, transdate: pd.Series) -> np.ndarray:
+    """
+    Packs (cst_dim_id, transdate) into a single int64 per row: the customer
+    id in the high bits, the day number since epoch in the low JOIN_DAY_BITS.
+    Rows with a missing id or date get -1, which never matches, and so do
+    rows that don't pack (see packable); build_patterns_index keys those
+    on (id, day) pairs instead.
+    """
+    return pack_keys(*join_key_parts(cst_dim_id, transdate))
+
+def pack_keys(ids: np.ndarray, days: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    valid = valid & packable(ids, days)
+    keys = np.full(len(ids), -1, dtype='int64')
+    keys[valid] = (ids[valid].astype('int64') << JOIN_DAY_BITS) | days[valid]
+    return keys
+
+def build_patterns_index(patterns: pd.DataFrame) -> pd.DataFrame:
+    """
+    Builds the lookup side of the transactions x patterns join: the pattern
+    feature columns indexed by join_key, unique and sorted. Build it once and
+    reuse it for any number of join_transactions_patterns calls. If any row
+    can't be packed into join_key, the index is a (cst_dim_id, day)
+    MultiIndex instead, which is slower to join but never collides.
+
+    If a (cst_dim_id, transdate) pair appears more than once, the last row
+    wins; a left merge would have duplicated the matching transactions.
+
+    Parameters:
+    patterns (pd.DataFrame): Validated patterns data.
+
+    Returns:
+    pd.DataFrame: Pattern features without the key columns.
+    """
+    ids, days, valid = join_key_parts(patterns['cst_dim_id'], patterns['transdate'])
+    index = patterns.drop(columns=['cst_dim_id', 'transdate'])
+    if (valid & ~packable(ids, days)).any():
+        index.index = pd.MultiIndex.from_arrays([ids, days], names=['cst_dim_id', 'day'])
+    else:
+        index.index = pd.Index(pack_keys(ids, days, valid), name='join_key')
+    index = index[valid & ~index.index.duplicated(keep='last')]
+    return index.sort_index()
+
+def join_positions(transactions: pd.DataFrame, patterns_index: pd.DataFrame) -> np.ndarray:
+    """
+    Returns the position in patterns_index of each transaction's patterns
+    row, or -1.
+    """
+    if not isinstance(patterns_index.index, pd.MultiIndex):
+        # a packed index holds only packable keys, so transactions that don't pack can't match anyway
+        return patterns_index.index.get_indexer(join_key(transactions['cst_dim_id'], transactions['transdate']))
+    ids, days, valid = join_key_parts(transactions['cst_dim_id'], transactions['transdate'])
+    positions = np.full(len(ids), -1, dtype=np.intp)
+    positions[valid] = patterns_index.index.get_indexer(pd.MultiIndex.from_arrays([ids[valid], days[valid]]))
+    return positions
+
+def join_transactions_patterns(transactions: pd.DataFrame, patterns_index: pd.DataFrame) -> tuple:
+    """
+    Inner-joins transactions with a patterns index from build_patterns_index.
+    Transactions without a pattern row are counted as unmatched. Joined rows
+    with a null in any column are dropped, as the old merge+dropna did,
+    since the model can't score a missing categorical; they are counted as
+    incomplete rather than silently lost.
+
+    Parameters:
+    transactions (pd.DataFrame): Validated transaction data.
+    patterns_index (pd.DataFrame): Output of build_patterns_index.
+
+    Returns:
+    tuple: The joined DataFrame and a dict with transactions/matched/unmatched/incomplete
+        counts; matched counts the rows returned.
+    """
+    positions = join_positions(transactions, patterns_index)
+    matched = positions >= 0
+    left = transactions[matched]
+    right = patterns_index.iloc[positions[matched]]
+    right.index = left.index
+    merged_df = pd.concat([left, right], axis=1)
+    nulls = null_rows(merged_df)
+    if nulls is not None:
+        merged_df = merged_df[~nulls]
+    stats = {
+        "transactions": len(transactions),
+        "matched": len(merged_df),
+        "unmatched": int(len(transactions) - matched.sum()),
+        "incomplete": int(nulls.sum()) if nulls is not None else 0,
+    }
+    return merged_df, stats
+
+def null_rows(df: pd.DataFrame) -> np.ndarray:
+    """
+    Marks the rows of df with a null in any column, or returns None if there
+    are none. Integer columns can't hold one and object columns of nothing
+    but strings, the usual case, are told apart by one infer_dtype pass,
+    which is several times faster than isna on strings.
+    """
+    nulls = None
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_integer_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+            continue
+        if values.dtype == object and pd.api.types.infer_dtype(values, skipna=False) == 'string':
+            continue
+        column_nulls = values.isna().to_numpy()
+        if column_nulls.any():
+            nulls = column_nulls if nulls is None else nulls | column_nulls
+    return nulls
+
 def merge_transaction_pattern_data(transactions: pd.DataFrame, patterns: pd.DataFrame) -> pd.DataFrame:
-    merged_df = transactions.merge(patterns, on=['cst_dim_id', 'transdate'], how='left')
-    merged_df = merged_df.dropna()
-    print(len(merged_df), "rows after merging transaction and pattern data")
+    merged_df, stats = join_transactions_patterns(transactions, build_patterns_index(patterns))
+    print(len(merged_df), "rows after merging transaction and pattern data,", stats["unmatched"], "transactions without patterns,", stats["incomplete"], "with nulls")
     return merged_df
 
-def preprocess_merged_data(df: pd.DataFrame) -> pd.DataFrame:
+def parse_datetime(values: pd.Series) -> pd.Series:
+    """
+    Parses a datetime column of ISO strings. Values may be quoted as in
+    transactions_cleaned.csv ('2025-01-05 16:32:02.000'); the quotes are
+    stripped first. NumPy's ISO parser is tried before pandas' explicit
+    format, and pandas' format inference is the last resort.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values
+    raw = values.to_numpy()
+    if len(raw) and isinstance(raw[0], str) and raw[0].startswith("'"):
+        raw = values.str.strip("'").to_numpy()
+    try:
+        return pd.Series(raw.astype('datetime64[ns]'), index=values.index, name=values.name)
+    except (ValueError, TypeError):
+        pass
+    values = values.astype(str).str.strip("'")
+    try:
+        return pd.to_datetime(values, format=DATETIME_FORMAT)
+    except (ValueError, TypeError):
+        return pd.to_datetime(values)
+
+def feature_stats(df: pd.DataFrame) -> dict:
+    """
+    Computes the cross-row statistics preprocess_merged_data needs: maxima of
+    the change counters, the mean login interval and the logins_last_7_days
+    and login_acceleration quantiles.
+
+    Parameters:
+    df (pd.DataFrame): Merged transaction and pattern data.
+
+    Returns:
+    dict: Plain floats, safe to store as JSON.
+    """
+    logins_7d_quantiles = df['logins_last_7_days'].quantile([0.05, 0.75, 0.95])
+    login_acceleration = df['login_frequency_7d'] - df['login_frequency_30d']
+    return {
+        'monthly_os_changes_max': float(df['monthly_os_changes'].max()),
+        'monthly_phone_model_changes_max': float(df['monthly_phone_model_changes'].max()),
+        'avg_login_interval_30d_mean': float(df['avg_login_interval_30d'].mean()),
+        'logins_last_7_days_q05': float(logins_7d_quantiles[0.05]),
+        'logins_last_7_days_q75': float(logins_7d_quantiles[0.75]),
+        'logins_last_7_days_q95': float(logins_7d_quantiles[0.95]),
+        'login_acceleration_q95': float(login_acceleration.quantile(0.95)),
+    }
+
+def preprocess_merged_data(df: pd.DataFrame, stats: dict = None) -> pd.DataFrame:
+    """
+    Builds the model features from merged transaction and pattern data.
+
+    Parameters:
+    df (pd.DataFrame): Merged transaction and pattern data.
+    stats (dict): Frozen output of feature_stats. When omitted the
+        statistics are computed from df itself, so features depend on the
+        rest of the batch.
+
+    Returns:
+    pd.DataFrame: df without the date columns, plus the feature columns.
+    """
     df = df.dropna(how='all', axis=0, subset=['monthly_os_changes', 'monthly_phone_model_changes', 'amount'])
-    df['hour'] = pd.to_datetime(df['transdatetime']).dt.hour
-    df['dayofweek'] = pd.to_datetime(df['transdatetime']).dt.dayofweek
-    df['day'] = pd.to_datetime(df['transdatetime']).dt.day
-    df['month'] = pd.to_datetime(df['transdatetime']).dt.month
+    if stats is None:
+        stats = feature_stats(df)
+    transdatetime = parse_datetime(df['transdatetime'])
     df = df.drop(columns=['transdate', 'transdatetime'])
-    df['is_weekend'] = df['dayofweek'].apply(lambda df: 1 if df >= 5 else 0)
-
-    def part_of_day(hour):
-        if hour < 6:
-            return 'night'
-        elif hour < 12:
-            return 'morning'
-        elif hour < 18:
-            return 'afternoon'
-        else:
-            return 'evening'
-    df['part_of_day'] = df['hour'].apply(part_of_day)
-
-    df['login_freq_7d_vs_30d_ratio'] = df['login_frequency_7d'] / (df['login_frequency_30d'] + 1e-6)
-    df['os_change_ratio'] = df['monthly_os_changes'] / (df['monthly_os_changes'].max() + 1e-6)
-    df['device_change_ratio'] = df['monthly_phone_model_changes'] / (df['monthly_phone_model_changes'].max() + 1e-6)
-    df['high_login_zscore'] = (df['avg_login_interval_30d'] - df['avg_login_interval_30d'].mean()) / (df['std_login_interval_30d'] + 1e-6)
-    df['high_login_zscore_flag'] = (df['high_login_zscore'].abs() > 2).astype(int)
-    df['os_device_change'] = df['monthly_os_changes'] * df['monthly_phone_model_changes']
-    df['logins_per_hour'] = df['logins_last_7_days'] / (df['hour'] + 1e-6)
-    df['bursty_and_frequent'] = df['burstiness_login_interval'] * df['logins_last_7_days']
-    df['interval_std_over_mean'] = df['std_login_interval_30d'] / (df['avg_login_interval_30d'] + 1e-6)
-    df['ewm_vs_avg'] = df['ewm_login_interval_7d'] / (df['avg_login_interval_30d'] + 1e-6)
-    df['login_acceleration'] = df['login_frequency_7d'] - df['login_frequency_30d']
-    df['sudden_activity_spike'] = ((df['logins_last_7_days'] / 7) > (df['logins_last_30_days'] / 30) * 2).astype(int)
-
-    # Recent device/OS change flags
-    df['recent_os_change_flag'] = (df['monthly_os_changes'] > 0).astype(int)
-    df['recent_device_change_flag'] = (df['monthly_phone_model_changes'] > 0).astype(int)
-    df['any_recent_change'] = (df['recent_os_change_flag'] | df['recent_device_change_flag']).astype(int)
-    df['multiple_changes'] = ((df['monthly_os_changes'] > 1) | (df['monthly_phone_model_changes'] > 1)).astype(int)
-
-    # Composite risk score (combines multiple signals)
-    df['risk_score'] = (
-        df['high_login_zscore_flag'] * 2 +
-        df['any_recent_change'] * 3 +
-        df['sudden_activity_spike'] * 2 +
-        (df['logins_7d_over_30d_ratio'] > 0.8).astype(int) +
-        df['multiple_changes'] * 4
-    )
-
-    # Changes + high activity (very suspicious)
-    df['change_with_high_activity'] = ((df['any_recent_change'] == 1) & 
-                                    (df['logins_last_7_days'] > df['logins_last_7_days'].quantile(0.75))).astype(int)
-
-    # Suspicious hours (night logins)
-    df['risky_hour'] = df['hour'].isin([0, 1, 2, 3, 4, 5, 22, 23]).astype(int)
-    df['night_with_change'] = ((df['part_of_day'] == 'night') & (df['any_recent_change'] == 1)).astype(int)
-
-    # Extreme velocity of activity change
-    df['extreme_velocity'] = (df['login_acceleration'].abs() > df['login_acceleration'].quantile(0.95)).astype(int)
-
-    # Multidimensional variability score
-    df['login_variability_score'] = df['burstiness_login_interval'] * df['interval_std_over_mean'] * (1 + df['os_device_change'])
-
-    # Consistency of behavior (low value = suspicious)
-    df['consistency_score'] = 1 / (1 + df['burstiness_login_interval'] + df['os_device_change'])
-
-    # Frequency + variability
-    df['freq_variability_product'] = df['logins_last_7_days'] * df['interval_std_over_mean']
-
-    # Deviation from typical behavior
-    df['deviation_score'] = abs(df['logins_last_7_days'] - df['logins_last_30_days'] / 4.3) / (df['logins_last_30_days'] / 4.3 + 1e-6)
-
-    # Extreme login frequency values
-    df['extreme_login_freq'] = ((df['logins_last_7_days'] > df['logins_last_7_days'].quantile(0.95)) | 
-                            (df['logins_last_7_days'] < df['logins_last_7_days'].quantile(0.05))).astype(int)
-    
+
+    # Features are computed on NumPy arrays, which keeps per-call overhead low
+    # for the single-row /score path, and attached in one concat in the
+    # order the model was trained with.
+    c = {name: df[name].to_numpy() for name in [
+        'monthly_os_changes', 'monthly_phone_model_changes', 'logins_last_7_days', 'logins_last_30_days',
+        'login_frequency_7d', 'login_frequency_30d', 'logins_7d_over_30d_ratio', 'avg_login_interval_30d',
+        'std_login_interval_30d', 'ewm_login_interval_7d', 'burstiness_login_interval',
+    ]}
+    f = {}
+    f['hour'] = transdatetime.dt.hour.to_numpy()
+    f['dayofweek'] = transdatetime.dt.dayofweek.to_numpy()
+    f['day'] = transdatetime.dt.day.to_numpy()
+    f['month'] = transdatetime.dt.month.to_numpy()
+    hour = f['hour']
+    f['is_weekend'] = (f['dayofweek'] >= 5).astype(int)
+    f['part_of_day'] = np.select([hour < 6, hour < 12, hour < 18], ['night', 'morning', 'afternoon'], 'evening').astype(object)
+
+    monthly_os_changes = c['monthly_os_changes']
+    monthly_phone_model_changes = c['monthly_phone_model_changes']
+    logins_last_7_days = c['logins_last_7_days']
+    logins_last_30_days = c['logins_last_30_days']
+    avg_login_interval_30d = c['avg_login_interval_30d']
+    std_login_interval_30d = c['std_login_interval_30d']
+    burstiness_login_interval = c['burstiness_login_interval']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f['login_freq_7d_vs_30d_ratio'] = c['login_frequency_7d'] / (c['login_frequency_30d'] + 1e-6)
+        f['os_change_ratio'] = monthly_os_changes / (stats['monthly_os_changes_max'] + 1e-6)
+        f['device_change_ratio'] = monthly_phone_model_changes / (stats['monthly_phone_model_changes_max'] + 1e-6)
+        f['high_login_zscore'] = (avg_login_interval_30d - stats['avg_login_interval_30d_mean']) / (std_login_interval_30d + 1e-6)
+        f['high_login_zscore_flag'] = (np.abs(f['high_login_zscore']) > 2).astype(int)
+        f['os_device_change'] = monthly_os_changes * monthly_phone_model_changes
+        f['logins_per_hour'] = logins_last_7_days / (f['hour'] + 1e-6)
+        f['bursty_and_frequent'] = burstiness_login_interval * logins_last_7_days
+        f['interval_std_over_mean'] = std_login_interval_30d / (avg_login_interval_30d + 1e-6)
+        f['ewm_vs_avg'] = c['ewm_login_interval_7d'] / (avg_login_interval_30d + 1e-6)
+        f['login_acceleration'] = c['login_frequency_7d'] - c['login_frequency_30d']
+        f['sudden_activity_spike'] = ((logins_last_7_days / 7) > (logins_last_30_days / 30) * 2).astype(int)
+
+        # Recent device/OS change flags
+        f['recent_os_change_flag'] = (monthly_os_changes > 0).astype(int)
+        f['recent_device_change_flag'] = (monthly_phone_model_changes > 0).astype(int)
+        f['any_recent_change'] = (f['recent_os_change_flag'] | f['recent_device_change_flag']).astype(int)
+        f['multiple_changes'] = ((monthly_os_changes > 1) | (monthly_phone_model_changes > 1)).astype(int)
+
+        # Composite risk score (combines multiple signals)
+        f['risk_score'] = (
+            f['high_login_zscore_flag'] * 2 +
+            f['any_recent_change'] * 3 +
+            f['sudden_activity_spike'] * 2 +
+            (c['logins_7d_over_30d_ratio'] > 0.8).astype(int) +
+            f['multiple_changes'] * 4
+        )
+
+        # Changes + high activity (very suspicious)
+        f['change_with_high_activity'] = ((f['any_recent_change'] == 1) &
+                                        (logins_last_7_days > stats['logins_last_7_days_q75'])).astype(int)
+
+        # Suspicious hours (night logins)
+        f['risky_hour'] = ((hour < 6) | (hour >= 22)).astype(int)
+        f['night_with_change'] = ((hour < 6) & (f['any_recent_change'] == 1)).astype(int)
+
+        # Extreme velocity of activity change
+        f['extreme_velocity'] = (np.abs(f['login_acceleration']) > stats['login_acceleration_q95']).astype(int)
+
+        # Multidimensional variability score
+        f['login_variability_score'] = burstiness_login_interval * f['interval_std_over_mean'] * (1 + f['os_device_change'])
+
+        # Consistency of behavior (low value = suspicious)
+        f['consistency_score'] = 1 / (1 + burstiness_login_interval + f['os_device_change'])
+
+        # Frequency + variability
+        f['freq_variability_product'] = logins_last_7_days * f['interval_std_over_mean']
+
+        # Deviation from typical behavior
+        f['deviation_score'] = np.abs(logins_last_7_days - logins_last_30_days / 4.3) / (logins_last_30_days / 4.3 + 1e-6)
+
+        # Extreme login frequency values
+        f['extreme_login_freq'] = ((logins_last_7_days > stats['logins_last_7_days_q95']) |
+                                (logins_last_7_days < stats['logins_last_7_days_q05'])).astype(int)
+
+    df = pd.concat([df, pd.DataFrame(f, index=df.index)], axis=1)
+
+    # cst_dim_id is the join key, not a feature; compact_frame makes it int64 on purpose
     for col in FLOAT_DTYPES:
-        if pd.api.types.is_integer_dtype(df[col].dtype):
+        if col != 'cst_dim_id' and pd.api.types.is_integer_dtype(df[col].dtype):
             df[col] = df[col].astype('float64')
-            print(f"Converted column {col} to float64")
 
     return df
 
+class FeaturePreprocessor:
+    """
+    Fit/transform wrapper around preprocess_merged_data. fit freezes the
+    cross-row statistics (see feature_stats) from reference data; transform
+    then featurizes any frame with them, so a row's features no longer
+    depend on the rest of its batch and a file can be scored whole or in
+    chunks with the same result.
+    """
+
+    def __init__(self, stats: dict = None):
+        self.stats = stats
+
+    def fit(self, df: pd.DataFrame) -> "FeaturePreprocessor":
+        """
+        Computes the statistics from merged reference data, after the same
+        row filter preprocess_merged_data applies.
+        """
+        df = df.dropna(how='all', axis=0, subset=['monthly_os_changes', 'monthly_phone_model_changes', 'amount'])
+        self.stats = feature_stats(df)
+        return self
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.stats is None:
+            raise ValueError("FeaturePreprocessor is not fitted")
+        return preprocess_merged_data(df, self.stats)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"stats": self.stats}, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "FeaturePreprocessor":
+        with open(path) as f:
+            return cls(json.load(f)["stats"])
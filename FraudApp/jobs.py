@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+import model_registry
+import scoring
+
+# one directory per job: its state, the uploaded inputs until it finishes, and the result
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+# jobs scored at the same time, each on its own worker
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 1))
+# finished jobs and their results are deleted this long after they end
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 24 * 3600))
+# seconds between sweeps for expired jobs while the server runs
+JOB_CLEANUP_INTERVAL = float(os.getenv("JOB_CLEANUP_INTERVAL", 600))
+
+# result file extension per output format
+EXTENSIONS = {"ndjson": ".ndjson", "csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+FINISHED = ("done", "failed")
+_cleaner = None
+
+def job_path(job_id: str, name: str = "") -> str:
+    # ids are generated here; anything else could point outside JOBS_DIR
+    if len(job_id) != 32 or not all(c in "0123456789abcdef" for c in job_id):
+        raise KeyError(job_id)
+    return os.path.join(JOBS_DIR, job_id, name)
+
+def read_state(job_id: str) -> dict:
+    """
+    Returns a job's state, or None for an unknown id.
+    """
+    try:
+        with open(job_path(job_id, "job.json")) as f:
+            return json.load(f)
+    except (KeyError, FileNotFoundError):
+        return None
+
+def write_state(state: dict):
+    """
+    Saves a job's state through a temporary file and a rename, so readers
+    never see it half-written.
+    """
+    path = job_path(state["id"], "job.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+def create(transactions, patterns, fmt: str, spec: dict, sweep: int = 0, probabilities: bool = False) -> dict:
+    """
+    Stores a new job's inputs on disk and marks it queued.
+
+    Parameters:
+    transactions: The transactions upload as a file object.
+    patterns: The patterns upload as a file object, or None to use patterns_store.
+    fmt (str): Result format, one of EXTENSIONS.
+    spec (dict): Model version the job is scored with (see model_registry),
+        fixed when it is submitted.
+    sweep (int): Thresholds of the metrics' threshold sweep, 0 for none
+        (see scoring.threshold_sweep).
+    probabilities (bool): Whether the result keeps the probability column.
+
+    Returns:
+    dict: The job's state.
+    """
+    job_id = uuid.uuid4().hex
+    os.makedirs(job_path(job_id))
+    for name, upload in (("transactions", transactions), ("patterns", patterns)):
+        if upload is not None:
+            with open(job_path(job_id, name), "wb") as f:
+                shutil.copyfileobj(upload, f, 1024 * 1024)
+    state = {
+        "id": job_id,
+        "status": "queued",
+        "format": fmt,
+        "model": spec,
+        "sweep": sweep,
+        "probabilities": probabilities,
+        "progress": {"parsed": 0, "joined": 0, "scored": 0},
+        "metrics": None,
+        "error": None,
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+    }
+    write_state(state)
+    return state
+
+def run(job_id: str):
+    """
+    Scores a queued job into its result file, saving progress after every
+    chunk. Jobs are scored out of core like big /process uploads; a model
+    version without a fitted preprocessor scores the upload whole instead.
+    Module-level so process pools can run it.
+    """
+    state = read_state(job_id)
+    if state is None or state["status"] in FINISHED:
+        return
+    state.update(status="running", started=time.time(), progress={"parsed": 0, "joined": 0, "scored": 0})
+    write_state(state)
+
+    def progress(counts: dict):
+        state["progress"] = counts
+        write_state(state)
+
+    transactions_path = job_path(job_id, "transactions")
+    patterns_path = job_path(job_id, "patterns")
+    result_path = result_file(state)
+    # jobs queued before these options existed have neither
+    options = {"sweep": state.get("sweep", 0), "probabilities": state.get("probabilities", False)}
+    try:
+        patterns_content = None
+        if os.path.exists(patterns_path):
+            with open(patterns_path, "rb") as f:
+                patterns_content = f.read()
+        if model_registry.resolve(state["model"]).preprocessor is not None:
+            result = scoring.score_file_chunked(
+                transactions_path, patterns_content, result_path + ".tmp", state["format"], scoring.CHUNK_ROWS, state["model"], progress, **options,
+            )
+        else:
+            with open(transactions_path, "rb") as f:
+                result = scoring.score_uploads(f.read(), patterns_content, state["model"], **options)
+            if not isinstance(result, dict):
+                scored, result = result
+                scoring.write_frame(scored, result, result_path + ".tmp", state["format"])
+                progress({"parsed": result["join"]["transactions"], "joined": result["join"]["matched"], "scored": len(scored)})
+    except Exception as e:
+        result = {"error": str(e)}
+
+    if "error" in result:
+        state.update(status="failed", error=result["error"])
+        if os.path.exists(result_path + ".tmp"):
+            os.remove(result_path + ".tmp")
+    else:
+        os.replace(result_path + ".tmp", result_path)
+        state.update(status="done", metrics=result)
+    state["finished"] = time.time()
+    write_state(state)
+    for path in (transactions_path, patterns_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+def result_file(state: dict) -> str:
+    return job_path(state["id"], "result" + EXTENSIONS[state["format"]])
+
+def list_states() -> list:
+    """
+    Returns the state of every job on disk, oldest first.
+    """
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    states = [read_state(job_id) for job_id in os.listdir(JOBS_DIR)]
+    return sorted((s for s in states if s is not None), key=lambda s: s["created"])
+
+def expire() -> int:
+    """
+    Deletes jobs that finished more than JOB_RETENTION_SECONDS ago, result
+    files included.
+
+    Returns:
+    int: How many jobs were deleted.
+    """
+    expired = 0
+    for state in list_states():
+        if state["status"] in FINISHED and time.time() - state["finished"] > JOB_RETENTION_SECONDS:
+            shutil.rmtree(job_path(state["id"]), ignore_errors=True)
+            expired += 1
+    return expired
+
+def recover() -> list:
+    """
+    Deletes expired jobs and puts the ones a restart interrupted back in
+    the queue; a job that was running starts over. Call at startup, before
+    any job runs.
+
+    Returns:
+    list: Ids of the jobs to run, oldest first.
+    """
+    expire()
+    queued = []
+    for state in list_states():
+        if state["status"] in FINISHED:
+            continue
+        if state["status"] == "running":
+            state.update(status="queued", started=None)
+            write_state(state)
+        queued.append(state["id"])
+    return queued
+
+def cleanup_loop():
+    while True:
+        time.sleep(JOB_CLEANUP_INTERVAL)
+        try:
+            expired = expire()
+            if expired:
+                print(f"deleted {expired} expired jobs")
+        except Exception as e:
+            print("job cleanup failed:", e)
+
+def start_cleaner():
+    """
+    Starts the thread deleting expired jobs every JOB_CLEANUP_INTERVAL
+    seconds, once per process.
+    """
+    global _cleaner
+    if _cleaner is None and JOB_CLEANUP_INTERVAL > 0:
+        _cleaner = threading.Thread(target=cleanup_loop, name="job-cleaner", daemon=True)
+        _cleaner.start()
@@ -0,0 +1,347 @@
+"""
+Patterns features computed from raw login events as they arrive, instead of
+the offline daily snapshot in the patterns file.
+
+Every customer keeps the logins of the last 30 days and running statistics
+over them; each event updates them in O(1) (amortized: every event enters
+and leaves each window once). snapshot() turns the state into patterns rows
+as of a moment, in PATTERN_COLUMNS, for patterns_store and the usual join.
+
+Definitions, as of a moment T, with the 7 and 30 day windows (T - N days, T]:
+- logins_last_N_days: logins in the window.
+- login_frequency_7d: logins_last_7_days / 7; login_frequency_30d:
+  logins_last_30_days / 30 rounded to 2 decimals, as in the file.
+- freq_change_7d_vs_mean: login_frequency_7d / (logins_last_30_days / 30) - 1.
+- logins_7d_over_30d_ratio: logins_last_7_days / logins_last_30_days.
+- avg/std/var_login_interval_30d: over the intervals, in seconds, ending at
+  each login of the window; the first one's predecessor may be older.
+  Sample variance. -1 below 1 interval (avg) or 2 (std, var).
+- ewm_login_interval_7d: pandas ewm(span=7) mean of the intervals between
+  consecutive logins of the 7 day window, oldest first; -1 below 2 logins.
+- burstiness_login_interval: (std - avg) / (std + avg); fano_factor:
+  var / avg; both -1 where std is.
+- zscore_avg_login_interval_7d: (mean of the 7 day intervals - avg) / std;
+  -1 below 2 logins in 7 days or where std is -1.
+- monthly_os_changes, monthly_phone_model_changes: distinct values seen in
+  the 30 day window; last_*_categorical: those of the latest login.
+
+These reproduce every relation between columns that patterns_cleaned.csv
+itself satisfies and its -1 conventions (see bench_login_patterns.py).
+"""
+import os
+import math
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from helpers import PATTERN_COLUMNS
+
+# columns of a raw login event
+LOGIN_COLUMNS = ['cst_dim_id', 'logindatetime', 'os', 'phone_model']
+# logins kept per customer; beyond it the oldest are dropped early, so the 30 day figures are capped
+LOGIN_MAX_EVENTS = int(os.getenv("LOGIN_MAX_EVENTS", 4096))
+# customers without a login for this long are forgotten; a returning one
+# starts over, its first interval unknown as for a new customer
+LOGIN_IDLE_SECONDS = float(os.getenv("LOGIN_IDLE_SECONDS", 90 * 86400))
+# seconds between snapshots published to patterns_store by the background thread; 0 turns it off
+LOGIN_PUBLISH_INTERVAL = float(os.getenv("LOGIN_PUBLISH_INTERVAL", 0))
+
+DAY = 86400.0
+# pandas' ewm(span=7) weight of the interval before the newest
+EWM_DECAY = 1 - 2 / (7 + 1)
+MISSING = -1.0
+
+class CustomerLogins:
+    """
+    One customer's logins inside the 30 day window, oldest first, with
+    running statistics. Lists are trimmed from the front through head
+    indices and compacted now and then, so eviction is O(1).
+    """
+    __slots__ = (
+        "times", "intervals", "os", "phones", "head30", "head7", "last_time", "last_os", "last_phone",
+        "n30", "mean30", "m2_30", "sum7", "ewm_num", "ewm_count", "os_counts", "phone_counts",
+    )
+
+    def __init__(self):
+        self.times, self.intervals, self.os, self.phones = [], [], [], []
+        self.head30 = self.head7 = 0
+        self.last_time = None
+        self.last_os = self.last_phone = None
+        # intervals ending in the 30 day window: count, mean, sum of squared deviations (Welford)
+        self.n30, self.mean30, self.m2_30 = 0, 0.0, 0.0
+        # intervals between logins of the 7 day window: sum, and the weighted sum of the ewm
+        self.sum7, self.ewm_num, self.ewm_count = 0.0, 0.0, 0
+        self.os_counts, self.phone_counts = {}, {}
+
+    def add(self, t: float, os_name: str, phone: str):
+        interval = t - self.last_time if self.last_time is not None else None
+        if interval is not None:
+            self.n30 += 1
+            delta = interval - self.mean30
+            self.mean30 += delta / self.n30
+            self.m2_30 += delta * (interval - self.mean30)
+            if self.head7 < len(self.times):
+                # the previous login is in the 7 day window, so the interval is too
+                self.sum7 += interval
+                self.ewm_num = self.ewm_num * EWM_DECAY + interval
+                self.ewm_count += 1
+        self.times.append(t)
+        self.intervals.append(interval)
+        self.os.append(os_name)
+        self.phones.append(phone)
+        self.os_counts[os_name] = self.os_counts.get(os_name, 0) + 1
+        self.phone_counts[phone] = self.phone_counts.get(phone, 0) + 1
+        self.last_time, self.last_os, self.last_phone = t, os_name, phone
+        if len(self.times) - self.head30 > LOGIN_MAX_EVENTS:
+            self.drop30()
+
+    def drop7(self):
+        # the oldest login of the 7 day window leaves it, and with it the interval to the next one
+        self.head7 += 1
+        if self.head7 < len(self.times) and self.ewm_count:
+            interval = self.intervals[self.head7]
+            self.sum7 -= interval
+            self.ewm_num -= interval * EWM_DECAY ** (self.ewm_count - 1)
+            self.ewm_count -= 1
+            if self.ewm_count == 0:
+                self.sum7 = self.ewm_num = 0.0
+
+    def drop30(self):
+        if self.head7 == self.head30:
+            self.drop7()
+        i = self.head30
+        interval = self.intervals[i]
+        if interval is not None:
+            self.n30 -= 1
+            if self.n30 == 0:
+                self.mean30 = self.m2_30 = 0.0
+            else:
+                delta = interval - self.mean30
+                self.mean30 -= delta / self.n30
+                self.m2_30 -= delta * (interval - self.mean30)
+        for counts, value in ((self.os_counts, self.os[i]), (self.phone_counts, self.phones[i])):
+            if counts[value] == 1:
+                del counts[value]
+            else:
+                counts[value] -= 1
+        self.head30 += 1
+        if self.head30 >= 64 and self.head30 * 2 >= len(self.times):
+            self.compact()
+
+    def copy(self) -> "CustomerLogins":
+        """
+        A copy of the logins still in the 30 day window and the statistics,
+        which can be advanced without touching this one.
+        """
+        other = CustomerLogins.__new__(CustomerLogins)
+        head = self.head30
+        other.times, other.intervals, other.os, other.phones = self.times[head:], self.intervals[head:], self.os[head:], self.phones[head:]
+        other.head30, other.head7 = 0, self.head7 - head
+        for name in ("last_time", "last_os", "last_phone", "n30", "mean30", "m2_30", "sum7", "ewm_num", "ewm_count"):
+            setattr(other, name, getattr(self, name))
+        other.os_counts, other.phone_counts = dict(self.os_counts), dict(self.phone_counts)
+        return other
+
+    def compact(self):
+        head = self.head30
+        del self.times[:head], self.intervals[:head], self.os[:head], self.phones[:head]
+        self.head7 -= head
+        self.head30 = 0
+
+    def stale(self, t: float) -> bool:
+        """
+        Whether advance(t) would drop anything.
+        """
+        times = self.times
+        return (self.head30 < len(times) and times[self.head30] <= t - 30 * DAY) or (self.head7 < len(times) and times[self.head7] <= t - 7 * DAY)
+
+    def advance(self, t: float):
+        """
+        Moves both windows to end at t.
+        """
+        times = self.times
+        while self.head30 < len(times) and times[self.head30] <= t - 30 * DAY:
+            self.drop30()
+        while self.head7 < len(times) and times[self.head7] <= t - 7 * DAY:
+            self.drop7()
+
+    def features(self) -> tuple:
+        """
+        The numeric patterns columns, in PATTERN_COLUMNS order.
+        """
+        logins30 = len(self.times) - self.head30
+        logins7 = len(self.times) - self.head7
+        freq7 = logins7 / 7
+        avg = self.mean30 if self.n30 >= 1 else MISSING
+        if self.n30 >= 2:
+            var = self.m2_30 / (self.n30 - 1)
+            std = math.sqrt(var)
+            burstiness = (std - avg) / (std + avg) if std + avg else MISSING
+            fano = var / avg if avg else MISSING
+        else:
+            var = std = burstiness = fano = MISSING
+        if self.ewm_count:
+            ewm = self.ewm_num * (1 - EWM_DECAY) / (1 - EWM_DECAY ** self.ewm_count)
+            zscore = (self.sum7 / self.ewm_count - avg) / std if std > 0 else MISSING
+        else:
+            ewm = zscore = MISSING
+        return (
+            len(self.os_counts), len(self.phone_counts), logins7, logins30, freq7, round(logins30 / 30, 2),
+            freq7 / (logins30 / 30) - 1, logins7 / logins30, avg, std, var, ewm, burstiness, fano, zscore,
+        )
+
+class LoginAggregator:
+    """
+    Patterns features for every customer, kept up to date login by login.
+    Logins must arrive in time order per customer; older ones are counted
+    in .late and skipped. Customers idle for LOGIN_IDLE_SECONDS are
+    dropped, counted in .evicted. Thread-safe.
+    """
+
+    def __init__(self):
+        self.customers = {}
+        self.events = 0
+        self.late = 0
+        self.evicted = 0
+        # latest login time seen, and logins since the last sweep for idle customers
+        self.latest = None
+        self.since_sweep = 0
+        self.lock = threading.Lock()
+
+    def ingest(self, cst_dim_id: float, t: float, os_name: str, phone: str):
+        """
+        Adds one login; t is in seconds since the epoch.
+        """
+        with self.lock:
+            self._ingest(cst_dim_id, t, os_name, phone)
+
+    def _ingest(self, cst_dim_id, t, os_name, phone):
+        customer = self.customers.get(cst_dim_id)
+        if customer is None:
+            customer = self.customers[cst_dim_id] = CustomerLogins()
+        elif customer.last_time is not None and t < customer.last_time:
+            self.late += 1
+            return
+        customer.advance(t)
+        customer.add(t, os_name, phone)
+        self.events += 1
+        if self.latest is None or t > self.latest:
+            self.latest = t
+        # a sweep costs one step per customer, so sweeping once per that many logins keeps ingest O(1) amortized
+        self.since_sweep += 1
+        if self.since_sweep >= max(len(self.customers), 1024):
+            self.evict_idle()
+
+    def evict_idle(self):
+        self.since_sweep = 0
+        cutoff = self.latest - LOGIN_IDLE_SECONDS
+        idle = [cst_dim_id for cst_dim_id, customer in self.customers.items() if customer.last_time <= cutoff]
+        for cst_dim_id in idle:
+            del self.customers[cst_dim_id]
+        self.evicted += len(idle)
+
+    def ingest_frame(self, logins: pd.DataFrame) -> int:
+        """
+        Adds a batch of logins with LOGIN_COLUMNS, sorted by time first.
+        Times are parsed before sorting: as strings, '2025-1-10' would sort
+        before '2025-1-7'.
+
+        Returns:
+        int: Logins added; the rest were out of order.
+        """
+        try:
+            parsed = pd.to_datetime(logins['logindatetime'])
+        except (ValueError, TypeError):
+            # formats or time zones that differ from row to row
+            parsed = pd.to_datetime(logins['logindatetime'], format='mixed', utc=True)
+        seconds = parsed.to_numpy('datetime64[ns]').astype(np.int64) / 1e9
+        order = np.argsort(seconds, kind='stable')
+        columns = (
+            logins['cst_dim_id'].to_numpy(np.float64)[order].tolist(), seconds[order].tolist(),
+            logins['os'].to_numpy()[order].tolist(), logins['phone_model'].to_numpy()[order].tolist(),
+        )
+        before = self.events
+        with self.lock:
+            for row in zip(*columns):
+                self._ingest(*row)
+        return self.events - before
+
+    def snapshot(self, as_of: datetime = None) -> pd.DataFrame:
+        """
+        Patterns rows for every customer with a login in the 30 days up to
+        as_of (default now), dated as_of's day. Leaves the state alone:
+        customers whose windows reach back past as_of's are scored from a
+        copy, so logins ingested later still count in full.
+
+        Parameters:
+        as_of (datetime): Moment the windows end at; not before any ingested login.
+
+        Returns:
+        pd.DataFrame: Rows with PATTERN_COLUMNS and their dtypes.
+        """
+        as_of = pd.Timestamp(as_of if as_of is not None else datetime.now())
+        t = as_of.value / 1e9
+        ids, categorical, numeric = [], [], []
+        with self.lock:
+            for cst_dim_id, customer in self.customers.items():
+                if customer.last_time is None or customer.last_time <= t - 30 * DAY:
+                    continue
+                if customer.stale(t):
+                    customer = customer.copy()
+                    customer.advance(t)
+                ids.append(cst_dim_id)
+                categorical.append((customer.last_phone, customer.last_os))
+                numeric.append(customer.features())
+        numeric = np.array(numeric, dtype=np.float64).reshape(len(ids), 15)
+        columns = {
+            'transdate': np.full(len(ids), as_of.normalize().to_datetime64(), dtype='datetime64[ns]'),
+            'cst_dim_id': np.array(ids, dtype=np.float64),
+            'monthly_os_changes': numeric[:, 0].astype(np.int64),
+            'monthly_phone_model_changes': numeric[:, 1].astype(np.int64),
+            'last_phone_model_categorical': [phone for phone, _ in categorical],
+            'last_os_categorical': [os_name for _, os_name in categorical],
+            'logins_last_7_days': numeric[:, 2].astype(np.int64),
+            'logins_last_30_days': numeric[:, 3].astype(np.int64),
+        }
+        for i, name in enumerate(list(PATTERN_COLUMNS)[8:], start=4):
+            columns[name] = numeric[:, i]
+        return pd.DataFrame(columns, columns=list(PATTERN_COLUMNS))
+
+    def stats(self) -> dict:
+        return {"customers": len(self.customers), "events": self.events, "late": self.late, "evicted": self.evicted}
+
+aggregator = LoginAggregator()
+_publisher = None
+
+def publish(as_of: datetime = None) -> dict:
+    """
+    Upserts a snapshot of the live features into patterns_store, where
+    /process without a patterns file and /score pick them up.
+    """
+    import patterns_store
+    start = time.perf_counter()
+    patterns = aggregator.snapshot(as_of)
+    if patterns.empty:
+        return {"received": 0}
+    result = patterns_store.upsert_patterns(patterns)
+    print(f"published {len(patterns)} login patterns rows in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return result
+
+def publish_loop():
+    while True:
+        time.sleep(LOGIN_PUBLISH_INTERVAL)
+        try:
+            publish()
+        except Exception as e:
+            print("login patterns publish failed:", e)
+
+def start_publisher():
+    """
+    Starts the thread publishing snapshots every LOGIN_PUBLISH_INTERVAL
+    seconds, if that is set.
+    """
+    global _publisher
+    if _publisher is None and LOGIN_PUBLISH_INTERVAL > 0:
+        _publisher = threading.Thread(target=publish_loop, name="login-publisher", daemon=True)
+        _publisher.start()
@@ -1,71 +1,495 @@
-from fastapi import FastAPI, UploadFile, File
+import os
+import json
+import time
+import shutil
+import hmac
+import asyncio
+import tempfile
+import threading
+import functools
 import pandas as pd
-from io import BytesIO
-import joblib
-from sklearn.metrics import classification_report
-from helpers import validate_transaction_data,validate_patterns_data, identify_separator, merge_transaction_pattern_data, preprocess_merged_data
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Optional, List, Union
+from fastapi import FastAPI, UploadFile, File, Request, Header
+from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
+from starlette.background import BackgroundTask
+import scoring
+import model_registry
+import patterns_store
+import result_cache
+import jobs
+import login_patterns
+import telemetry
+from telemetry import stage
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from helpers import upload_schema, PATTERN_COLUMNS
 app = FastAPI()
 
-PRED_THRESHOLD = 0.3
+# "thread" or "process"; process workers each hold their own copy of the model
+SCORING_EXECUTOR = os.getenv("SCORING_EXECUTOR", "thread")
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", os.cpu_count() or 1))
+# uploads allowed to wait for a free worker before /process answers 503
+SCORING_QUEUE_SIZE = int(os.getenv("SCORING_QUEUE_SIZE", 4))
 
-model = joblib.load("model.pkl")
+# largest batch /score accepts; bigger batches belong on /process
+SCORE_MAX_BATCH = int(os.getenv("SCORE_MAX_BATCH", 1000))
 
-@app.post("/process")
-async def upload_csv(file1: UploadFile = File(...), file2: UploadFile = File(...)):
-    print("reading file1")
-    content1 = await file1.read()
-    sep1 = identify_separator(BytesIO(content1))
-    df1 = pd.read_csv(BytesIO(content1), sep=sep1, encoding='cp1251')
-        
-    print("reading file2")
-    content2 = await file2.read()
-    sep2 = identify_separator(BytesIO(content2))
-    df2 = pd.read_csv(BytesIO(content2), sep=sep2, encoding='cp1251')
-    
-    
-    if df2.shape[1] < df1.shape[1]:
-        df1, df2 = df2, df1
-    # validate data
-    transactions = validate_transaction_data(df1)
-    patterns = validate_patterns_data(df2)
-    if transactions.get("status") == "error":
-        return {"error": transactions["message"], "file": "transactions"}
-    if patterns.get("status") == "error":
-        return {"error": patterns["message"], "file": "patterns"}
-
-    #merge
-    merged_df = merge_transaction_pattern_data(transactions=df1, patterns=df2)
-
-    preprocessed_df = preprocess_merged_data(merged_df)
-
-    temp = preprocessed_df.copy()
-    temp.rename(columns={'target': "expected_target"}, inplace=True)
-    
-    preprocessed_df.drop(columns=['cst_dim_id', 'transdate', 'transdatetime', 'docno', 'target'], inplace=True, errors='ignore')
-    
-    try: 
-        predictions = model.predict_proba(preprocessed_df)[:, 1]
-        temp['target'] = (predictions > PRED_THRESHOLD).astype(int) 
-        result = temp.to_dict(orient='records')
-        
-        # Calculate metrics of target vs expected_target
-        metrics = {
-            "fraud": {
-
-            },
-            "nonfraud": {
-
-            }
-        }
-        if 'expected_target' in temp.columns:
-            y_true = temp['expected_target']
-            y_pred = temp['target']
-            metrics_report = classification_report(y_true, y_pred, output_dict=True)
-            metrics["fraud"] = metrics_report['1']
-            metrics["nonfraud"] = metrics_report['0']
-
-        
-        return {"predictions": result, "metrics": metrics}
+# streaming /process uploads at least this big are scored out of core, chunk by chunk
+CHUNKED_MIN_BYTES = int(os.getenv("CHUNKED_MIN_BYTES", 256 * 1024 * 1024))
+
+if SCORING_EXECUTOR == "process":
+    executor = scoring.worker_pool(SCORING_WORKERS)
+else:
+    executor = ThreadPoolExecutor(max_workers=SCORING_WORKERS)
+
+# /jobs runs here, apart from the executor serving /process and /score
+if SCORING_EXECUTOR == "process":
+    job_executor = scoring.worker_pool(jobs.JOB_WORKERS)
+else:
+    job_executor = ThreadPoolExecutor(max_workers=jobs.JOB_WORKERS)
+
+# shadow scoring with the candidate version runs here, after the response is
+# sent, one request at a time so it never competes with served traffic much
+shadow_executor = ThreadPoolExecutor(max_workers=1)
+# sampled requests allowed to wait for the shadow worker; more are dropped
+# (and counted) instead of piling up in memory
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", 1))
+shadow_slots = threading.BoundedSemaphore(SHADOW_QUEUE_SIZE + 1)
+
+# POST /models answers 403 unless this is set and sent as X-Admin-Token
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN")
+
+# only touched from the event loop, so no lock is needed
+pending_jobs = 0
+
+# filled in by start_scoring; /ready and the scoring endpoints check it
+startup = {"ready": False, "error": None, "load_ms": None, "warmup_ms": None}
+
+def start_scoring():
+    """
+    Loads and warms up the model and the patterns store, then starts and
+    warms the scoring worker processes if there are any. Runs in the background after the server has
+    bound its port, so /healthz answers while the model is still loading.
+    """
+    try:
+        start = time.perf_counter()
+        scoring.load_model()
+        startup["load_ms"] = (time.perf_counter() - start) * 1000
+        startup["warmup_ms"] = scoring.warm_up()
+        patterns_store.get_patterns_index()
+        scoring.freeze_heap()
+        model_registry.start_watcher()
+        login_patterns.start_publisher()
+        if SCORING_EXECUTOR == "process":
+            # workers start on demand; one task each gets them loaded now
+            wait([executor.submit(os.getpid) for _ in range(SCORING_WORKERS)])
+        # jobs queued or running when the server last stopped
+        for job_id in jobs.recover():
+            job_executor.submit(jobs.run, job_id)
+        jobs.start_cleaner()
+        startup["ready"] = True
+        print(f"ready in {(time.perf_counter() - start) * 1000:.0f}ms")
     except Exception as e:
-        return {"error": str(e)}
+        startup["error"] = str(e)
+        print("startup failed:", e)
+
+def queue_full() -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Scoring queue is full, retry later"},
+        headers={"Retry-After": "1"},
+    )
+
+def not_ready() -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"error": startup["error"] or "Model is still loading, retry later"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.on_event("startup")
+async def start_background_loading():
+    asyncio.get_running_loop().run_in_executor(None, start_scoring)
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    executor.shutdown(wait=True)
+    # unfinished jobs stay on disk and run again after a restart
+    job_executor.shutdown(wait=False, cancel_futures=True)
+    shadow_executor.shutdown(wait=False, cancel_futures=True)
+    scoring.shutdown_partition_pool()
+
+# latency and stages of these endpoints are recorded on /metrics
+app.add_middleware(telemetry.StageTimingMiddleware, endpoints={"/process", "/score"})
+
+# media types of the /process response modes
+MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+def response_format(request: Request, format: Optional[str]) -> str:
+    """
+    Picks the /process response mode from the ?format= query parameter,
+    falling back to the Accept header. Returns one of MEDIA_TYPES' keys.
+    """
+    if format:
+        # unknown values stream NDJSON, as they always did
+        return format.lower() if format.lower() in MEDIA_TYPES else "ndjson"
+    accept = request.headers.get("accept", "")
+    for mode in ("ndjson", "csv", "parquet", "arrow"):
+        if MEDIA_TYPES[mode] in accept:
+            return mode
+    return "json"
+
+class Transaction(BaseModel):
+    cst_dim_id: float
+    transdatetime: str
+    transdate: Optional[str] = None
+    amount: float
+    docno: int
+    direction: str
+
+def render_json(result: dict) -> bytes:
+    return JSONResponse(content=result).body
+
+def is_patterns_upload(upload: UploadFile) -> bool:
+    head = upload.file.read(65536)
+    upload.file.seek(0)
+    return upload_schema(upload.file, head) is PATTERN_COLUMNS
+
+def spool_upload(upload: UploadFile) -> str:
+    """
+    Copies an upload to a named temporary file in 1 MB pieces and returns
+    its path, so large files never have to fit in memory.
+    """
+    with tempfile.NamedTemporaryFile(prefix="transactions-", suffix=".upload", delete=False) as f:
+        shutil.copyfileobj(upload.file, f, 1024 * 1024)
+        return f.name
+
+async def run_scoring(version: model_registry.ModelVersion, func, *args):
+    """
+    Runs a scoring call on the executor with the model version the request
+    started with, and counts its latency against that version. Stages the
+    worker timed are added to the request's.
+
+    Threads get the version itself, so it can't be unloaded under them by
+    later swaps; worker processes get its spec and load it if they must.
+    """
+    start = time.perf_counter()
+    ok = False
+    spec = version.spec if SCORING_EXECUTOR == "process" else version
+    try:
+        result, timings = await asyncio.get_running_loop().run_in_executor(executor, telemetry.timed, func, *args, spec)
+        ok = True
+        if timings is not None and telemetry.current() is not None:
+            telemetry.current().merge(timings)
+        return result
+    finally:
+        model_registry.record(version.version, (time.perf_counter() - start) * 1000, ok)
+
+def shadow(func, *args):
+    """
+    Hands a request to shadow_executor for scoring with the candidate
+    version, if there is one and this request was sampled. Dropped when
+    SHADOW_QUEUE_SIZE requests are already waiting.
+    """
+    candidate = model_registry.candidate()
+    if candidate is not None and model_registry.should_shadow():
+        if not shadow_slots.acquire(blocking=False):
+            model_registry.record_dropped(candidate.version)
+            return
+        future = shadow_executor.submit(func, *args, candidate.spec)
+        future.add_done_callback(lambda _: shadow_slots.release())
+
+def remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+async def process_chunked(file1: UploadFile, file2: Optional[UploadFile], mode: str, version: model_registry.ModelVersion, options: dict):
+    """
+    /process for uploads too big to hold in memory: the transactions file
+    is spooled to disk and scored chunk by chunk into a temporary output
+    file, which is then sent back and deleted. Results are not cached.
+    """
+    loop = asyncio.get_running_loop()
+    if file2 is not None and await loop.run_in_executor(None, is_patterns_upload, file1):
+        file1, file2 = file2, file1
+    # patterns files are small, so they are still read whole
+    patterns_content = await file2.read() if file2 is not None else None
+    with stage("spool_upload"):
+        transactions_path = await loop.run_in_executor(None, spool_upload, file1)
+    out_path = transactions_path + ".out"
+    try:
+        metrics = await run_scoring(
+            version, functools.partial(scoring.score_file_chunked, **options), transactions_path, patterns_content, out_path, mode, scoring.CHUNK_ROWS,
+        )
+    except BaseException:
+        remove_files(transactions_path, out_path)
+        raise
+    if "error" in metrics:
+        remove_files(transactions_path, out_path)
+        return metrics
+    cleanup = BackgroundTask(remove_files, transactions_path, out_path)
+    if mode == "ndjson":
+        return FileResponse(out_path, media_type=MEDIA_TYPES["ndjson"], background=cleanup)
+    return FileResponse(out_path, media_type=MEDIA_TYPES[mode], headers={"X-Metrics": json.dumps(metrics)}, background=cleanup)
 
+@app.post("/process")
+async def upload_csv(request: Request, file1: UploadFile = File(...), file2: Optional[UploadFile] = File(None), format: Optional[str] = None, chunked: bool = False, sweep: int = 0, probabilities: bool = False):
+    """
+    Scores the uploads. With a target column, sweep=N adds precision,
+    recall and F1 at N thresholds from 0 to 1, PR-AUC and ROC-AUC to the
+    metrics (see scoring.threshold_sweep); probabilities=true keeps each
+    row's fraud probability in the output.
+    """
+    global pending_jobs
+    if not startup["ready"]:
+        return not_ready()
+    if pending_jobs >= SCORING_WORKERS + SCORING_QUEUE_SIZE:
+        return queue_full()
+
+    pending_jobs += 1
+    request.state.timings = telemetry.begin()
+    try:
+        mode = response_format(request, format)
+        options = {"sweep": max(sweep, 0), "probabilities": probabilities}
+        # the whole request is scored with this version, even if another is published meanwhile
+        version = model_registry.current()
+        sizes = [upload.size or 0 for upload in (file1, file2) if upload is not None]
+        # out-of-core scoring needs the fitted preprocessor, so big uploads without one stay in memory
+        large = max(sizes) >= CHUNKED_MIN_BYTES and version.preprocessor is not None
+        if mode != "json" and (chunked or large):
+            return await process_chunked(file1, file2, mode, version, options)
+
+        with stage("read_upload"):
+            content1 = await file1.read()
+            # without file2, patterns come from the store loaded through /patterns
+            content2 = await file2.read() if file2 is not None else None
+        loop = asyncio.get_running_loop()
+
+        # JSON bodies are cached already rendered, streaming modes cache the scored frame
+        kind = "json" if mode == "json" else "frame"
+        patterns_source = "store:" + patterns_store.store_identity() if content2 is None else "upload"
+        with stage("cache_lookup"):
+            key = await loop.run_in_executor(
+                None, result_cache.cache_key,
+                kind, content1, content2 or b"", patterns_source, version.identity, json.dumps(options, sort_keys=True),
+            )
+            cached = await loop.run_in_executor(None, result_cache.get, key)
+
+        if mode == "json":
+            if cached is None:
+                result = await run_scoring(version, functools.partial(scoring.process_uploads, **options), content1, content2)
+                if "error" in result:
+                    return result
+                shadow(scoring.shadow_uploads, content1, content2, [p['target'] for p in result['predictions']])
+                with stage("render"):
+                    cached = await loop.run_in_executor(None, render_json, result)
+                await loop.run_in_executor(None, result_cache.put, key, cached)
+            return Response(content=cached, media_type="application/json")
+
+        if cached is None:
+            cached = await run_scoring(version, functools.partial(scoring.score_uploads, **options), content1, content2)
+            if isinstance(cached, dict):
+                return cached
+            shadow(scoring.shadow_uploads, content1, content2, cached[0]['target'].to_numpy())
+            await loop.run_in_executor(None, result_cache.put, key, cached)
+        temp, metrics = cached
+        if mode in scoring.BINARY_FORMATS:
+            # a Parquet or Arrow file is only readable whole, so it is built before sending
+            with stage("render"):
+                body = await loop.run_in_executor(None, scoring.encode_frame, temp, mode)
+            return Response(content=body, media_type=MEDIA_TYPES[mode], headers={"X-Metrics": json.dumps(metrics)})
+        if mode == "csv":
+            # CSV has no room for a trailing record, so metrics travel in a header
+            return StreamingResponse(
+                scoring.iter_csv(temp),
+                media_type="text/csv",
+                headers={"X-Metrics": json.dumps(metrics)},
+            )
+        return StreamingResponse(scoring.iter_ndjson(temp, metrics), media_type="application/x-ndjson")
+    finally:
+        pending_jobs -= 1
+
+@app.post("/score")
+async def score(request: Request, body: Union[Transaction, List[Transaction]]):
+    """
+    Scores up to SCORE_MAX_BATCH transactions inline. Runs on the scoring
+    executor and counts against the same queue as /process, so a burst of
+    /score calls is answered 503 rather than starving /process.
+    """
+    global pending_jobs
+    if not startup["ready"]:
+        return not_ready()
+    transactions = [body] if isinstance(body, Transaction) else body
+    if len(transactions) > SCORE_MAX_BATCH:
+        return JSONResponse(status_code=413, content={"error": f"At most {SCORE_MAX_BATCH} transactions per /score call"})
+    if pending_jobs >= SCORING_WORKERS + SCORING_QUEUE_SIZE:
+        return queue_full()
+    records = [t.model_dump() for t in transactions]
+
+    pending_jobs += 1
+    request.state.timings = telemetry.begin()
+    try:
+        result = await run_scoring(model_registry.current(), scoring.score_transactions, records)
+    finally:
+        pending_jobs -= 1
+    if "error" in result:
+        if result.get("file") == "transactions":
+            return JSONResponse(status_code=422, content=result)
+        return result
+    shadow(scoring.shadow_transactions, records, [r["target"] for r in result["results"]])
+    return result
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file1: UploadFile = File(...), file2: Optional[UploadFile] = File(None), format: str = "ndjson", sweep: int = 0, probabilities: bool = False):
+    """
+    Queues an upload for scoring in the background and returns its job id
+    at once. Poll GET /jobs/{job_id} for progress and fetch the result from
+    GET /jobs/{job_id}/result when it is done. Takes the same files as
+    /process, and its sweep and probabilities options; format is "ndjson",
+    "csv", "parquet" or "arrow".
+    """
+    if not startup["ready"]:
+        return not_ready()
+    if format not in jobs.EXTENSIONS:
+        return JSONResponse(status_code=400, content={"error": f"format must be one of {', '.join(jobs.EXTENSIONS)}"})
+    loop = asyncio.get_running_loop()
+    if file2 is not None and await loop.run_in_executor(None, is_patterns_upload, file1):
+        file1, file2 = file2, file1
+    state = await loop.run_in_executor(
+        None, jobs.create, file1.file, file2.file if file2 is not None else None, format, model_registry.current().spec, max(sweep, 0), probabilities,
+    )
+    job_executor.submit(jobs.run, state["id"])
+    return state
+
+@app.get("/jobs")
+def list_jobs():
+    return jobs.list_states()
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    state = jobs.read_state(job_id)
+    if state is None:
+        return JSONResponse(status_code=404, content={"error": "No such job"})
+    return state
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    state = jobs.read_state(job_id)
+    if state is None:
+        return JSONResponse(status_code=404, content={"error": "No such job"})
+    if state["status"] != "done":
+        return JSONResponse(status_code=409, content={"error": f"Job is {state['status']}", "status": state["status"], "job_error": state["error"]})
+    headers = {} if state["format"] == "ndjson" else {"X-Metrics": json.dumps(state["metrics"])}
+    return FileResponse(jobs.result_file(state), media_type=MEDIA_TYPES[state["format"]], headers=headers, filename="result" + jobs.EXTENSIONS[state["format"]])
+
+@app.post("/patterns")
+async def upload_patterns(file: UploadFile = File(...), replace: bool = False):
+    content = await file.read()
+    loop = asyncio.get_running_loop()
+    # upserts stay in this process (default thread pool) so the store's
+    # write lock covers all of them
+    return await loop.run_in_executor(None, scoring.load_patterns, content, replace)
+
+class LoginEvent(BaseModel):
+    cst_dim_id: float
+    logindatetime: str
+    os: str
+    phone_model: str
+
+@app.post("/logins")
+async def ingest_logins(body: List[LoginEvent], publish: bool = False):
+    """
+    Feeds raw login events to the live patterns features (see
+    login_patterns). With publish=true a snapshot is written to the
+    patterns store right away; otherwise the background publisher does it
+    every LOGIN_PUBLISH_INTERVAL seconds, if set.
+    """
+    logins = pd.DataFrame([event.model_dump() for event in body], columns=login_patterns.LOGIN_COLUMNS)
+    loop = asyncio.get_running_loop()
+    try:
+        added = await loop.run_in_executor(None, login_patterns.aggregator.ingest_frame, logins)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": f"Could not parse logindatetime: {e}"})
+    result = {"added": added, **login_patterns.aggregator.stats()}
+    if publish:
+        result["published"] = await loop.run_in_executor(None, login_patterns.publish)
+    return result
+
+@app.get("/logins")
+def login_stats():
+    return login_patterns.aggregator.stats()
+
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    if not startup["ready"]:
+        return not_ready()
+    return {
+        "status": "ready",
+        "model": model_registry.current().spec,
+        "load_ms": startup["load_ms"],
+        "warmup_ms": startup["warmup_ms"],
+    }
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/cache")
+def cache_stats():
+    return result_cache.cache_stats()
+
+class ModelPublish(BaseModel):
+    version: str
+    model_path: Optional[str] = None
+    preprocessor_path: Optional[str] = None
+    threshold: float = model_registry.PRED_THRESHOLD
+    role: str = "active"
+    shadow_fraction: Optional[float] = None
+
+@app.get("/models")
+def models():
+    return model_registry.describe()
+
+@app.post("/models")
+async def publish_model(body: ModelPublish, x_admin_token: Optional[str] = Header(None)):
+    """
+    Makes a model version active, or the candidate scored in the shadow of
+    a shadow_fraction of requests. A candidate without model_path removes
+    the candidate. Requests in flight finish on the version they started with.
+    Needs MODEL_ADMIN_TOKEN, and only loads .cbm files from MODELS_DIR.
+    """
+    if not MODEL_ADMIN_TOKEN:
+        return JSONResponse(status_code=403, content={"error": "Publishing models is disabled, set MODEL_ADMIN_TOKEN"})
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), MODEL_ADMIN_TOKEN.encode()):
+        return JSONResponse(status_code=403, content={"error": "Missing or wrong X-Admin-Token"})
+    if body.role not in ("active", "candidate"):
+        return JSONResponse(status_code=400, content={"error": "role must be 'active' or 'candidate'"})
+    if body.model_path is None and body.role == "active":
+        return JSONResponse(status_code=400, content={"error": "model_path is required for the active version"})
+    spec = None
+    if body.model_path is not None:
+        try:
+            model_registry.check_publishable(body.model_path, body.preprocessor_path, forbidden=(jobs.JOBS_DIR,))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        spec = model_registry.make_spec(body.version, body.model_path, body.preprocessor_path, body.threshold)
+    loop = asyncio.get_running_loop()
+    try:
+        # loading a model takes a while; requests keep being served meanwhile
+        return await loop.run_in_executor(None, model_registry.publish, spec, body.role, body.shadow_fraction)
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"error": f"Could not load model version {body.version}: {e}"})
@@ -0,0 +1,332 @@
+import os
+import json
+import time
+import random
+import threading
+from collections import deque
+import numpy as np
+import joblib
+import inference
+from helpers import FeaturePreprocessor
+
+# decision threshold of the default version; registry versions carry their own
+PRED_THRESHOLD = float(os.getenv("PRED_THRESHOLD", 0.3))
+# a joblib pickle, or a native CatBoost .cbm file, which loads without unpickling
+MODEL_PATH = os.getenv("MODEL_PATH", "model.pkl")
+# fitted FeaturePreprocessor, written by fit_preprocessor.py next to the model
+PREPROCESSOR_PATH = os.getenv("PREPROCESSOR_PATH", os.path.join(os.path.dirname(MODEL_PATH), "preprocessor.json"))
+# active and candidate versions, shared by every process serving the model;
+# without it the files above are served as version "default"
+MODEL_REGISTRY_PATH = os.getenv("MODEL_REGISTRY_PATH", "model_registry.json")
+# POST /models only publishes native CatBoost .cbm files from this directory;
+# pickles and anything uploaded elsewhere can't be pointed at over HTTP
+MODELS_DIR = os.getenv("MODELS_DIR", "models")
+# seconds between checks for a new version or changed model files
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", 2))
+# latencies kept per version for the percentiles in describe
+LATENCY_WINDOW = 1000
+
+class ModelVersion:
+    """
+    A loaded model with everything needed to score with it. Requests take
+    one ModelVersion at the start and use it throughout, so a swap never
+    mixes two versions within a request.
+    """
+
+    def __init__(self, spec: dict, model, preprocessor):
+        self.spec = spec
+        self.version = spec["version"]
+        self.identity = spec["identity"]
+        self.threshold = spec["threshold"]
+        self.model = model
+        self.preprocessor = preprocessor
+        # scores feature frames with the model (see inference)
+        self.predictor = inference.make_predictor(model)
+
+_state = {"active": None, "candidate": None, "shadow_fraction": 0.0}
+# loaded versions by identity: the current ones plus the previous active one
+_loaded = {}
+# load errors by identity, so a broken version isn't retried and reported
+# on every check until its files change
+_failed = {}
+_refresh_lock = threading.Lock()
+# serializes the read-modify-write of the registry file by concurrent publishes
+_publish_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {}
+_watcher = None
+
+def file_identity(path: str) -> str:
+    if not path or not os.path.exists(path):
+        return f"{path and os.path.abspath(path)}:missing"
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def spec_identity(spec: dict) -> str:
+    """
+    Identifies a version by name, threshold and the size and modification
+    time of its files, so replacing model.pkl in place is a new version too.
+    """
+    return "|".join([
+        spec["version"], str(spec["threshold"]),
+        file_identity(spec["model_path"]), file_identity(spec.get("preprocessor_path")),
+    ])
+
+def make_spec(version: str, model_path: str, preprocessor_path: str = None, threshold: float = PRED_THRESHOLD) -> dict:
+    spec = {"version": version, "model_path": model_path, "preprocessor_path": preprocessor_path, "threshold": float(threshold)}
+    spec["identity"] = spec_identity(spec)
+    return spec
+
+def default_spec() -> dict:
+    return make_spec("default", MODEL_PATH, PREPROCESSOR_PATH)
+
+def check_publishable(model_path: str, preprocessor_path: str = None, forbidden: tuple = ()):
+    """
+    Raises ValueError unless model_path is a .cbm file inside MODELS_DIR and
+    preprocessor_path, if given, is inside it too. Symlinks are resolved
+    first; paths inside any of the forbidden directories are refused even
+    when MODELS_DIR contains them.
+    """
+    root = os.path.realpath(MODELS_DIR)
+    if not model_path.endswith(".cbm"):
+        raise ValueError("model_path must be a CatBoost .cbm file")
+    for path in (model_path, preprocessor_path):
+        if path is None:
+            continue
+        real = os.path.realpath(path)
+        if os.path.commonpath([root, real]) != root:
+            raise ValueError(f"{path} is outside the models directory")
+        for directory in forbidden:
+            directory = os.path.realpath(directory)
+            if os.path.commonpath([directory, real]) == directory:
+                raise ValueError(f"{path} is not a model file")
+
+def read_registry(path: str = MODEL_REGISTRY_PATH) -> dict:
+    """
+    Returns the wanted active and candidate specs, identities included.
+    """
+    if not os.path.exists(path):
+        return {"active": default_spec(), "candidate": None, "shadow_fraction": 0.0}
+    with open(path) as f:
+        registry = json.load(f)
+    for role in ("active", "candidate"):
+        if registry.get(role):
+            registry[role] = make_spec(**{k: v for k, v in registry[role].items() if k != "identity"})
+    registry.setdefault("candidate", None)
+    registry.setdefault("shadow_fraction", 0.0)
+    return registry
+
+def load_version(spec: dict) -> ModelVersion:
+    """
+    Loads a version's model and preprocessor. Paths ending in .cbm are read
+    with CatBoost's native loader, anything else with joblib.
+    """
+    start = time.perf_counter()
+    path = spec["model_path"]
+    if path.endswith(".cbm"):
+        from catboost import CatBoostClassifier
+        model = CatBoostClassifier()
+        model.load_model(path)
+    else:
+        model = joblib.load(path)
+    preprocessor = None
+    if spec.get("preprocessor_path") and os.path.exists(spec["preprocessor_path"]):
+        preprocessor = FeaturePreprocessor.load(spec["preprocessor_path"])
+    else:
+        print(f"{spec.get('preprocessor_path')} not found, version {spec['version']} uses per-batch feature statistics")
+    print(f"loaded model version {spec['version']} from {path} in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return ModelVersion(spec, model, preprocessor)
+
+def resolve(spec: dict = None) -> ModelVersion:
+    """
+    Returns the loaded version for spec, loading it if this process hasn't
+    yet; with no spec, the active version. Lets a request that picked its
+    version in one process be scored with exactly that version in another.
+    Raises ValueError if the files on disk are no longer the ones spec was
+    made from, rather than scoring with a model under the wrong name.
+    A ModelVersion, as threads of this process are handed, is returned as is.
+    """
+    if spec is None:
+        return current()
+    if isinstance(spec, ModelVersion):
+        return spec
+    version = _loaded.get(spec["identity"])
+    if version is None:
+        identity = spec_identity(spec)
+        if identity != spec["identity"]:
+            raise ValueError(f"the files of model version {spec['version']} changed since it was published")
+        version = load_version(spec)
+        # a file replaced while it was being read
+        if spec_identity(spec) != identity:
+            raise ValueError(f"the files of model version {spec['version']} changed while loading")
+        _loaded[spec["identity"]] = version
+    return version
+
+def try_resolve(spec: dict, role: str) -> ModelVersion:
+    """
+    resolve for refresh: returns None instead of raising when spec doesn't
+    load, reporting each broken version once.
+    """
+    if spec["identity"] in _failed:
+        return None
+    try:
+        return resolve(spec)
+    except Exception as e:
+        _failed[spec["identity"]] = str(e)
+        print(f"{role} model version {spec['version']} failed to load: {e}")
+        return None
+
+def current() -> ModelVersion:
+    """
+    Returns the active version, loading it on first use.
+    """
+    if _state["active"] is None:
+        refresh()
+    return _state["active"]
+
+def candidate() -> ModelVersion:
+    return _state["candidate"]
+
+def should_shadow() -> bool:
+    return _state["candidate"] is not None and random.random() < _state["shadow_fraction"]
+
+def refresh() -> bool:
+    """
+    Brings this process in line with the registry file: loads any new
+    active or candidate version, then swaps it in with a single assignment.
+    Requests keep scoring with the old version while the new one loads.
+
+    A candidate that fails to load is dropped; an active version that fails
+    leaves the previous one serving, or the default files on first start.
+    Only if nothing loads at all does this raise.
+
+    Returns:
+    bool: Whether anything changed.
+    """
+    global _state, _loaded
+    with _refresh_lock:
+        previous = _state
+        try:
+            wanted = read_registry()
+        except (OSError, ValueError, TypeError) as e:
+            # a registry written by hand with a typo; keep serving what's loaded
+            print("could not read the model registry:", e)
+            if previous["active"] is not None:
+                return False
+            wanted = {"active": None, "candidate": None, "shadow_fraction": 0.0}
+        active = try_resolve(wanted["active"], "active") if wanted["active"] else None
+        if active is None:
+            active = previous["active"] or resolve(default_spec())
+        shadow = try_resolve(wanted["candidate"], "candidate") if wanted["candidate"] else None
+        if previous["active"] is active and previous["candidate"] is shadow and previous["shadow_fraction"] == wanted["shadow_fraction"]:
+            return False
+        _state = {"active": active, "candidate": shadow, "shadow_fraction": float(wanted["shadow_fraction"])}
+        keep = [v for v in (active, shadow, previous["active"]) if v is not None]
+        _loaded = {v.identity: v for v in keep}
+        if previous["active"] is not active:
+            old = previous["active"].version if previous["active"] else None
+            print(f"active model version {old} -> {active.version} (threshold {active.threshold})")
+        return True
+
+def publish(spec: dict, role: str = "active", shadow_fraction: float = None) -> dict:
+    """
+    Makes spec the active or candidate version (role="candidate" with spec
+    None removes the candidate). The registry file is written atomically;
+    this process swaps as soon as the version is loaded, other processes
+    within MODEL_WATCH_INTERVAL.
+
+    Returns:
+    dict: The registry after the change.
+    """
+    if spec is not None:
+        # fail here, before other processes are pointed at a version that doesn't load
+        resolve(spec)
+        _failed.pop(spec["identity"], None)
+    with _publish_lock:
+        registry = read_registry()
+        registry[role] = spec
+        if shadow_fraction is not None:
+            registry["shadow_fraction"] = float(shadow_fraction)
+        for key in ("active", "candidate"):
+            if registry[key]:
+                registry[key] = {k: v for k, v in registry[key].items() if k != "identity"}
+        # a temporary file of its own, in case another process publishes at the same moment
+        tmp_path = f"{MODEL_REGISTRY_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(registry, f, indent=2)
+        os.replace(tmp_path, MODEL_REGISTRY_PATH)
+    refresh()
+    return describe()
+
+def watch_loop():
+    while True:
+        time.sleep(MODEL_WATCH_INTERVAL)
+        try:
+            refresh()
+        except Exception as e:
+            # a half-copied model file fails to load; the old version keeps serving
+            print("model refresh failed:", e)
+
+def start_watcher():
+    """
+    Starts the background thread that picks up new versions, once per process.
+    """
+    global _watcher
+    if _watcher is None:
+        _watcher = threading.Thread(target=watch_loop, name="model-watcher", daemon=True)
+        _watcher.start()
+
+def record(version: str, elapsed_ms: float, ok: bool = True, kind: str = "requests"):
+    """
+    Counts a scoring call and its latency against a version. kind is
+    "requests" for served traffic and "shadow" for shadow scoring.
+    """
+    with _stats_lock:
+        stats = _stats.setdefault(version, {})
+        entry = stats.setdefault(kind, {"count": 0, "errors": 0, "latency_ms": deque(maxlen=LATENCY_WINDOW)})
+        entry["count"] += 1
+        entry["errors"] += 0 if ok else 1
+        entry["latency_ms"].append(elapsed_ms)
+
+def record_shadow(version: str, elapsed_ms: float, rows: int, disagreements: int):
+    """
+    Counts a shadow scoring pass and how many decisions differed from the
+    active version's.
+    """
+    record(version, elapsed_ms, kind="shadow")
+    with _stats_lock:
+        entry = _stats[version]["shadow"]
+        entry["rows"] = entry.get("rows", 0) + rows
+        entry["disagreements"] = entry.get("disagreements", 0) + disagreements
+
+def record_dropped(version: str):
+    """
+    Counts a request sampled for shadow scoring but skipped because the
+    shadow worker was still busy.
+    """
+    with _stats_lock:
+        entry = _stats.setdefault(version, {}).setdefault("shadow", {"count": 0, "errors": 0, "latency_ms": deque(maxlen=LATENCY_WINDOW)})
+        entry["dropped"] = entry.get("dropped", 0) + 1
+
+def describe() -> dict:
+    """
+    The active and candidate specs, the shadow fraction and per-version stats.
+    """
+    with _stats_lock:
+        versions = {}
+        for version, kinds in _stats.items():
+            versions[version] = {}
+            for kind, entry in kinds.items():
+                latencies = np.asarray(entry["latency_ms"]) if entry["latency_ms"] else np.zeros(1)
+                versions[version][kind] = {
+                    **{k: v for k, v in entry.items() if k != "latency_ms"},
+                    "latency_ms_p50": float(np.percentile(latencies, 50)),
+                    "latency_ms_p99": float(np.percentile(latencies, 99)),
+                }
+    state = _state
+    return {
+        "active": state["active"].spec if state["active"] else None,
+        "candidate": state["candidate"].spec if state["candidate"] else None,
+        "shadow_fraction": state["shadow_fraction"],
+        "versions": versions,
+    }
@@ -0,0 +1,73 @@
+import os
+import time
+import threading
+import pandas as pd
+from helpers import build_patterns_index
+
+# Parquet file holding every patterns row loaded through /patterns
+PATTERNS_STORE_PATH = os.getenv("PATTERNS_STORE_PATH", "patterns_store.parquet")
+
+# Per-process cache of the stored rows and their join index. Scoring worker
+# processes keep their own copy and reload it when the file changes.
+_patterns = None
+_patterns_index = None
+_loaded_mtime = None
+_write_lock = threading.Lock()
+
+def _load(path: str):
+    global _patterns, _patterns_index, _loaded_mtime
+    start = time.perf_counter()
+    mtime = os.stat(path).st_mtime_ns
+    patterns = pd.read_parquet(path)
+    _patterns_index = build_patterns_index(patterns)
+    _patterns = patterns
+    _loaded_mtime = mtime
+    print(f"loaded {len(_patterns_index)} pattern keys from {path} in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+def get_patterns_index(path: str = PATTERNS_STORE_PATH):
+    """
+    Returns the join index (see build_patterns_index) for the stored
+    patterns, or None if nothing has been stored yet. Reloads from disk when
+    another process has written a newer file.
+    """
+    if not os.path.exists(path):
+        return None
+    if _loaded_mtime != os.stat(path).st_mtime_ns:
+        _load(path)
+    return _patterns_index
+
+def store_identity(path: str = PATTERNS_STORE_PATH) -> str:
+    """
+    Identifies the current store contents; changes on every upsert.
+    """
+    if not os.path.exists(path):
+        return ""
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def upsert_patterns(patterns: pd.DataFrame, replace: bool = False, path: str = PATTERNS_STORE_PATH) -> dict:
+    """
+    Adds validated patterns rows to the store. Rows whose (cst_dim_id,
+    transdate) is already stored replace the old row. With replace=True the
+    store is rebuilt from patterns alone.
+
+    The file is written to a temporary path and renamed into place, so
+    readers never see a half-written store.
+
+    Parameters:
+    patterns (pd.DataFrame): Validated patterns data.
+    replace (bool): Drop the existing store contents first.
+
+    Returns:
+    dict: Rows received and pattern keys now stored.
+    """
+    received = len(patterns)
+    with _write_lock:
+        if not replace and get_patterns_index(path) is not None:
+            patterns = pd.concat([_patterns, patterns], ignore_index=True)
+        patterns = patterns.drop_duplicates(subset=['cst_dim_id', 'transdate'], keep='last')
+        tmp_path = path + ".tmp"
+        patterns.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        _load(path)
+        return {"received": received, "keys": len(_patterns_index)}
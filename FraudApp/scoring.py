@@ -0,0 +1,741 @@
+import os
+import gc
+import json
+import time
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+import patterns_store
+import model_registry
+import telemetry
+from telemetry import stage
+from model_registry import PRED_THRESHOLD, MODEL_PATH, PREPROCESSOR_PATH
+from helpers import TRANSACTION_COLUMNS, PATTERN_COLUMNS, validate_transaction_data, validate_patterns_data, read_upload_typed, iter_upload_typed, compact_frame, build_patterns_index, join_transactions_patterns, parse_datetime, preprocess_merged_data, FeaturePreprocessor
+
+# one merged transaction+patterns row scored at startup, before the service reports ready
+WARMUP_SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "warmup_sample.json")
+# rows serialized per chunk by the streaming response modes
+STREAM_CHUNK_ROWS = 10000
+# transactions read per chunk by score_file_chunked
+CHUNK_ROWS = int(os.getenv("CHUNK_ROWS", 200000))
+# processes featurize+predict is split across for big batches; 1 scores in the calling process
+PARTITION_WORKERS = int(os.getenv("PARTITION_WORKERS", 1))
+# batches smaller than this aren't worth shipping to the partition pool
+PARTITION_MIN_ROWS = int(os.getenv("PARTITION_MIN_ROWS", 100000))
+# how worker processes are started; a forked child would inherit locks held by
+# this process's threads (the model watcher's among them) and could deadlock on one
+WORKER_START_METHOD = os.getenv("WORKER_START_METHOD", "spawn")
+# categoricals, float32 and downcast flags from ingestion through predict_proba
+COMPACT_FRAMES = os.getenv("COMPACT_FRAMES", "0") == "1"
+# response formats written by FrameWriter rather than as text
+BINARY_FORMATS = ("parquet", "arrow")
+# thresholds a threshold sweep reports at most, which keeps it small enough for the X-Metrics header
+SWEEP_MAX_POINTS = int(os.getenv("SWEEP_MAX_POINTS", 201))
+
+_partition_pool = None
+# set by init_worker: worker processes score in place rather than through a
+# partition pool of their own, which nobody would shut down
+_in_worker = False
+
+def load_model() -> model_registry.ModelVersion:
+    """
+    Loads the active model version (see model_registry) in this process and
+    returns it.
+    """
+    model_registry.refresh()
+    return model_registry.current()
+
+def warm_up(path: str = WARMUP_SAMPLE_PATH) -> float:
+    """
+    Runs the bundled sample row through the whole /process pipeline once,
+    as a transactions and a patterns CSV, so the first real request doesn't
+    pay for lazy imports (the CSV engine, the cp1251 codec) or the model's
+    lazy initialization.
+
+    Returns:
+    float: Milliseconds the warm-up took.
+    """
+    start = time.perf_counter()
+    with open(path) as f:
+        sample = pd.DataFrame.from_records(json.load(f))
+    # /process requires a label column
+    transactions = sample.assign(target=0)[list(TRANSACTION_COLUMNS)].to_csv(index=False).encode('cp1251')
+    patterns = sample[list(PATTERN_COLUMNS)].to_csv(index=False).encode('cp1251')
+    result = process_uploads(transactions, patterns)
+    if "error" in result:
+        raise ValueError(f"warm-up failed: {result['error']}")
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"warm-up took {elapsed:.1f}ms")
+    return elapsed
+
+def freeze_heap():
+    """
+    Moves everything allocated so far (modules, the model, warm-up garbage
+    excluded) out of the garbage collector's reach. Otherwise the first
+    request after startup triggers a full collection over all of it, which
+    took about 100ms.
+    """
+    gc.collect()
+    gc.freeze()
+
+def init_worker():
+    """
+    Initializer of scoring and partition worker processes: each loads the
+    model once and warms it up, instead of doing either per task, and
+    watches the registry for new versions. Workers never partition: the
+    pool they're in already spreads the work over processes.
+    """
+    global _in_worker
+    _in_worker = True
+    load_model()
+    warm_up()
+    freeze_heap()
+    model_registry.start_watcher()
+
+def featurize(merged_df: pd.DataFrame, version: model_registry.ModelVersion) -> pd.DataFrame:
+    """
+    Applies the version's fitted preprocessor, or per-batch statistics if it
+    has none.
+    """
+    if version.preprocessor is not None:
+        return version.preprocessor.transform(merged_df)
+    return preprocess_merged_data(merged_df)
+
+def score_frame(merged_df: pd.DataFrame, version: model_registry.ModelVersion, stats: dict = None) -> pd.DataFrame:
+    """
+    Featurizes and scores joined transactions.
+
+    Parameters:
+    merged_df (pd.DataFrame): Output of join_transactions_patterns.
+    version (ModelVersion): Model, preprocessor and threshold to score with.
+    stats (dict): Feature statistics to use instead of the fitted
+        preprocessor (see feature_stats).
+
+    Returns:
+    pd.DataFrame: The features with target renamed to expected_target, and
+        the fraud probability (float32) and predicted target added.
+    """
+    with stage("featurize") as current:
+        scored = preprocess_merged_data(merged_df, stats) if stats is not None else featurize(merged_df, version)
+        if COMPACT_FRAMES:
+            compact_frame(scored, downcast_ints=True)
+        current.rows = len(scored)
+    with stage("predict") as current:
+        features = scored.drop(columns=['cst_dim_id', 'transdate', 'transdatetime', 'docno', 'target'], errors='ignore')
+        predictions = version.predictor.predict(features)
+        current.rows = len(features)
+        del features
+
+    scored.rename(columns={'target': "expected_target"}, inplace=True)
+    scored['probability'] = predictions.astype(np.float32)
+    scored['target'] = (predictions > version.threshold).astype(int)
+    return scored
+
+def score_partition(merged_df: pd.DataFrame, spec: dict, stats: dict) -> pd.DataFrame:
+    """
+    score_frame for one partition, run inside a partition worker with the
+    version the request started with.
+    """
+    return score_frame(merged_df, model_registry.resolve(spec), stats)
+
+def worker_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    A process pool of workers started with WORKER_START_METHOD, each loading
+    the model once through init_worker.
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, mp_context=multiprocessing.get_context(WORKER_START_METHOD))
+
+def partition_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process pool partitions are scored in, starting it on first
+    use. Each worker loads the model once through init_worker.
+    """
+    global _partition_pool
+    if _partition_pool is None:
+        _partition_pool = worker_pool(PARTITION_WORKERS)
+    return _partition_pool
+
+def shutdown_partition_pool():
+    global _partition_pool
+    if _partition_pool is not None:
+        _partition_pool.shutdown(wait=True)
+        _partition_pool = None
+# set by init_worker: worker processes score in place rather than through a
+# partition pool of their own, which nobody would shut down
+_in_worker = False
+
+def use_partitions(merged_df: pd.DataFrame) -> bool:
+    return PARTITION_WORKERS > 1 and not _in_worker and len(merged_df) >= PARTITION_MIN_ROWS
+
+def score_partitioned(merged_df: pd.DataFrame, version: model_registry.ModelVersion, partitions: int = None) -> pd.DataFrame:
+    """
+    score_frame spread over the partition pool. Rows are split by a hash of
+    cst_dim_id, so each client's transactions stay together, and the scored
+    partitions are put back in the original row order.
+
+    Feature statistics are taken from the fitted preprocessor, or computed
+    once over the whole frame, so the result is the same as score_frame's.
+    """
+    partitions = partitions or PARTITION_WORKERS
+    if version.preprocessor is not None:
+        stats = version.preprocessor.stats
+    else:
+        stats = FeaturePreprocessor().fit(merged_df).stats
+
+    buckets = pd.util.hash_array(merged_df['cst_dim_id'].to_numpy()) % partitions
+    pool = partition_pool()
+    futures = [
+        pool.submit(score_partition, merged_df[buckets == bucket], version.spec, stats)
+        for bucket in range(partitions)
+    ]
+    # the join keeps the transactions' RangeIndex, so sorting restores the input order
+    return pd.concat([future.result() for future in futures]).sort_index()
+
+def score_uploads(content1: bytes, content2: bytes = None, spec: dict = None, sweep: int = 0, probabilities: bool = False):
+    """
+    Runs the CPU-bound part of /process: parsing, validation, merge,
+    feature engineering and prediction.
+
+    Parameters:
+    content1 (bytes): Body of the first uploaded CSV file.
+    content2 (bytes): Body of the second uploaded CSV file, or None to take
+        patterns from patterns_store.
+    spec (dict | ModelVersion): Model version to score with (see
+        model_registry.resolve), by default the active one.
+    sweep (int): Thresholds to report precision/recall/F1 at in
+        metrics["sweep"] (see threshold_sweep); 0 leaves it out. Needs a
+        target column.
+    probabilities (bool): Whether to keep the probability column.
+
+    Returns:
+    dict | tuple: An error dict, or the scored DataFrame and the metrics dict.
+    """
+    try:
+        version = model_registry.resolve(spec)
+    except Exception as e:
+        # the files of a version no longer loaded here were replaced since the request started
+        return {"error": f"Could not load the model version: {e}"}
+
+    with stage("parse") as current:
+        try:
+            df1 = read_upload_typed(content1)
+        except ValueError as e:
+            return {"error": f"Could not read file1: {e}"}
+        current.rows = len(df1)
+
+    if content2 is None:
+        patterns_index = patterns_store.get_patterns_index()
+        if patterns_index is None:
+            return {"error": "No patterns file uploaded and the patterns store is empty", "file": "patterns"}
+        with stage("validate"):
+            transactions = validate_transaction_data(df1)
+        if transactions.get("status") == "error":
+            return {"error": transactions["message"], "file": "transactions"}
+        if COMPACT_FRAMES:
+            with stage("compact"):
+                compact_frame(df1)
+    else:
+        with stage("parse") as current:
+            try:
+                df2 = read_upload_typed(content2)
+            except ValueError as e:
+                return {"error": f"Could not read file2: {e}"}
+            current.rows = len(df2)
+
+        if df2.shape[1] < df1.shape[1]:
+            df1, df2 = df2, df1
+        # validate data
+        with stage("validate"):
+            transactions = validate_transaction_data(df1)
+            patterns = validate_patterns_data(df2)
+        if transactions.get("status") == "error":
+            return {"error": transactions["message"], "file": "transactions"}
+        if patterns.get("status") == "error":
+            return {"error": patterns["message"], "file": "patterns"}
+        if COMPACT_FRAMES:
+            with stage("compact"):
+                compact_frame(df1)
+                compact_frame(df2)
+        with stage("index_patterns") as current:
+            patterns_index = build_patterns_index(df2)
+            current.rows = len(df2)
+
+    #merge
+    with stage("join") as current:
+        merged_df, join_stats = join_transactions_patterns(df1, patterns_index)
+        current.rows = len(merged_df)
+
+    try:
+        if use_partitions(merged_df):
+            with stage("score_partitions") as current:
+                temp = score_partitioned(merged_df, version)
+                current.rows = len(temp)
+        else:
+            temp = score_frame(merged_df, version)
+
+        # Calculate metrics of target vs expected_target
+        metrics = {
+            "fraud": {
+
+            },
+            "nonfraud": {
+
+            },
+            "join": join_stats,
+            "model": {"version": version.version, "threshold": version.threshold}
+        }
+        if 'expected_target' in temp.columns:
+            with stage("metrics"):
+                metrics_report = report_from_counts(*confusion_counts(temp['expected_target'], temp['target']))
+                if sweep:
+                    metrics["sweep"] = threshold_sweep(temp['expected_target'].to_numpy(), temp['probability'].to_numpy(), sweep)
+            metrics["fraud"] = metrics_report['1']
+            metrics["nonfraud"] = metrics_report['0']
+        if not probabilities:
+            temp.drop(columns='probability', inplace=True)
+
+        return temp, metrics
+    except Exception as e:
+        return {"error": str(e)}
+
+def process_uploads(content1: bytes, content2: bytes = None, spec: dict = None, sweep: int = 0, probabilities: bool = False) -> dict:
+    """
+    Scores the uploads and builds the classic single-JSON /process body.
+    """
+    scored = score_uploads(content1, content2, spec, sweep, probabilities)
+    if isinstance(scored, dict):
+        return scored
+    temp, metrics = scored
+    with stage("to_records") as current:
+        predictions = temp.to_dict(orient='records')
+        current.rows = len(predictions)
+    return {"predictions": predictions, "metrics": metrics}
+
+def confusion_counts(y_true, y_pred) -> list:
+    """
+    Returns [tp, fp, fn, tn] for binary labels and predictions.
+    """
+    y_true = np.asarray(y_true) == 1
+    y_pred = np.asarray(y_pred) == 1
+    return [int((y_true & y_pred).sum()), int((~y_true & y_pred).sum()), int((y_true & ~y_pred).sum()), int((~y_true & ~y_pred).sum())]
+
+def report_from_counts(tp: int, fp: int, fn: int, tn: int) -> dict:
+    """
+    Builds the per-class part of classification_report(output_dict=True)
+    from confusion counts, with sklearn's formulas so the numbers are
+    identical. Lets metrics be accumulated chunk by chunk, and keeps
+    sklearn, which takes about a second to import, out of the service.
+    Undefined ratios are reported as 0.0, as sklearn does.
+    """
+    def scores(hits, predicted, actual):
+        precision = hits / predicted if predicted else 0.0
+        recall = hits / actual if actual else 0.0
+        f1 = 2 * hits / (predicted + actual) if predicted + actual else 0.0
+        return {"precision": precision, "recall": recall, "f1-score": f1, "support": float(actual)}
+
+    return {
+        "1": scores(tp, tp + fp, tp + fn),
+        "0": scores(tn, tn + fn, tn + fp),
+    }
+
+def threshold_sweep(y_true, probabilities, points: int = 101) -> dict:
+    """
+    Fraud-class precision, recall and F1 at many thresholds at once. The
+    probabilities are sorted a single time; the rows flagged at any
+    threshold are then the ones above its position in the sorted array,
+    and the positives among them come from one cumulative sum. A row is
+    flagged when its probability is above the threshold, as for target.
+
+    Parameters:
+    y_true: Binary labels (expected_target).
+    probabilities: Predicted fraud probabilities.
+    points (int): Evenly spaced thresholds from 0 to 1 to report the curve
+        at, at most SWEEP_MAX_POINTS.
+
+    Returns:
+    dict: The curve as parallel lists (thresholds, flagged rows,
+        precision, recall, F1), the best F1 over every distinct
+        probability with the threshold that gives it, PR-AUC (average
+        precision) and ROC-AUC. An AUC is None when a class is missing.
+        Undefined ratios are 0.0, as in report_from_counts.
+    """
+    p = np.asarray(probabilities, dtype=np.float64)
+    order = np.argsort(p)
+    p = p[order]
+    y = np.asarray(y_true)[order] == 1
+    rows, positives = len(p), int(y.sum())
+    negatives = rows - positives
+    # positives among the k lowest probabilities, for k = 0..rows
+    positives_below = np.concatenate(([0], np.cumsum(y)))
+
+    def curve(below):
+        # rows above position below: flagged, true positives, precision, recall, F1
+        flagged = rows - below
+        hits = positives - positives_below[below]
+        precision = np.divide(hits, flagged, out=np.zeros(len(below)), where=flagged > 0)
+        recall = hits / positives if positives else np.zeros(len(below))
+        f1 = np.divide(2 * hits, flagged + positives, out=np.zeros(len(below)), where=flagged + positives > 0)
+        return flagged, hits, precision, recall, f1
+
+    thresholds = np.linspace(0, 1, min(max(points, 2), SWEEP_MAX_POINTS))
+    flagged, _, precision, recall, f1 = curve(np.searchsorted(p, thresholds, side='right'))
+    result = {
+        "thresholds": np.round(thresholds, 6).tolist(),
+        "flagged": flagged.tolist(),
+        "precision": np.round(precision, 6).tolist(),
+        "recall": np.round(recall, 6).tolist(),
+        "f1": np.round(f1, 6).tolist(),
+        "best_f1": None,
+        "pr_auc": None,
+        "roc_auc": None,
+    }
+    if not rows:
+        return result
+
+    # every distinct probability, highest first, flagging the rows at or above it
+    starts = np.flatnonzero(np.concatenate(([True], p[1:] != p[:-1])))[::-1]
+    flagged, hits, precision, recall, f1 = curve(starts)
+    best = int(np.argmax(f1))
+    start = starts[best]
+    result["best_f1"] = {
+        # the highest threshold that flags the same rows
+        "threshold": float(p[start - 1]) if start else float(np.nextafter(p[0], -np.inf)),
+        "flagged": int(flagged[best]),
+        "precision": float(precision[best]),
+        "recall": float(recall[best]),
+        "f1": float(f1[best]),
+    }
+    if positives:
+        result["pr_auc"] = float(np.sum(np.diff(recall, prepend=0.0) * precision))
+    if positives and negatives:
+        tpr = np.concatenate(([0.0], hits / positives))
+        fpr = np.concatenate(([0.0], (flagged - hits) / negatives))
+        result["roc_auc"] = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    return result
+
+def score_chunk(chunk: pd.DataFrame, patterns_index: pd.DataFrame, version: model_registry.ModelVersion) -> tuple:
+    """
+    Joins, featurizes and scores one validated chunk for score_file_chunked.
+
+    Returns:
+    tuple: The scored DataFrame (see score_frame) and the chunk's join stats.
+    """
+    with stage("join") as current:
+        merged_df, join_stats = join_transactions_patterns(chunk, patterns_index)
+        current.rows = len(merged_df)
+    if use_partitions(merged_df):
+        with stage("score_partitions") as current:
+            scored = score_partitioned(merged_df, version)
+            current.rows = len(scored)
+    else:
+        scored = score_frame(merged_df, version)
+    return scored, join_stats
+
+def score_file_chunked(transactions_path: str, patterns_content: bytes, out_path: str, fmt: str = "ndjson", chunk_rows: int = CHUNK_ROWS, spec: dict = None, progress=None, sweep: int = 0, probabilities: bool = False) -> dict:
+    """
+    Out-of-core variant of score_uploads for files larger than RAM. Reads
+    the transactions file from disk chunk_rows rows at a time, joins each
+    chunk against the in-memory patterns index, featurizes it with the
+    fitted preprocessor and appends the scored rows to out_path, so memory
+    stays bounded by the chunk size and the patterns index.
+
+    Needs a fitted preprocessor: per-batch statistics would differ from
+    chunk to chunk.
+
+    Parameters:
+    transactions_path (str): Transactions CSV, Parquet or Arrow file spooled to disk.
+    patterns_content (bytes): Body of the patterns file, or None to use patterns_store.
+    out_path (str): File the predictions are written to.
+    fmt (str): "ndjson" (with a trailing metrics line), "csv", "parquet" or "arrow".
+    spec (dict | ModelVersion): Model version to score every chunk with, by
+        default the active one.
+    progress (callable): Called after each chunk with the running counts
+        of transactions parsed, joined to a patterns row and scored.
+    sweep (int): As for score_uploads; labels and probabilities of every
+        chunk (5 bytes a row) are kept until the end for it.
+    probabilities (bool): Whether to write the probability column.
+
+    Returns:
+    dict: The metrics, or an error dict.
+    """
+    try:
+        version = model_registry.resolve(spec)
+    except Exception as e:
+        # the files of a version no longer loaded here were replaced since the request started
+        return {"error": f"Could not load the model version: {e}"}
+    if version.preprocessor is None:
+        return {"error": f"Chunked scoring needs a fitted preprocessor for model version {version.version}"}
+
+    if patterns_content is None:
+        patterns_index = patterns_store.get_patterns_index()
+        if patterns_index is None:
+            return {"error": "No patterns file uploaded and the patterns store is empty", "file": "patterns"}
+    else:
+        with stage("parse") as current:
+            try:
+                patterns = read_upload_typed(patterns_content)
+            except ValueError as e:
+                return {"error": f"Could not read the patterns file: {e}", "file": "patterns"}
+            current.rows = len(patterns)
+        with stage("validate"):
+            result = validate_patterns_data(patterns)
+        if result.get("status") == "error":
+            return {"error": result["message"], "file": "patterns"}
+        with stage("index_patterns") as current:
+            patterns_index = build_patterns_index(patterns)
+            current.rows = len(patterns)
+        del patterns
+
+    join_stats = {"transactions": 0, "matched": 0, "unmatched": 0, "incomplete": 0}
+    counts = np.zeros(4, dtype=np.int64)
+    labels, scores = [], []
+    labelled = False
+    scored_rows = 0
+    binary = fmt in BINARY_FORMATS
+    with open(out_path, "wb" if binary else "w", encoding=None if binary else "utf-8") as out:
+        writer = FrameWriter(out, fmt) if binary else None
+        chunks = telemetry.timed_iter("parse", iter_upload_typed(transactions_path, chunk_rows))
+        for i in itertools.count():
+            try:
+                chunk = next(chunks, None)
+            except (ValueError, TypeError, OSError) as e:
+                return {"error": f"Could not read the transactions file: {e}", "file": "transactions", "chunk": i}
+            if chunk is None:
+                break
+            with stage("validate"):
+                result = validate_transaction_data(chunk)
+            if result.get("status") == "error":
+                return {"error": result["message"], "file": "transactions", "chunk": i}
+            if COMPACT_FRAMES:
+                with stage("compact"):
+                    compact_frame(chunk)
+
+            try:
+                scored, chunk_stats = score_chunk(chunk, patterns_index, version)
+            except Exception as e:
+                # as score_uploads reports a batch that fails to featurize or predict
+                return {"error": str(e), "chunk": i}
+            del chunk
+            for name in join_stats:
+                join_stats[name] += chunk_stats[name]
+            if 'expected_target' in scored.columns:
+                labelled = True
+                with stage("metrics"):
+                    counts += confusion_counts(scored['expected_target'], scored['target'])
+                    if sweep:
+                        labels.append(scored['expected_target'].to_numpy() == 1)
+                        scores.append(scored['probability'].to_numpy())
+            if not probabilities:
+                scored.drop(columns='probability', inplace=True)
+
+            with stage("write") as current:
+                if writer is not None:
+                    writer.write(scored)
+                else:
+                    # serialized in slices: to_json on a whole chunk peaks at several times its size
+                    for start in range(0, len(scored), STREAM_CHUNK_ROWS):
+                        piece = scored.iloc[start:start + STREAM_CHUNK_ROWS]
+                        if fmt == "csv":
+                            piece.to_csv(out, index=False, header=out.tell() == 0)
+                        else:
+                            out.write(piece.to_json(orient='records', lines=True, double_precision=15).rstrip("\n") + "\n")
+                current.rows = len(scored)
+            scored_rows += len(scored)
+            if progress is not None:
+                progress({"parsed": join_stats["transactions"], "joined": join_stats["matched"], "scored": scored_rows})
+
+        metrics = {"fraud": {}, "nonfraud": {}, "join": join_stats, "model": {"version": version.version, "threshold": version.threshold}}
+        if labelled:
+            report = report_from_counts(*counts.tolist())
+            metrics["fraud"] = report['1']
+            metrics["nonfraud"] = report['0']
+            if sweep:
+                with stage("metrics"):
+                    metrics["sweep"] = threshold_sweep(np.concatenate(labels), np.concatenate(scores), sweep)
+        if writer is not None:
+            writer.close()
+        elif fmt != "csv":
+            out.write(json.dumps({"metrics": metrics}) + "\n")
+    return metrics
+
+def score_transactions(records: list, spec: dict = None) -> dict:
+    """
+    Scores a few transactions inline for /score. Patterns come from
+    patterns_store and cross-row statistics from the fitted preprocessor, so
+    each row's score doesn't depend on the rest of the batch.
+
+    Parameters:
+    records (list): Transaction dicts with TRANSACTION_COLUMNS except target;
+        transdate may be None and is then taken from transdatetime.
+    spec (dict | ModelVersion): Model version to score with, by default the
+        active one.
+
+    Returns:
+    dict: Per-transaction probability and decision, the docnos that had no
+        patterns row and the model version used; or an error dict, with
+        "file": "transactions" when the records themselves are invalid.
+    """
+    try:
+        version = model_registry.resolve(spec)
+    except Exception as e:
+        # the files of a version no longer loaded here were replaced since the request started
+        return {"error": f"Could not load the model version: {e}"}
+    if version.preprocessor is None:
+        return {"error": f"Model version {version.version} has no fitted preprocessor"}
+    patterns_index = patterns_store.get_patterns_index()
+    if patterns_index is None:
+        return {"error": "The patterns store is empty", "file": "patterns"}
+
+    with stage("parse") as current:
+        df = pd.DataFrame.from_records(records, columns=[c for c in TRANSACTION_COLUMNS if c != 'target'])
+        try:
+            df['transdatetime'] = parse_datetime(df['transdatetime'])
+            if df['transdate'].isna().any():
+                df['transdate'] = df['transdatetime'].dt.normalize()
+            else:
+                df['transdate'] = parse_datetime(df['transdate'])
+        except (ValueError, TypeError) as e:
+            return {"error": f"Could not parse transdatetime or transdate: {e}", "file": "transactions"}
+        current.rows = len(df)
+
+    with stage("join") as current:
+        merged_df, join_stats = join_transactions_patterns(df, patterns_index)
+        current.rows = len(merged_df)
+    with stage("featurize") as current:
+        features = version.preprocessor.transform(merged_df)
+        current.rows = len(features)
+    with stage("predict") as current:
+        features = features.drop(columns=['cst_dim_id', 'transdate', 'transdatetime', 'docno', 'target'], errors='ignore')
+        predictions = version.predictor.predict(features)
+        current.rows = len(features)
+
+    docnos = merged_df['docno'].to_numpy().tolist()
+    results = [
+        {"docno": docno, "probability": p, "target": int(p > version.threshold)}
+        for docno, p in zip(docnos, np.asarray(predictions, dtype=float).tolist())
+    ]
+    matched = set(docnos)
+    return {
+        "results": results,
+        "unmatched": [d for d in df['docno'].to_numpy().tolist() if d not in matched],
+        "model": version.version,
+    }
+
+def shadow_uploads(content1: bytes, content2: bytes, decisions: np.ndarray, spec: dict):
+    """
+    Scores a /process request again with the candidate version given by
+    spec and records how many decisions differ from the active version's.
+    Runs after the response has been sent; nothing here reaches the client.
+    """
+    start = time.perf_counter()
+    scored = score_uploads(content1, content2, spec)
+    if isinstance(scored, dict):
+        model_registry.record(spec["version"], (time.perf_counter() - start) * 1000, ok=False, kind="shadow")
+        return
+    candidate_decisions = scored[0]['target'].to_numpy()
+    disagreements = int((candidate_decisions != decisions).sum()) if len(candidate_decisions) == len(decisions) else len(decisions)
+    model_registry.record_shadow(spec["version"], (time.perf_counter() - start) * 1000, len(decisions), disagreements)
+
+def shadow_transactions(records: list, decisions: list, spec: dict):
+    """
+    shadow_uploads for /score requests.
+    """
+    start = time.perf_counter()
+    result = score_transactions(records, spec)
+    if "error" in result:
+        model_registry.record(spec["version"], (time.perf_counter() - start) * 1000, ok=False, kind="shadow")
+        return
+    candidate_decisions = [r["target"] for r in result["results"]]
+    disagreements = sum(a != b for a, b in zip(candidate_decisions, decisions))
+    model_registry.record_shadow(spec["version"], (time.perf_counter() - start) * 1000, len(decisions), disagreements)
+
+def load_patterns(content: bytes, replace: bool = False) -> dict:
+    """
+    Parses and validates an uploaded patterns file (CSV, Parquet or Arrow)
+    and upserts it into patterns_store.
+    """
+    try:
+        df = read_upload_typed(content)
+    except ValueError as e:
+        return {"error": f"Could not read the patterns file: {e}", "file": "patterns"}
+    patterns = validate_patterns_data(df)
+    if patterns.get("status") == "error":
+        return {"error": patterns["message"], "file": "patterns"}
+    return {"status": "success", **patterns_store.upsert_patterns(df, replace=replace)}
+
+def iter_ndjson(df: pd.DataFrame, metrics: dict, chunk_rows: int = STREAM_CHUNK_ROWS):
+    """
+    Yields predictions as NDJSON, one record per line, serialized chunk_rows
+    rows at a time. The last line is a {"metrics": ...} record.
+    """
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_json(orient='records', lines=True, double_precision=15).rstrip("\n") + "\n"
+    yield json.dumps({"metrics": metrics}) + "\n"
+
+def iter_csv(df: pd.DataFrame, chunk_rows: int = STREAM_CHUNK_ROWS):
+    """
+    Yields predictions as CSV text, serialized chunk_rows rows at a time.
+    """
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0)
+
+class FrameWriter:
+    """
+    Writes scored DataFrames to one Parquet or Arrow IPC file, chunk after
+    chunk. The first chunk fixes the schema and later ones are converted to
+    it, so a chunk where a column came out all-null still fits. Metrics
+    travel outside the file, as for CSV.
+    """
+
+    def __init__(self, sink, fmt: str):
+        self.sink = sink
+        self.fmt = fmt
+        self.writer = None
+        self.schema = None
+
+    def write(self, df: pd.DataFrame):
+        import pyarrow
+        if self.writer is None:
+            self.schema = pyarrow.Schema.from_pandas(df, preserve_index=False)
+            if self.fmt == "parquet":
+                from pyarrow import parquet
+                self.writer = parquet.ParquetWriter(self.sink, self.schema)
+            else:
+                self.writer = pyarrow.ipc.new_file(self.sink, self.schema)
+        self.writer.write_table(pyarrow.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.writer is None:
+            # nothing scored: still a valid, empty file
+            self.write(pd.DataFrame())
+        self.writer.close()
+
+def write_frame(df: pd.DataFrame, metrics: dict, out_path: str, fmt: str):
+    """
+    Writes scored predictions to out_path in any /process format, as the
+    chunked path would have: NDJSON ends with a metrics line, the other
+    formats leave metrics out.
+    """
+    if fmt in BINARY_FORMATS:
+        with open(out_path, "wb") as out:
+            writer = FrameWriter(out, fmt)
+            writer.write(df)
+            writer.close()
+        return
+    pieces = iter_csv(df) if fmt == "csv" else iter_ndjson(df, metrics)
+    with open(out_path, "w", encoding="utf-8") as out:
+        out.writelines(pieces)
+
+def encode_frame(df: pd.DataFrame, fmt: str) -> bytes:
+    """
+    Serializes scored predictions as a Parquet or Arrow IPC file body, for
+    the in-memory /process path.
+    """
+    import pyarrow
+    sink = pyarrow.BufferOutputStream()
+    writer = FrameWriter(sink, fmt)
+    writer.write(df)
+    writer.close()
+    return sink.getvalue().to_pybytes()
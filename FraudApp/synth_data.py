@@ -0,0 +1,179 @@
+"""
+Synthetic transactions and patterns CSVs at any scale, for benchmarks.
+
+Usage:
+    python synth_data.py --transactions 1000000 --patterns 100000 [--hit-rate 0.97] [--seed 0] [--out-dir synth]
+
+Writes transactions.csv and patterns.csv in the exact format of the bundled
+transactions_cleaned.csv and patterns_cleaned.csv. Rows are clones of real
+rows under new customer ids: copy k of real customer c gets id
+c + k * 2**32, so each copy keeps its customer's pattern history, dates and
+feature values. A matching transaction is a clone of a real transaction
+that joined, pointed at a copy of the same customer, so it joins the clone
+of the same pattern row and feature/target relationships (and with them
+the model's score distribution) carry over. Non-matching transactions get
+an id no pattern copy uses. docno is renumbered to stay unique.
+
+Both files are written in chunks, so memory hardly grows with size: 1e7
+transactions peak at about 500 MB, 1e6 at about 400 MB.
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from helpers import read_csv_typed, join_key, JOIN_DAY_BITS
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+TRANSACTIONS_CSV = os.path.join(ROOT, "transactions_cleaned.csv")
+PATTERNS_CSV = os.path.join(ROOT, "patterns_cleaned.csv")
+
+# spacing between copies of a customer id; above every real id
+ID_STRIDE = 2 ** 32
+# copies that fit in the id bits of the packed join key, one kept for non-matching ids
+MAX_COPIES = 2 ** (63 - JOIN_DAY_BITS) // ID_STRIDE - 2
+# rows built and written per to_csv call
+WRITE_CHUNK_ROWS = 500_000
+
+def load_real(transactions_path: str = TRANSACTIONS_CSV, patterns_path: str = PATTERNS_CSV) -> dict:
+    """
+    Reads the real files twice: as raw strings, which clones are copied
+    from verbatim, and typed, to find which transactions join which
+    pattern row.
+    """
+    real = {}
+    for name, path in (("transactions", transactions_path), ("patterns", patterns_path)):
+        with open(path, "rb") as f:
+            content = f.read()
+        real[name + "_raw"] = pd.read_csv(path, encoding='cp1251', dtype=str, keep_default_na=False)
+        real[name] = read_csv_typed(content)
+
+    pattern_keys = join_key(real["patterns"]['cst_dim_id'], real["patterns"]['transdate'])
+    transaction_keys = join_key(real["transactions"]['cst_dim_id'], real["transactions"]['transdate'])
+    real["matched"] = np.flatnonzero(np.isin(transaction_keys, pattern_keys[pattern_keys >= 0]))
+    real["hit_rate"] = len(real["matched"]) / len(transaction_keys)
+    return real
+
+def plan_patterns(real: dict, rows: int, rng: np.random.Generator) -> dict:
+    """
+    Decides which copies of which customers make up rows pattern rows:
+    rows // len(real patterns) full copies plus one partial copy made of
+    whole customers, so histories are never cut in half.
+    """
+    patterns = real["patterns"]
+    full_copies, remainder = divmod(rows, len(patterns))
+    if full_copies + 1 > MAX_COPIES:
+        raise ValueError(f"At most {MAX_COPIES * len(patterns)} pattern rows fit in the join key")
+    customers = patterns['cst_dim_id'].to_numpy()
+    partial_customers = np.empty(0, dtype=customers.dtype)
+    if remainder:
+        unique, counts = np.unique(customers, return_counts=True)
+        order = rng.permutation(len(unique))
+        taken = np.searchsorted(np.cumsum(counts[order]), remainder) + 1
+        partial_customers = unique[order[:taken]]
+    partial_rows = np.flatnonzero(np.isin(customers, partial_customers))
+    return {"full_copies": full_copies, "partial_customers": partial_customers, "partial_rows": partial_rows}
+
+def format_ids(ids: np.ndarray) -> np.ndarray:
+    return np.char.add(ids.astype(np.int64).astype(str), ".0")
+
+def write_patterns(real: dict, plan: dict, path: str) -> int:
+    raw = real["patterns_raw"]
+    ids = real["patterns"]['cst_dim_id'].to_numpy()
+    # (copy, real row) pairs, in copy order
+    copies = [(k, np.arange(len(raw))) for k in range(plan["full_copies"])]
+    if len(plan["partial_rows"]):
+        copies.append((plan["full_copies"], plan["partial_rows"]))
+
+    written = 0
+    per_chunk = max(1, WRITE_CHUNK_ROWS // len(raw))
+    with open(path, "w", encoding="cp1251", newline="") as out:
+        for start in range(0, len(copies), per_chunk):
+            batch = copies[start:start + per_chunk]
+            rows = np.concatenate([r for _, r in batch])
+            offsets = np.concatenate([np.full(len(r), k, dtype=np.int64) for k, r in batch]) * ID_STRIDE
+            chunk = raw.iloc[rows].reset_index(drop=True)
+            chunk['cst_dim_id'] = format_ids(ids[rows] + offsets)
+            chunk.to_csv(out, index=False, header=written == 0)
+            written += len(chunk)
+    return written
+
+def write_transactions(real: dict, plan: dict, rows: int, hit_rate: float, path: str, rng: np.random.Generator) -> int:
+    raw = real["transactions_raw"]
+    ids = real["transactions"]['cst_dim_id'].to_numpy()
+    matched = real["matched"]
+    in_partial = np.isin(ids, plan["partial_customers"])
+    if plan["full_copies"] == 0:
+        # only the partial copy exists: match through its customers only
+        matched = matched[in_partial[matched]]
+    if len(matched) == 0 and hit_rate > 0:
+        raise ValueError("No real transaction joins the generated patterns, use more pattern rows")
+    miss_offset = (plan["full_copies"] + 1) * ID_STRIDE
+
+    written = 0
+    with open(path, "w", encoding="cp1251", newline="") as out:
+        for start in range(0, rows, WRITE_CHUNK_ROWS):
+            n = min(WRITE_CHUNK_ROWS, rows - start)
+            hits = rng.random(n) < hit_rate
+            source = rng.integers(0, len(raw), n)
+            offsets = np.full(n, miss_offset, dtype=np.int64)
+            if hits.any():
+                hit_rows = matched[rng.integers(0, len(matched), hits.sum())]
+                # a customer in the partial copy may also map to copy full_copies
+                copies = rng.integers(0, plan["full_copies"] + in_partial[hit_rows], len(hit_rows)) if plan["full_copies"] else np.zeros(len(hit_rows), dtype=np.int64)
+                source[hits] = hit_rows
+                offsets[hits] = copies * ID_STRIDE
+            chunk = raw.iloc[source].reset_index(drop=True)
+            chunk['cst_dim_id'] = format_ids(ids[source] + offsets)
+            chunk['docno'] = np.arange(start + 1, start + n + 1)
+            chunk.to_csv(out, index=False, header=written == 0)
+            written += n
+    return written
+
+def generate(transactions_rows: int, patterns_rows: int, out_dir: str, hit_rate: float = None, seed: int = 0, real: dict = None) -> dict:
+    """
+    Writes synthetic transactions.csv and patterns.csv into out_dir.
+
+    Parameters:
+    transactions_rows (int): Transactions to generate.
+    patterns_rows (int): Pattern rows to generate, about; the partial copy
+        is rounded up to whole customers.
+    out_dir (str): Directory for the two files, created if missing.
+    hit_rate (float): Share of transactions with a pattern row; by default
+        that of the real files.
+    seed (int): Seed for the random generator; same inputs, same files.
+    real (dict): Output of load_real, to skip reloading the real files.
+
+    Returns:
+    dict: The two paths and the row counts actually written.
+    """
+    real = real or load_real()
+    hit_rate = real["hit_rate"] if hit_rate is None else hit_rate
+    rng = np.random.default_rng(seed)
+    plan = plan_patterns(real, patterns_rows, rng)
+    os.makedirs(out_dir, exist_ok=True)
+    transactions_path = os.path.join(out_dir, "transactions.csv")
+    patterns_path = os.path.join(out_dir, "patterns.csv")
+    return {
+        "transactions_path": transactions_path,
+        "patterns_path": patterns_path,
+        "patterns": write_patterns(real, plan, patterns_path),
+        "transactions": write_transactions(real, plan, transactions_rows, hit_rate, transactions_path, rng),
+        "hit_rate": hit_rate,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=100_000)
+    parser.add_argument("--patterns", type=int, default=None, help="defaults to the real files' ratio to transactions")
+    parser.add_argument("--hit-rate", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out-dir", default="synth")
+    args = parser.parse_args()
+
+    real = load_real()
+    patterns = args.patterns or max(1, round(args.transactions * len(real["patterns"]) / len(real["transactions"])))
+    result = generate(args.transactions, patterns, args.out_dir, args.hit_rate, args.seed, real)
+    print(f"wrote {result['transactions']} transactions to {result['transactions_path']} and {result['patterns']} pattern rows to {result['patterns_path']}")
+
+if __name__ == "__main__":
+    main()
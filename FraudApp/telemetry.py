@@ -0,0 +1,212 @@
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Histogram, Counter
+
+# per-stage timers and Prometheus histograms; "0" turns both off
+STAGE_TIMING = os.getenv("STAGE_TIMING", "1") == "1"
+# also send each request's stage timings back in a Server-Timing header
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "0") == "1"
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+REQUEST_SECONDS = Histogram(
+    "fraudapp_request_seconds", "Time spent handling a request", ["endpoint"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+STAGE_SECONDS = Histogram(
+    "fraudapp_stage_seconds", "Time spent in one stage of a request", ["endpoint", "stage"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+STAGE_ROWS = Counter("fraudapp_stage_rows", "Rows that went through a stage", ["endpoint", "stage"])
+REQUEST_ROWS = Histogram(
+    "fraudapp_request_rows", "Joined transactions scored per request", ["endpoint"],
+    buckets=(1, 10, 100, 1000, 10_000, 100_000, 1_000_000, 10_000_000),
+)
+REQUEST_PEAK_MEMORY = Histogram(
+    "fraudapp_request_peak_memory_bytes", "Growth of the scoring process's RSS during a request, sampled at stage boundaries", ["endpoint"],
+    buckets=tuple(2 ** n * 1024 * 1024 for n in range(0, 13)),
+)
+
+_timings = contextvars.ContextVar("timings", default=None)
+# labelled children by (metric, labels); .labels() takes a lock and builds a key every call
+_children = {}
+
+def _child(metric, *labels):
+    child = _children.get((metric, labels))
+    if child is None:
+        child = _children[(metric, labels)] = metric.labels(*labels)
+    return child
+
+_statm = {"pid": None, "fd": None}
+
+def rss_bytes() -> int:
+    """
+    Resident set size of this process, or 0 where /proc isn't available.
+    The file is kept open and re-read with pread, which is several times
+    cheaper than opening it per sample; the descriptor is reopened after a
+    fork, since the inherited one still describes the parent.
+    """
+    try:
+        if _statm["pid"] != os.getpid():
+            _statm["fd"] = os.open("/proc/self/statm", os.O_RDONLY)
+            _statm["pid"] = os.getpid()
+        return int(os.pread(_statm["fd"], 128, 0).split()[1]) * _PAGE_SIZE
+    except (OSError, AttributeError):
+        return 0
+
+class Timings:
+    """
+    Stage timings of one request, collected in whichever process scores it
+    and handed back to the main process, which owns the histograms.
+    Stages that run more than once (a chunked upload parses every chunk)
+    are summed.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.rows = {}
+        self.start_rss = rss_bytes()
+        self.peak_rss = self.start_rss
+
+    def add(self, name: str, seconds: float, rows: int = None):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if rows is not None:
+            self.rows[name] = self.rows.get(name, 0) + rows
+
+    def sample_memory(self):
+        rss = rss_bytes()
+        if rss > self.peak_rss:
+            self.peak_rss = rss
+
+    def merge(self, other: "Timings"):
+        """
+        Adds the stages a scoring worker timed; its memory readings replace
+        ours, since the worker is where the request's data lives.
+        """
+        for name, seconds in other.stages.items():
+            self.add(name, seconds, other.rows.get(name))
+        self.start_rss, self.peak_rss = other.start_rss, other.peak_rss
+
+    def peak_memory(self) -> int:
+        return self.peak_rss - self.start_rss
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items())
+
+class _Stage:
+    rows = None
+
+@contextmanager
+def stage(name: str):
+    """
+    Times the enclosed block as stage name of the current request. Set
+    .rows on the yielded object to count rows. Does nothing outside a
+    timed call, e.g. during warm-up or shadow scoring.
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield _Stage()
+        return
+    current = _Stage()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        timings.add(name, time.perf_counter() - start, current.rows)
+        timings.sample_memory()
+
+def timed_iter(name: str, iterable):
+    """
+    Yields from iterable, timing each step as stage name; for readers that
+    parse lazily, chunk by chunk.
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name) as current:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            current.rows = len(item)
+        yield item
+
+def begin() -> Timings:
+    """
+    Starts collecting stage timings for the current request; call it at the
+    top of an async endpoint, whose task has a context of its own.
+    """
+    if not STAGE_TIMING:
+        return None
+    timings = Timings()
+    _timings.set(timings)
+    return timings
+
+def current() -> Timings:
+    return _timings.get()
+
+def timed(func, *args):
+    """
+    Calls func(*args) with stage timers collecting into a fresh Timings.
+    Module-level so process pools can run it.
+
+    Returns:
+    tuple: func's result and the Timings, or None with STAGE_TIMING off.
+    """
+    if not STAGE_TIMING:
+        return func(*args), None
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        return func(*args), timings
+    finally:
+        _timings.reset(token)
+
+def observe(endpoint: str, seconds: float, timings: Timings = None):
+    """
+    Records a finished request in the Prometheus histograms.
+    """
+    if not STAGE_TIMING:
+        return
+    _child(REQUEST_SECONDS, endpoint).observe(seconds)
+    if timings is None:
+        return
+    if "join" in timings.rows:
+        _child(REQUEST_ROWS, endpoint).observe(timings.rows["join"])
+    for name, stage_seconds in timings.stages.items():
+        _child(STAGE_SECONDS, endpoint, name).observe(stage_seconds)
+    for name, stage_rows in timings.rows.items():
+        _child(STAGE_ROWS, endpoint, name).inc(stage_rows)
+    if timings.start_rss:
+        _child(REQUEST_PEAK_MEMORY, endpoint).observe(timings.peak_memory())
+
+class StageTimingMiddleware:
+    """
+    Records latency and the stage timings endpoints left in
+    request.state.timings, and optionally returns them in a Server-Timing
+    header. Plain ASGI rather than BaseHTTPMiddleware, which costs a few
+    hundred microseconds per request. For streamed responses the latency
+    runs until the headers are sent.
+    """
+
+    def __init__(self, app, endpoints: set):
+        self.app = app
+        self.endpoints = endpoints
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not STAGE_TIMING or scope["path"] not in self.endpoints:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        state = scope.setdefault("state", {})
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timings = state.get("timings")
+                observe(scope["path"], time.perf_counter() - start, timings)
+                if SERVER_TIMING_HEADER and timings is not None and timings.stages:
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", timings.server_timing().encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
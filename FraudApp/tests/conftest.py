@@ -0,0 +1,89 @@
+import os
+import sys
+import pandas as pd
+import pytest
+
+# the service is a flat set of modules; tests import them as main.py does
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, APP_DIR)
+ROOT = os.path.join(APP_DIR, "..")
+
+def bundled_path(name: str) -> str:
+    return os.path.join(ROOT, name)
+
+@pytest.fixture(scope="session")
+def bundled_csvs() -> tuple:
+    """
+    The bundled transactions and patterns files, raw and as read by the service.
+    """
+    from helpers import read_csv_typed
+    contents = []
+    for name in ("transactions_cleaned.csv", "patterns_cleaned.csv"):
+        with open(bundled_path(name), "rb") as f:
+            contents.append(f.read())
+    return contents[0], contents[1], read_csv_typed(contents[0]), read_csv_typed(contents[1])
+
+@pytest.fixture
+def bundled_frames(bundled_csvs) -> tuple:
+    """
+    Validated copies of the bundled transactions and patterns, free to modify.
+    """
+    from helpers import validate_transaction_data, validate_patterns_data
+    transactions, patterns = bundled_csvs[2].copy(), bundled_csvs[3].copy()
+    assert validate_transaction_data(transactions)["status"] == "success"
+    assert validate_patterns_data(patterns)["status"] == "success"
+    return transactions, patterns
+
+@pytest.fixture(scope="session")
+def model_dir(tmp_path_factory) -> str:
+    """
+    A directory with a small CatBoost model trained on the bundled data, as
+    model.pkl and model.cbm, and its fitted preprocessor.json; the repo
+    ships no model.
+    """
+    import joblib
+    from catboost import CatBoostClassifier
+    from helpers import read_csv_typed, validate_transaction_data, validate_patterns_data, merge_transaction_pattern_data, FeaturePreprocessor
+    directory = tmp_path_factory.mktemp("model")
+    with open(bundled_path("transactions_cleaned.csv"), "rb") as f:
+        transactions = read_csv_typed(f.read())
+    with open(bundled_path("patterns_cleaned.csv"), "rb") as f:
+        patterns = read_csv_typed(f.read())
+    validate_transaction_data(transactions)
+    validate_patterns_data(patterns)
+    merged = merge_transaction_pattern_data(transactions=transactions, patterns=patterns)
+    preprocessor = FeaturePreprocessor().fit(merged)
+    features = preprocessor.transform(merged)
+    y = features['target']
+    X = features.drop(columns=['cst_dim_id', 'transdate', 'transdatetime', 'docno', 'target'], errors='ignore')
+    cat_features = [name for name in X.columns if X[name].dtype == object]
+    model = CatBoostClassifier(iterations=50, depth=4, random_seed=0, thread_count=1, verbose=0, allow_writing_files=False, cat_features=cat_features)
+    model.fit(X, y)
+    joblib.dump(model, directory / "model.pkl")
+    model.save_model(str(directory / "model.cbm"))
+    preprocessor.save(str(directory / "preprocessor.json"))
+    return str(directory)
+
+@pytest.fixture(scope="session")
+def client(model_dir, bundled_csvs):
+    """
+    The app, ready, in a working directory of its own holding the test model
+    (the default relative paths resolve there) and the bundled patterns
+    loaded into the patterns store.
+    """
+    import time
+    from fastapi.testclient import TestClient
+    cwd = os.getcwd()
+    os.chdir(model_dir)
+    try:
+        import main
+        with TestClient(main.app) as client:
+            deadline = time.monotonic() + 60
+            while client.get("/ready").status_code != 200:
+                assert time.monotonic() < deadline, main.startup
+                time.sleep(0.05)
+            response = client.post("/patterns", files={"file": ("patterns.csv", bundled_csvs[1])}, params={"replace": "true"})
+            assert response.json()["status"] == "success"
+            yield client
+    finally:
+        os.chdir(cwd)
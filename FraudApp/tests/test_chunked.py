@@ -0,0 +1,41 @@
+import os
+import pandas as pd
+import pytest
+import model_registry
+import scoring
+from conftest import bundled_path
+
+@pytest.fixture
+def spec(model_dir):
+    return model_registry.make_spec("test", os.path.join(model_dir, "model.pkl"), os.path.join(model_dir, "preprocessor.json"))
+
+def missing_docno() -> bytes:
+    transactions = pd.read_csv(bundled_path("transactions_cleaned.csv"), encoding='cp1251')
+    transactions['docno'] = transactions['docno'].astype(object)
+    transactions.loc[5000, 'docno'] = None
+    return transactions.to_csv(index=False).encode('cp1251')
+
+def test_chunked_reports_a_bad_column_like_the_in_memory_path(bundled_csvs, spec, tmp_path):
+    content = missing_docno()
+    expected = scoring.score_uploads(content, bundled_csvs[1], spec)
+    assert expected["file"] == "transactions"
+    path = tmp_path / "transactions.csv"
+    path.write_bytes(content)
+    for chunk_rows in (1000, 100000):
+        result = scoring.score_file_chunked(str(path), bundled_csvs[1], str(tmp_path / "out.csv"), "csv", chunk_rows, spec)
+        assert {k: v for k, v in result.items() if k != "chunk"} == expected
+    assert result["chunk"] == 0
+
+def test_chunked_reports_unreadable_files_and_scoring_errors(bundled_csvs, spec, tmp_path, monkeypatch):
+    path = tmp_path / "transactions.parquet"
+    path.write_bytes(b"PAR1 not really parquet")
+    result = scoring.score_file_chunked(str(path), bundled_csvs[1], str(tmp_path / "out.csv"), "csv", 1000, spec)
+    assert result["error"].startswith("Could not read the transactions file")
+
+    def fail(*args):
+        raise ValueError("predict failed")
+    monkeypatch.setattr(scoring, "score_frame", fail)
+    path = tmp_path / "transactions.csv"
+    path.write_bytes(bundled_csvs[0])
+    result = scoring.score_file_chunked(str(path), bundled_csvs[1], str(tmp_path / "out.csv"), "csv", 1000, spec)
+    assert result == {"error": "predict failed", "chunk": 0}
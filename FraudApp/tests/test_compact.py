@@ -0,0 +1,39 @@
+import os
+import joblib
+import numpy as np
+from helpers import compact_frame, merge_transaction_pattern_data, preprocess_merged_data
+
+# largest difference in fraud probability allowed between compact and default frames
+TOLERANCE = 1e-4
+DROP = ['cst_dim_id', 'transdate', 'transdatetime', 'docno', 'target']
+
+def features(transactions, patterns, compact: bool):
+    if compact:
+        compact_frame(transactions)
+        compact_frame(patterns)
+    merged = merge_transaction_pattern_data(transactions=transactions, patterns=patterns)
+    scored = preprocess_merged_data(merged)
+    if compact:
+        compact_frame(scored, downcast_ints=True)
+    return scored
+
+def test_compact_frames_are_smaller_and_score_within_tolerance(bundled_frames, model_dir):
+    transactions, patterns = bundled_frames
+    default = features(transactions.copy(), patterns.copy(), compact=False)
+    compact = features(transactions, patterns, compact=True)
+    assert compact.memory_usage(deep=True).sum() < default.memory_usage(deep=True).sum() / 2
+
+    model = joblib.load(os.path.join(model_dir, "model.pkl"))
+    p_default = model.predict_proba(default.drop(columns=DROP, errors='ignore'))[:, 1]
+    p_compact = model.predict_proba(compact.drop(columns=DROP, errors='ignore'))[:, 1]
+    assert np.abs(p_default - p_compact).max() <= TOLERANCE
+
+def test_compact_frames_keep_the_integer_key_quietly(bundled_frames, capsys):
+    transactions, patterns = bundled_frames
+    compact_frame(transactions)
+    compact_frame(patterns)
+    merged = merge_transaction_pattern_data(transactions=transactions, patterns=patterns)
+    capsys.readouterr()
+    scored = preprocess_merged_data(merged)
+    assert scored['cst_dim_id'].dtype == 'int64'
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,90 @@
+import warnings
+import pandas as pd
+from conftest import bundled_path
+from helpers import FLOAT_DTYPES, validate_transaction_data, validate_patterns_data, merge_transaction_pattern_data, preprocess_merged_data
+
+def reference_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    preprocess_merged_data as it was before vectorization: four datetime
+    parses, row-wise apply and a quantile call per statistic.
+    """
+    df = df.dropna(how='all', axis=0, subset=['monthly_os_changes', 'monthly_phone_model_changes', 'amount'])
+    df['hour'] = pd.to_datetime(df['transdatetime']).dt.hour
+    df['dayofweek'] = pd.to_datetime(df['transdatetime']).dt.dayofweek
+    df['day'] = pd.to_datetime(df['transdatetime']).dt.day
+    df['month'] = pd.to_datetime(df['transdatetime']).dt.month
+    df = df.drop(columns=['transdate', 'transdatetime'])
+    df['is_weekend'] = df['dayofweek'].apply(lambda df: 1 if df >= 5 else 0)
+
+    def part_of_day(hour):
+        if hour < 6:
+            return 'night'
+        elif hour < 12:
+            return 'morning'
+        elif hour < 18:
+            return 'afternoon'
+        else:
+            return 'evening'
+    df['part_of_day'] = df['hour'].apply(part_of_day)
+
+    df['login_freq_7d_vs_30d_ratio'] = df['login_frequency_7d'] / (df['login_frequency_30d'] + 1e-6)
+    df['os_change_ratio'] = df['monthly_os_changes'] / (df['monthly_os_changes'].max() + 1e-6)
+    df['device_change_ratio'] = df['monthly_phone_model_changes'] / (df['monthly_phone_model_changes'].max() + 1e-6)
+    df['high_login_zscore'] = (df['avg_login_interval_30d'] - df['avg_login_interval_30d'].mean()) / (df['std_login_interval_30d'] + 1e-6)
+    df['high_login_zscore_flag'] = (df['high_login_zscore'].abs() > 2).astype(int)
+    df['os_device_change'] = df['monthly_os_changes'] * df['monthly_phone_model_changes']
+    df['logins_per_hour'] = df['logins_last_7_days'] / (df['hour'] + 1e-6)
+    df['bursty_and_frequent'] = df['burstiness_login_interval'] * df['logins_last_7_days']
+    df['interval_std_over_mean'] = df['std_login_interval_30d'] / (df['avg_login_interval_30d'] + 1e-6)
+    df['ewm_vs_avg'] = df['ewm_login_interval_7d'] / (df['avg_login_interval_30d'] + 1e-6)
+    df['login_acceleration'] = df['login_frequency_7d'] - df['login_frequency_30d']
+    df['sudden_activity_spike'] = ((df['logins_last_7_days'] / 7) > (df['logins_last_30_days'] / 30) * 2).astype(int)
+    df['recent_os_change_flag'] = (df['monthly_os_changes'] > 0).astype(int)
+    df['recent_device_change_flag'] = (df['monthly_phone_model_changes'] > 0).astype(int)
+    df['any_recent_change'] = (df['recent_os_change_flag'] | df['recent_device_change_flag']).astype(int)
+    df['multiple_changes'] = ((df['monthly_os_changes'] > 1) | (df['monthly_phone_model_changes'] > 1)).astype(int)
+    df['risk_score'] = (
+        df['high_login_zscore_flag'] * 2 +
+        df['any_recent_change'] * 3 +
+        df['sudden_activity_spike'] * 2 +
+        (df['logins_7d_over_30d_ratio'] > 0.8).astype(int) +
+        df['multiple_changes'] * 4
+    )
+    df['change_with_high_activity'] = ((df['any_recent_change'] == 1) &
+                                    (df['logins_last_7_days'] > df['logins_last_7_days'].quantile(0.75))).astype(int)
+    df['risky_hour'] = df['hour'].isin([0, 1, 2, 3, 4, 5, 22, 23]).astype(int)
+    df['night_with_change'] = ((df['part_of_day'] == 'night') & (df['any_recent_change'] == 1)).astype(int)
+    df['extreme_velocity'] = (df['login_acceleration'].abs() > df['login_acceleration'].quantile(0.95)).astype(int)
+    df['login_variability_score'] = df['burstiness_login_interval'] * df['interval_std_over_mean'] * (1 + df['os_device_change'])
+    df['consistency_score'] = 1 / (1 + df['burstiness_login_interval'] + df['os_device_change'])
+    df['freq_variability_product'] = df['logins_last_7_days'] * df['interval_std_over_mean']
+    df['deviation_score'] = abs(df['logins_last_7_days'] - df['logins_last_30_days'] / 4.3) / (df['logins_last_30_days'] / 4.3 + 1e-6)
+    df['extreme_login_freq'] = ((df['logins_last_7_days'] > df['logins_last_7_days'].quantile(0.95)) |
+                            (df['logins_last_7_days'] < df['logins_last_7_days'].quantile(0.05))).astype(int)
+    for col in FLOAT_DTYPES:
+        if pd.api.types.is_integer_dtype(df[col].dtype):
+            df[col] = df[col].astype('float64')
+    return df
+
+def bundled_merged() -> pd.DataFrame:
+    # read untyped, as /process did when the reference was written
+    transactions = pd.read_csv(bundled_path("transactions_cleaned.csv"), encoding='cp1251')
+    patterns = pd.read_csv(bundled_path("patterns_cleaned.csv"), encoding='cp1251')
+    validate_transaction_data(transactions)
+    validate_patterns_data(patterns)
+    return merge_transaction_pattern_data(transactions=transactions, patterns=patterns)
+
+def test_features_match_reference_on_bundled_csvs():
+    merged = bundled_merged()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        expected = reference_features(merged.copy())
+    pd.testing.assert_frame_equal(preprocess_merged_data(merged), expected, check_exact=True)
+
+def test_features_leave_input_alone_and_warn_nothing():
+    merged = bundled_merged()
+    before = merged.copy()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        preprocess_merged_data(merged)
+    pd.testing.assert_frame_equal(merged, before, check_exact=True)
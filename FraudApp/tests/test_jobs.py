@@ -0,0 +1,15 @@
+import io
+import os
+import time
+import jobs
+
+def test_expire_deletes_only_jobs_finished_before_the_retention(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path))
+    monkeypatch.setattr(jobs, "JOB_RETENTION_SECONDS", 60)
+    states = [jobs.create(io.BytesIO(b"x"), None, "ndjson", {"version": "default"}) for _ in range(4)]
+    for state, status, finished in zip(states, ("done", "failed", "done", "queued"), (120, 120, 10, None)):
+        state.update(status=status, finished=finished and time.time() - finished)
+        jobs.write_state(state)
+    assert jobs.expire() == 2
+    assert sorted(os.listdir(tmp_path)) == sorted(s["id"] for s in states[2:])
+    assert jobs.recover() == [states[3]["id"]]
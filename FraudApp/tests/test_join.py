@@ -0,0 +1,51 @@
+import os
+import numpy as np
+import pandas as pd
+import model_registry
+import scoring
+from helpers import build_patterns_index, join_transactions_patterns
+
+def test_join_counts_unmatched_and_incomplete_rows(bundled_frames):
+    transactions, patterns = bundled_frames
+    merged, stats = join_transactions_patterns(transactions, build_patterns_index(patterns))
+    assert stats == {"transactions": len(transactions), "matched": len(merged), "unmatched": 418, "incomplete": 0}
+
+    transactions.loc[merged.index[0], 'direction'] = np.nan
+    patterns['last_os_categorical'] = patterns['last_os_categorical'].where(patterns.index != 0)
+    index = build_patterns_index(patterns)
+    nulled, stats = join_transactions_patterns(transactions, index)
+    assert not nulled.isna().any().any()
+    assert stats["incomplete"] >= 2
+    assert stats["matched"] + stats["unmatched"] + stats["incomplete"] == stats["transactions"]
+    assert set(nulled.index) < set(merged.index)
+
+def test_process_scores_uploads_with_null_categoricals(bundled_csvs, model_dir):
+    transactions = pd.read_csv(pd.io.common.BytesIO(bundled_csvs[0]), encoding='cp1251')
+    transactions.loc[:9, 'direction'] = np.nan
+    spec = model_registry.make_spec("test", os.path.join(model_dir, "model.pkl"), os.path.join(model_dir, "preprocessor.json"))
+    scored = scoring.score_uploads(transactions.to_csv(index=False).encode('cp1251'), bundled_csvs[1], spec)
+    assert not isinstance(scored, dict), scored
+    frame, metrics = scored
+    assert metrics["join"]["incomplete"] > 0
+    assert len(frame) == metrics["join"]["matched"]
+
+def test_join_key_falls_back_instead_of_colliding():
+    # 2**43 + 5 packs onto the same key as 5 would; 1.5 onto 1; 1969 dates to negative days
+    ids = [5.0, 2.0 ** 43 + 5, 1.0, 1.5, 7.0]
+    dates = pd.to_datetime(["2025-01-01", "2025-01-01", "2025-01-02", "2025-01-02", "1969-12-30"])
+    patterns = pd.DataFrame({"cst_dim_id": ids, "transdate": dates, "row": range(len(ids))})
+    index = build_patterns_index(patterns)
+    assert isinstance(index.index, pd.MultiIndex) and len(index) == len(ids)
+
+    transactions = pd.DataFrame({"cst_dim_id": ids[::-1] + [9.0], "transdate": list(dates[::-1]) + [dates[0]], "docno": range(len(ids) + 1)})
+    merged, stats = join_transactions_patterns(transactions, index)
+    assert merged["row"].tolist() == list(range(len(ids)))[::-1]
+    assert stats["unmatched"] == 1
+
+def test_packed_index_ignores_transactions_that_dont_pack():
+    patterns = pd.DataFrame({"cst_dim_id": [5.0], "transdate": pd.to_datetime(["2025-01-01"]), "row": [0]})
+    index = build_patterns_index(patterns)
+    assert not isinstance(index.index, pd.MultiIndex)
+    transactions = pd.DataFrame({"cst_dim_id": [2.0 ** 43 + 5, 5.0], "transdate": pd.to_datetime(["2025-01-01"] * 2), "docno": [0, 1]})
+    merged, stats = join_transactions_patterns(transactions, index)
+    assert merged["docno"].tolist() == [1] and stats["unmatched"] == 1
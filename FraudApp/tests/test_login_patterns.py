@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from bench_login_patterns import synthetic_logins, reference
+from helpers import PATTERN_COLUMNS
+from login_patterns import LoginAggregator
+
+def logins(*rows) -> pd.DataFrame:
+    return pd.DataFrame(list(rows), columns=['cst_dim_id', 'logindatetime', 'os', 'phone_model'])
+
+def assert_matches_reference(snapshot: pd.DataFrame, events: pd.DataFrame, as_of: pd.Timestamp):
+    snapshot = snapshot.sort_values('cst_dim_id', ignore_index=True)
+    expected = reference(events, as_of).sort_values('cst_dim_id', ignore_index=True)
+    assert len(snapshot) == len(expected)
+    for name in PATTERN_COLUMNS:
+        if snapshot[name].dtype == object or name == 'transdate':
+            assert (snapshot[name] == expected[name]).all(), name
+        else:
+            np.testing.assert_allclose(snapshot[name].to_numpy(np.float64), expected[name].to_numpy(np.float64), rtol=1e-6, atol=1e-6, err_msg=name)
+
+def test_daily_snapshots_match_the_brute_force_reference():
+    events = synthetic_logins(customers=40, days=45)
+    aggregator = LoginAggregator()
+    midnights = pd.date_range(events['logindatetime'].min().normalize() + pd.Timedelta(days=1), events['logindatetime'].max(), freq="D")
+    bounds = np.searchsorted(events['logindatetime'].to_numpy(), midnights.to_numpy(), side="right")
+    fed = 0
+    for as_of, bound in zip(midnights, bounds):
+        aggregator.ingest_frame(events.iloc[fed:bound])
+        fed = bound
+        assert_matches_reference(aggregator.snapshot(as_of), events.iloc[:bound], as_of)
+    assert aggregator.stats()["late"] == 0
+
+def test_ingest_frame_orders_by_time_not_text():
+    aggregator = LoginAggregator()
+    added = aggregator.ingest_frame(logins(
+        (1.0, '2025-1-10', 'iOS/18.5', 'iPhone16,1'),
+        (1.0, '2025-1-5', 'iOS/18.5', 'iPhone16,1'),
+        (1.0, '2025-1-7', 'iOS/18.5', 'iPhone16,1'),
+    ))
+    assert added == 3 and aggregator.stats()["late"] == 0
+
+def test_snapshot_leaves_later_logins_their_windows():
+    aggregator = LoginAggregator()
+    events = logins(*[(1.0, pd.Timestamp(f"2025-01-0{day}"), 'Android/14', 'Vivo V2116') for day in (1, 2, 3)])
+    aggregator.ingest_frame(events)
+    aggregator.snapshot(pd.Timestamp("2025-01-20"))
+    later = logins((1.0, pd.Timestamp("2025-01-05"), 'Android/14', 'Vivo V2116'))
+    aggregator.ingest_frame(later)
+    as_of = pd.Timestamp("2025-01-06")
+    snapshot = aggregator.snapshot(as_of)
+    assert snapshot['logins_last_7_days'].tolist() == [4]
+    assert_matches_reference(snapshot, pd.concat([events, later], ignore_index=True), as_of)
+
+def test_idle_customers_are_evicted():
+    aggregator = LoginAggregator()
+    aggregator.ingest(1.0, pd.Timestamp("2025-01-01").value / 1e9, 'iOS/17.6.1', 'iPhone12,1')
+    start = pd.Timestamp("2025-06-01").value / 1e9
+    aggregator.ingest_frame(logins(*[(2.0, pd.Timestamp((start + i * 60) * 1e9), 'iOS/18.5', 'iPhone16,1') for i in range(1100)]))
+    assert aggregator.stats()["customers"] == 1
+    assert aggregator.stats()["evicted"] == 1
+    assert 1.0 not in aggregator.customers
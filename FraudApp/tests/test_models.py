@@ -0,0 +1,195 @@
+import os
+import json
+import shutil
+import threading
+import time
+import pytest
+from conftest import bundled_path
+from test_score import records as score_records
+
+TOKEN = "test-token"
+
+@pytest.fixture
+def registry(client, model_dir, monkeypatch):
+    """
+    POST /models enabled with TOKEN and MODELS_DIR at the test model; the
+    default version is active again afterwards.
+    """
+    import main
+    import model_registry
+    monkeypatch.setattr(main, "MODEL_ADMIN_TOKEN", TOKEN)
+    monkeypatch.setattr(model_registry, "MODELS_DIR", model_dir)
+    yield model_registry
+    if os.path.exists(model_registry.MODEL_REGISTRY_PATH):
+        os.remove(model_registry.MODEL_REGISTRY_PATH)
+    model_registry.refresh()
+    assert model_registry.current().version == "default"
+
+def publish(client, token: str = TOKEN, **body):
+    return client.post("/models", json=body, headers={"X-Admin-Token": token} if token else {})
+
+def test_publishing_needs_the_admin_token(client, model_dir, monkeypatch):
+    import main
+    body = {"version": "a", "model_path": os.path.join(model_dir, "model.cbm")}
+    monkeypatch.setattr(main, "MODEL_ADMIN_TOKEN", None)
+    assert publish(client, **body).status_code == 403
+    monkeypatch.setattr(main, "MODEL_ADMIN_TOKEN", TOKEN)
+    assert publish(client, token=None, **body).status_code == 403
+    assert publish(client, token="wrong", **body).status_code == 403
+
+def test_publishing_only_loads_cbm_files_from_the_models_directory(client, registry, model_dir, tmp_path):
+    outside = tmp_path / "model.cbm"
+    shutil.copy(os.path.join(model_dir, "model.cbm"), outside)
+    os.makedirs(os.path.join(model_dir, "jobs", "0" * 32), exist_ok=True)
+    uploaded = os.path.join(model_dir, "jobs", "0" * 32, "transactions.cbm")
+    shutil.copy(os.path.join(model_dir, "model.cbm"), uploaded)
+    os.symlink(outside, os.path.join(model_dir, "linked.cbm"))
+    for path in ("model.pkl", str(outside), uploaded, "linked.cbm", os.path.join(model_dir, "..", "x.cbm")):
+        response = publish(client, version="a", model_path=path)
+        assert response.status_code == 400, path
+    response = publish(client, version="a", model_path="model.cbm", preprocessor_path="/etc/passwd")
+    assert response.status_code == 400
+    response = publish(client, version="a", model_path="model.cbm", preprocessor_path="preprocessor.json")
+    assert response.status_code == 200
+    assert response.json()["active"]["version"] == "a"
+
+def test_versions_that_fail_to_load_leave_the_last_working_one(client, registry, model_dir, monkeypatch):
+    assert publish(client, version="a", model_path="model.cbm", preprocessor_path="preprocessor.json").status_code == 200
+    with open(registry.MODEL_REGISTRY_PATH) as f:
+        wanted = json.load(f)
+    wanted["active"] = {**wanted["active"], "version": "b", "model_path": "missing.cbm"}
+    wanted["candidate"] = {**wanted["active"], "version": "c"}
+    with open(registry.MODEL_REGISTRY_PATH, "w") as f:
+        json.dump(wanted, f)
+    registry.refresh()
+    assert registry.current().version == "a"
+    assert registry.candidate() is None
+    assert client.post("/score", json=score_records()).json()["model"] == "a"
+
+    # on first start, the default files serve in place of a broken registry
+    monkeypatch.setattr(registry, "_state", {"active": None, "candidate": None, "shadow_fraction": 0.0})
+    assert registry.current().version == "default"
+
+def test_resolve_refuses_files_changed_since_publishing(registry, model_dir):
+    path = os.path.join(model_dir, "changed.cbm")
+    shutil.copy(os.path.join(model_dir, "model.cbm"), path)
+    spec = registry.make_spec("changed", path, "preprocessor.json")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with pytest.raises(ValueError):
+        registry.resolve(spec)
+
+def test_shadow_samples_are_dropped_while_the_worker_is_busy(client, registry):
+    import main
+    assert publish(client, version="shadowed", model_path="model.cbm", role="candidate", shadow_fraction=1.0).status_code == 200
+    release = threading.Event()
+    started = threading.Event()
+
+    def busy(spec):
+        started.set()
+        release.wait(10)
+
+    main.shadow(busy)
+    assert started.wait(10)
+    for _ in range(5):
+        main.shadow(busy)
+    release.set()
+    stats = registry.describe()["versions"]["shadowed"]["shadow"]
+    assert stats["dropped"] == 5 - main.SHADOW_QUEUE_SIZE
+
+def test_swapping_versions_under_traffic(client, registry, bundled_csvs):
+    """
+    /score and /process from several threads while the active version
+    switches between two thresholds; each response has to be exactly the
+    decisions of the version it reports.
+    """
+    import scoring
+    specs = [
+        registry.make_spec("a", "model.cbm", "preprocessor.json"),
+        registry.make_spec("b", "model.cbm", "preprocessor.json", 0.0001),
+    ]
+    records = score_records(20)
+    with open(bundled_path("transactions_cleaned.csv"), "rb") as f:
+        transactions = b"".join(f.readlines()[:201])
+    patterns = bundled_csvs[1]
+    expected_score = {s["version"]: [r["target"] for r in scoring.score_transactions(records, s)["results"]] for s in specs}
+    expected_process = {s["version"]: [p["target"] for p in scoring.process_uploads(transactions, patterns, s)["predictions"]] for s in specs}
+    assert expected_process["a"] != expected_process["b"]
+
+    failures = []
+    deadline = time.monotonic() + 3
+
+    def traffic(n: int):
+        while time.monotonic() < deadline:
+            if n % 2:
+                response = client.post("/score", json=records)
+            else:
+                response = client.post("/process", files={"file1": ("t.csv", transactions), "file2": ("p.csv", patterns)})
+            if response.status_code != 200:
+                failures.append(f"HTTP {response.status_code} {response.text[:200]}")
+                continue
+            body = response.json()
+            if n % 2:
+                version, decisions, expected = body["model"], [r["target"] for r in body["results"]], expected_score
+            else:
+                version, decisions, expected = body["metrics"]["model"]["version"], [p["target"] for p in body["predictions"]], expected_process
+            if decisions != expected[version]:
+                failures.append(f"decisions don't match version {version}")
+
+    def swaps():
+        i = 0
+        while time.monotonic() < deadline:
+            spec = specs[i % 2]
+            response = publish(client, version=spec["version"], model_path="model.cbm", preprocessor_path="preprocessor.json", threshold=spec["threshold"])
+            if response.status_code != 200 or response.json()["active"]["version"] != spec["version"]:
+                failures.append(f"publish {spec['version']}: {response.text[:200]}")
+            i += 1
+            time.sleep(0.2)
+
+    threads = [threading.Thread(target=traffic, args=(n,)) for n in range(4)] + [threading.Thread(target=swaps)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not failures, failures[:5]
+    served = client.get("/models").json()["versions"]
+    assert served["a"]["requests"]["count"] and served["b"]["requests"]["count"]
+
+def test_scoring_with_changed_files_is_an_error_not_a_crash(client, registry, model_dir):
+    import scoring
+    path = os.path.join(model_dir, "replaced.cbm")
+    shutil.copy(os.path.join(model_dir, "model.cbm"), path)
+    spec = registry.make_spec("replaced", path, "preprocessor.json")
+    # a thread holding the version it resolved keeps scoring with it
+    version = registry.resolve(spec)
+    # unloaded, as two swaps while the request runs would
+    del registry._loaded[spec["identity"]]
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert scoring.score_transactions(score_records(), version)["model"] == "replaced"
+    # a worker that has to load it from the spec reports it
+    assert "error" in scoring.score_transactions(score_records(), spec)
+    with open(bundled_path("transactions_cleaned.csv"), "rb") as f:
+        transactions = f.read()
+    assert "error" in scoring.score_uploads(transactions, None, spec)
+
+def test_concurrent_publishes_keep_every_update(client, registry, monkeypatch):
+    read_registry = registry.read_registry
+
+    def slow_read_registry(*args):
+        # widens the window between reading the registry and writing it back
+        time.sleep(0.02)
+        return read_registry(*args)
+
+    monkeypatch.setattr(registry, "read_registry", slow_read_registry)
+    for i in range(10):
+        threads = [
+            threading.Thread(target=registry.publish, args=(registry.make_spec(f"a{i}", "model.cbm", "preprocessor.json"), "active")),
+            threading.Thread(target=registry.publish, args=(registry.make_spec(f"c{i}", "model.cbm", "preprocessor.json"), "candidate", 0.5)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wanted = registry.read_registry()
+        assert (wanted["active"]["version"], wanted["candidate"]["version"]) == (f"a{i}", f"c{i}")
@@ -0,0 +1,60 @@
+import os
+import signal
+import subprocess
+import sys
+import pandas as pd
+from conftest import APP_DIR, bundled_path
+import model_registry
+import scoring
+from helpers import merge_transaction_pattern_data
+
+def test_partitioned_scoring_matches_single_process(bundled_frames, model_dir, monkeypatch):
+    # workers load the model through the default relative paths
+    monkeypatch.chdir(model_dir)
+    version = model_registry.resolve(model_registry.make_spec("test", os.path.join(model_dir, "model.pkl"), os.path.join(model_dir, "preprocessor.json")))
+    merged = merge_transaction_pattern_data(*bundled_frames)
+    monkeypatch.setattr(scoring, "PARTITION_WORKERS", 2)
+    try:
+        partitioned = scoring.score_partitioned(merged, version)
+        assert scoring.partition_pool()._mp_context.get_start_method() == scoring.WORKER_START_METHOD
+    finally:
+        scoring.shutdown_partition_pool()
+    pd.testing.assert_frame_equal(partitioned, scoring.score_frame(merged, version), check_exact=True)
+
+SHUTDOWN_SCRIPT = """
+import sys, time
+from fastapi.testclient import TestClient
+import main
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as f1, open(sys.argv[2], "rb") as f2:
+        files = {"file1": ("t.csv", f1.read()), "file2": ("p.csv", f2.read())}
+    with TestClient(main.app) as client:
+        while client.get("/ready").status_code != 200:
+            assert not main.startup["error"], main.startup
+            time.sleep(0.1)
+        assert client.post("/process", files=files).status_code == 200
+"""
+
+def test_process_mode_with_partitions_shuts_down(model_dir, tmp_path):
+    # a server of its own: shutdown is what's under test, and spawned workers need a script to import
+    script = tmp_path / "serve.py"
+    script.write_text(SHUTDOWN_SCRIPT)
+    env = {
+        **os.environ, "PYTHONPATH": APP_DIR, "SCORING_EXECUTOR": "process", "SCORING_WORKERS": "2",
+        "PARTITION_WORKERS": "2", "PARTITION_MIN_ROWS": "1", "MODEL_REGISTRY_PATH": str(tmp_path / "registry.json"),
+        "JOBS_DIR": str(tmp_path / "jobs"), "PATTERNS_STORE_PATH": str(tmp_path / "patterns.parquet"),
+    }
+    with open(tmp_path / "output", "w+") as output:
+        process = subprocess.Popen(
+            [sys.executable, str(script), bundled_path("transactions_cleaned.csv"), bundled_path("patterns_cleaned.csv")],
+            cwd=model_dir, env=env, stdout=output, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+        try:
+            returncode = process.wait(timeout=180)
+        except subprocess.TimeoutExpired:
+            # the workers too, or they outlive the test
+            os.killpg(process.pid, signal.SIGKILL)
+            returncode = process.wait()
+        output.seek(0)
+        assert returncode == 0, output.read()[-2000:]
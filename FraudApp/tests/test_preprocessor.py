@@ -0,0 +1,34 @@
+import os
+import numpy as np
+import pandas as pd
+import model_registry
+import scoring
+from helpers import merge_transaction_pattern_data, FeaturePreprocessor
+
+def test_transform_whole_and_in_chunks_is_identical(bundled_frames):
+    merged = merge_transaction_pattern_data(*bundled_frames)
+    preprocessor = FeaturePreprocessor().fit(merged)
+    whole = preprocessor.transform(merged)
+    chunks = [preprocessor.transform(merged.iloc[start:start + 1000]) for start in range(0, len(merged), 1000)]
+    pd.testing.assert_frame_equal(whole, pd.concat(chunks), check_exact=True)
+
+def test_preprocessor_round_trips_through_json(bundled_frames, tmp_path):
+    merged = merge_transaction_pattern_data(*bundled_frames)
+    preprocessor = FeaturePreprocessor().fit(merged)
+    preprocessor.save(str(tmp_path / "preprocessor.json"))
+    loaded = FeaturePreprocessor.load(str(tmp_path / "preprocessor.json"))
+    pd.testing.assert_frame_equal(loaded.transform(merged), preprocessor.transform(merged), check_exact=True)
+
+def test_scoring_a_file_whole_or_in_chunks_is_identical(bundled_csvs, model_dir, tmp_path):
+    transactions, patterns = bundled_csvs[0], bundled_csvs[1]
+    spec = model_registry.make_spec("test", os.path.join(model_dir, "model.pkl"), os.path.join(model_dir, "preprocessor.json"))
+    whole, whole_metrics = scoring.score_uploads(transactions, patterns, spec, probabilities=True)
+
+    path = tmp_path / "transactions.csv"
+    path.write_bytes(transactions)
+    metrics = scoring.score_file_chunked(str(path), patterns, str(tmp_path / "out.parquet"), "parquet", 1000, spec, probabilities=True)
+    chunked = pd.read_parquet(tmp_path / "out.parquet")
+
+    assert metrics == whole_metrics
+    for name in ("docno", "expected_target", "probability", "target"):
+        np.testing.assert_array_equal(chunked[name].to_numpy(), whole[name].to_numpy())
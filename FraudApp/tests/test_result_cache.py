@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+import result_cache
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(result_cache, "_entries", type(result_cache._entries)())
+    monkeypatch.setattr(result_cache, "_memory_bytes", 0)
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_ENTRIES", 100)
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_BYTES", 1000)
+    monkeypatch.setattr(result_cache, "RESULT_CACHE_DIR", None)
+    return result_cache
+
+def test_memory_tier_is_bounded_by_bytes(cache):
+    for i in range(10):
+        cache.put(f"k{i}", bytes(300))
+    assert cache.cache_stats()["bytes"] <= 1000
+    assert cache.get("k9") is not None and cache.get("k0") is None
+    cache.put("big", bytes(2000))
+    assert cache.get("big") is None
+
+def test_frames_are_counted_by_their_memory(cache):
+    frame = pd.DataFrame({"x": np.zeros(50)})
+    cache.put("frame", (frame, {"metrics": {}}))
+    assert cache.cache_stats()["bytes"] >= 400
+    cache.put("other", (frame, {}))
+    assert cache.get("frame") is None and cache.get("other") is not None
+
+def test_disk_tier_is_bounded_by_bytes(cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "RESULT_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(cache, "RESULT_CACHE_DISK_BYTES", 1500)
+    for i in range(10):
+        cache.put(f"k{i}", bytes(400))
+    files = list(tmp_path.glob("*.pkl"))
+    assert 0 < len(files) <= 3
+    assert sum(f.stat().st_size for f in files) <= 1500
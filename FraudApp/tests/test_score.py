@@ -0,0 +1,48 @@
+import pandas as pd
+from conftest import bundled_path
+
+def records(rows: int = 3) -> list:
+    frame = pd.read_csv(bundled_path("transactions_cleaned.csv"), encoding='cp1251', nrows=rows)
+    return [
+        {"cst_dim_id": row.cst_dim_id, "transdatetime": row.transdatetime.strip("'"), "transdate": None,
+         "amount": row.amount, "docno": int(row.docno), "direction": row.direction}
+        for row in frame.itertuples()
+    ]
+
+def test_score_returns_a_decision_per_matched_transaction(client):
+    body = records()
+    response = client.post("/score", json=body)
+    assert response.status_code == 200
+    result = response.json()
+    assert len(result["results"]) + len(result["unmatched"]) == len(body)
+    assert all(0 <= r["probability"] <= 1 and r["target"] in (0, 1) for r in result["results"])
+
+def test_score_rejects_an_invalid_transdatetime(client):
+    body = records()
+    body[1]["transdatetime"] = "not a date"
+    response = client.post("/score", json=body)
+    assert response.status_code == 422
+    assert response.json()["file"] == "transactions"
+    body[1]["transdatetime"] = body[0]["transdatetime"]
+    body[1]["transdate"] = "2025-13-45"
+    body[0]["transdate"] = body[2]["transdate"] = "2025-01-01"
+    assert client.post("/score", json=body).status_code == 422
+
+def test_requests_print_nothing(client, bundled_csvs, capsys):
+    from helpers import validate_transaction_data
+    capsys.readouterr()
+    response = client.post("/process", files={"file1": ("t.csv", bundled_csvs[0]), "file2": ("p.csv", bundled_csvs[1])}, params={"format": "csv"})
+    assert response.status_code == 200
+    assert client.post("/score", json=records()).status_code == 200
+    # an integer cst_dim_id skips the float check, which used to be printed
+    transactions = bundled_csvs[2].head(5).copy()
+    transactions['cst_dim_id'] = transactions['cst_dim_id'].astype('int64')
+    validate_transaction_data(transactions)
+    assert capsys.readouterr().out == ""
+
+def test_score_shares_the_scoring_queue(client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, "pending_jobs", main.SCORING_WORKERS + main.SCORING_QUEUE_SIZE)
+    response = client.post("/score", json=records())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
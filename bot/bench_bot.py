@@ -0,0 +1,323 @@
+"""
+Load test of the bot's update handling against local stand-ins for the
+Telegram Bot API and for the backend's /process.
+
+Usage (from bot/):
+    python bench_bot.py [--users 100] [--spread 2] [--service-time 0.2] [--backend-workers 2] [--backend-queue 4]
+
+A simulated update stream is fed straight to the dispatcher, each update
+in its own task as polling does:
+- Every user sends /start.
+- Then, within --spread seconds, three users in four send both files as
+  one album and the rest send them one after the other.
+- A few more users send only their first file. Their FSM state must
+  still be there after the storage is closed and reopened, as after a
+  restart.
+
+The backend stand-in behaves like /process under load: --backend-workers
+requests are scored at a time for --service-time seconds each,
+--backend-queue more may wait, and anything beyond gets a 503 JSON
+error.
+
+The test runs twice, each time in a fresh process:
+- "unlimited": BACKEND_CONCURRENCY is as large as the number of users,
+  so requests go to the backend as soon as files arrive, as before.
+- "queue": the default limit.
+
+Reported per run:
+- Requests the backend received, rejected (503) and had in flight at most.
+- Results delivered.
+- Time from a user's second file to the bot's first reply (ack) and to
+  the result file.
+- Handler time per update, and messages sent and edited.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import aiohttp
+from aiohttp import web
+
+TOKEN = "123456:BENCH"
+FILES = {
+    "transactions.csv": b"cst_dim_id,transdate,transdatetime,amount,docno,direction,target\n" + b"1.0,2025-01-01,'2025-01-01 10:00:00.000',100.0,1,x,0\n" * 50,
+    "patterns.csv": b"transdate,cst_dim_id,monthly_os_changes\n" + b"2025-01-01,1.0,1\n" * 50,
+}
+RESULT = b"docno,target\n" + b"1,0\n" * 50
+METRICS = {"fraud": {"precision": 0.5, "recall": 0.5, "f1-score": 0.5, "support": 10}, "nonfraud": {"precision": 0.9, "recall": 0.9, "f1-score": 0.9, "support": 100}}
+
+
+# ==================== STAND-INS ====================
+def stub_app(service_time: float, workers: int, queue_size: int) -> web.Application:
+    stats = {"backend_requests": 0, "rejected": 0, "max_in_flight": 0, "in_flight": 0, "methods": {}, "events": {}}
+    scoring = asyncio.Semaphore(workers)
+    message_ids = iter(range(1, 10 ** 9))
+
+    def record(method: str, chat_id):
+        stats["methods"][method] = stats["methods"].get(method, 0) + 1
+        stats["events"].setdefault(str(chat_id), []).append([time.time(), method])
+
+    def message_json(chat_id) -> dict:
+        return {"ok": True, "result": {"message_id": next(message_ids), "date": int(time.time()), "chat": {"id": int(chat_id), "type": "private"}, "text": "x"}}
+
+    async def get_file(request):
+        data = await request.post()
+        return web.json_response({"ok": True, "result": {"file_id": data["file_id"], "file_unique_id": data["file_id"], "file_path": data["file_id"]}})
+
+    async def download(request):
+        return web.Response(body=FILES[request.match_info["path"]])
+
+    async def send_message(request):
+        data = await request.post()
+        record(request.match_info["method"], data["chat_id"])
+        return web.json_response(message_json(data["chat_id"]))
+
+    async def send_document(request):
+        chat_id = None
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "chat_id":
+                chat_id = await part.text()
+            else:
+                while await part.read_chunk():
+                    pass
+        record("sendDocument", chat_id)
+        return web.json_response(message_json(chat_id))
+
+    async def process(request):
+        stats["backend_requests"] += 1
+        if stats["in_flight"] >= workers + queue_size:
+            stats["rejected"] += 1
+            await request.read()
+            return web.json_response({"error": "Scoring queue is full, retry later"}, status=503, headers={"Retry-After": "1"})
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await request.read()
+            async with scoring:
+                await asyncio.sleep(service_time)
+            return web.Response(body=RESULT, content_type="text/csv", headers={"X-Metrics": json.dumps(METRICS)})
+        finally:
+            stats["in_flight"] -= 1
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application(client_max_size=0)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_post(f"/bot{TOKEN}/getFile", get_file)
+    app.router.add_get(f"/file/bot{TOKEN}/{{path}}", download)
+    app.router.add_post(f"/bot{TOKEN}/sendDocument", send_document)
+    app.router.add_post(f"/bot{TOKEN}/{{method:sendMessage|editMessageText}}", send_message)
+    app.router.add_post("/process", process)
+    return app
+
+
+# ==================== UPDATE STREAM ====================
+def document_update(update_id: int, user_id: int, file_name: str, media_group_id: str = None):
+    from aiogram.types import Chat, Document, Message, Update, User
+    message = Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name=f"user{user_id}"),
+        document=Document(file_id=file_name, file_unique_id=file_name, file_name=file_name),
+        media_group_id=media_group_id,
+    )
+    return Update(update_id=update_id, message=message)
+
+
+def start_update(update_id: int, user_id: int):
+    from aiogram.types import Chat, Message, Update, User
+    message = Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name=f"user{user_id}"), text="/start",
+    )
+    return Update(update_id=update_id, message=message)
+
+
+def schedule(users: int, half_users: int, spread: float, seed: int = 0) -> list:
+    """
+    (offset in seconds, update, user whose pair it completes or None),
+    sorted by offset.
+    """
+    rng = random.Random(seed)
+    updates, update_id = [], 1
+    for user_id in range(1, users + half_users + 1):
+        at = rng.random() * spread
+        if user_id > users:
+            updates.append((at, document_update(update_id, user_id, "transactions.csv"), None))
+            update_id += 1
+        elif user_id % 4:
+            # both files in one album: Telegram delivers its messages a few ms apart
+            group = f"album{user_id}"
+            updates.append((at, document_update(update_id, user_id, "transactions.csv", group), None))
+            updates.append((at + 0.01, document_update(update_id + 1, user_id, "patterns.csv", group), user_id))
+            update_id += 2
+        else:
+            updates.append((at, document_update(update_id, user_id, "transactions.csv"), None))
+            updates.append((at + 0.5, document_update(update_id + 1, user_id, "patterns.csv"), user_id))
+            update_id += 2
+    return sorted(updates, key=lambda item: item[0])
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+# ==================== MEASUREMENT ====================
+async def bench_storage(path: str, operations: int = 2000) -> dict:
+    """
+    Microseconds per get_data + update_data, as a handler does them.
+    """
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from storage import SQLiteStorage
+    result = {}
+    for name, storage in (("memory", MemoryStorage()), ("sqlite", SQLiteStorage(path))):
+        start = time.perf_counter()
+        for i in range(operations):
+            key = StorageKey(bot_id=1, chat_id=i, user_id=i)
+            await storage.get_data(key)
+            await storage.update_data(key, {"file1": {"file_id": "x" * 80, "file_name": "transactions.csv"}})
+        result[name] = (time.perf_counter() - start) / operations * 1e6
+        await storage.close()
+    return result
+
+
+async def client(args, base_url: str, concurrency: int) -> dict:
+    """
+    Runs the update stream through the bot; concurrency 0 keeps its default limit.
+    """
+    state_dir = tempfile.mkdtemp()
+    os.environ.update({
+        "BOT_TOKEN": TOKEN, "BACKEND_URL": base_url + "/process", "FSM_STORAGE_PATH": os.path.join(state_dir, "fsm.sqlite3"),
+    })
+    if concurrency:
+        os.environ["BACKEND_CONCURRENCY"] = str(concurrency)
+    import main
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.fsm.storage.base import StorageKey
+    from storage import SQLiteStorage
+
+    main.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    await main.open_http_session()
+    handler_times = []
+
+    async def feed(update):
+        start = time.perf_counter()
+        await main.dp.feed_update(main.bot, update)
+        handler_times.append(time.perf_counter() - start)
+
+    users, half_users = args.users, max(1, args.users // 10)
+    await asyncio.gather(*(feed(start_update(10 ** 6 + user_id, user_id)) for user_id in range(1, users + half_users + 1)))
+    handler_times.clear()
+
+    began = time.time()
+    completed_at = {}
+    tasks = []
+    for offset, update, completes in schedule(users, half_users, args.spread):
+        await asyncio.sleep(max(0.0, began + offset - time.time()))
+        if completes is not None:
+            completed_at[completes] = time.time()
+        tasks.append(asyncio.create_task(feed(update)))
+    await asyncio.gather(*tasks)
+
+    # every pair has been handed to the queue; wait until it has run them all
+    deadline = time.time() + args.timeout
+    while (main.backend_queue.tasks or main.backend_queue.waiting) and time.time() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.time() - began
+    async with aiohttp.ClientSession() as session:
+        async with session.get(base_url + "/stats") as resp:
+            stats = await resp.json()
+
+    ack, result = [], []
+    for user, at in completed_at.items():
+        events = [(t, method) for t, method in stats["events"].get(str(user), []) if t >= at]
+        if events:
+            ack.append(events[0][0] - at)
+        documents = [t for t, method in events if method == "sendDocument"]
+        if documents:
+            result.append(documents[0] - at)
+    per_user = [sum(method == "sendDocument" for _, method in stats["events"].get(str(user), [])) for user in completed_at]
+
+    await main.close_http_session()
+    await main.dp.storage.close()
+    # the half-uploaded users' first file must survive a restart
+    reopened = SQLiteStorage(os.environ["FSM_STORAGE_PATH"])
+    kept = 0
+    for user_id in range(users + 1, users + half_users + 1):
+        data = await reopened.get_data(StorageKey(bot_id=main.bot.id, chat_id=user_id, user_id=user_id))
+        kept += data.get("file1", {}).get("file_id") == "transactions.csv"
+    await reopened.close()
+    await main.bot.session.close()
+    return {
+        "concurrency": main.BACKEND_CONCURRENCY, "elapsed_s": elapsed,
+        "backend_requests": stats["backend_requests"], "rejected": stats["rejected"], "max_in_flight": stats["max_in_flight"],
+        "delivered": stats["methods"].get("sendDocument", 0), "duplicates": sum(count > 1 for count in per_user),
+        "ack_p50": percentile(ack, 0.5), "ack_p95": percentile(ack, 0.95),
+        "result_p50": percentile(result, 0.5), "result_p95": percentile(result, 0.95),
+        "handler_p50": percentile(handler_times, 0.5), "handler_p95": percentile(handler_times, 0.95),
+        "sent": stats["methods"].get("sendMessage", 0), "edited": stats["methods"].get("editMessageText", 0),
+        "half_users": half_users, "half_users_kept": kept,
+        "storage_us": await bench_storage(os.path.join(state_dir, "bench.sqlite3")),
+    }
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--spread", type=float, default=2.0)
+    parser.add_argument("--service-time", type=float, default=0.2)
+    parser.add_argument("--backend-workers", type=int, default=2)
+    parser.add_argument("--backend-queue", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--client", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    if args.serve:
+        web.run_app(stub_app(args.service_time, args.backend_workers, args.backend_queue), host="127.0.0.1", port=args.port, print=None)
+        return
+    if args.client is not None:
+        print(json.dumps(asyncio.run(client(args, base_url, args.client))))
+        return
+
+    print(f"{args.users} users over {args.spread}s; backend: {args.backend_workers} workers x {args.service_time}s, "
+          f"{args.backend_queue} queued, 503 beyond")
+    for mode, concurrency in (("unlimited", args.users * 2), ("queue", 0)):
+        server = subprocess.Popen([sys.executable, __file__, "--serve", "--port", str(args.port), "--service-time", str(args.service_time),
+                                   "--backend-workers", str(args.backend_workers), "--backend-queue", str(args.backend_queue)])
+        try:
+            time.sleep(1.5)
+            output = subprocess.run(
+                [sys.executable, __file__, "--client", str(concurrency), "--port", str(args.port), "--users", str(args.users),
+                 "--spread", str(args.spread), "--timeout", str(args.timeout)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+        finally:
+            server.terminate()
+            server.wait()
+        r = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode} (BACKEND_CONCURRENCY={r['concurrency']}):")
+        print(f"   backend: {r['backend_requests']} requests, {r['rejected']} rejected with 503, at most {r['max_in_flight']} in flight")
+        print(f"   results delivered {r['delivered']} of {args.users} ({r['duplicates']} users got more than one) in {r['elapsed_s']:.1f}s")
+        print(f"   ack    p50={r['ack_p50'] * 1000:7.0f}ms  p95={r['ack_p95'] * 1000:7.0f}ms")
+        print(f"   result p50={r['result_p50'] * 1000:7.0f}ms  p95={r['result_p95'] * 1000:7.0f}ms")
+        print(f"   handler per update p50={r['handler_p50'] * 1000:7.1f}ms  p95={r['handler_p95'] * 1000:7.1f}ms")
+        print(f"   messages sent {r['sent']}, edited {r['edited']}; first files kept across restart {r['half_users_kept']} of {r['half_users']}")
+    print(f"FSM get_data + update_data: memory {r['storage_us']['memory']:.0f}us, sqlite {r['storage_us']['sqlite']:.0f}us")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,251 @@
+"""
+Benchmark of the bot's upload path against local stand-ins for the
+Telegram Bot API (getFile, file download, sendDocument, sendMessage) and
+for the backend's /process.
+
+Usage (from bot/):
+    python bench_relay.py [--rows 200000] [--repeat 3]
+
+Compares the relay in main.py with the previous path, reproduced here as
+legacy_relay:
+- Save both documents to uploads/.
+- Post them through a fresh ClientSession.
+- json.loads the whole JSON response.
+- Rewrite every row with csv.DictWriter into a temporary file.
+- Upload that file.
+
+Each path runs in a fresh process. The benchmark reports wall time per
+relay, the growth of the process's peak RSS and the bytes written to
+disk. Both stand-ins serve the same rows: the Telegram stand-in replicates
+the bundled CSVs to --rows transactions, and the backend stand-in answers
+with --rows scored rows, as CSV or JSON.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import aiohttp
+from aiohttp import web
+
+TOKEN = "123456:BENCH"
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+METRICS = {
+    "fraud": {"precision": 0.5, "recall": 0.5, "f1-score": 0.5, "support": 10},
+    "nonfraud": {"precision": 0.9, "recall": 0.9, "f1-score": 0.9, "support": 100},
+}
+
+# ==================== STAND-INS ====================
+def replicate(path: str, rows: int, out_path: str):
+    with open(path, "rb") as f:
+        header, *lines = f.readlines()
+    with open(out_path, "wb") as out:
+        out.write(header)
+        for i in range(rows):
+            out.write(lines[i % len(lines)])
+
+def write_results(rows: int, data_dir: str):
+    """
+    Scored rows like /process returns: ids, the joined patterns columns,
+    features and both targets.
+    """
+    columns = ["cst_dim_id", "docno", "amount"] + [f"feature_{n}" for n in range(28)] + ["expected_target", "target"]
+    with open(os.path.join(data_dir, "result.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for i in range(rows):
+            writer.writerow([float(i), i, 1234.5 + i] + [i * 0.001 + n for n in range(28)] + [i % 2, i % 3 == 0])
+    with open(os.path.join(data_dir, "result.csv")) as f, open(os.path.join(data_dir, "result.json"), "w") as out:
+        out.write(json.dumps({"predictions": list(csv.DictReader(f)), "metrics": METRICS}))
+
+async def drain(request: web.Request) -> dict:
+    sizes = {}
+    reader = await request.multipart()
+    async for part in reader:
+        sizes[part.name] = 0
+        while chunk := await part.read_chunk(256 * 1024):
+            sizes[part.name] += len(chunk)
+    return sizes
+
+def peak_rss() -> int:
+    """
+    This process's peak RSS. Read from VmHWM, which starts afresh at exec;
+    ru_maxrss would carry over the orchestrating parent's peak.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def message_json(chat_id: int = 1) -> dict:
+    return {"message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+
+def stub_app(data_dir: str) -> web.Application:
+    # bytes of each file part last received, checked by the client after every relay
+    received = {}
+
+    async def get_file(request):
+        data = await request.post()
+        return web.json_response({"ok": True, "result": {"file_id": data["file_id"], "file_unique_id": data["file_id"], "file_path": data["file_id"]}})
+
+    async def download(request):
+        return web.FileResponse(os.path.join(data_dir, request.match_info["path"]))
+
+    async def send_document(request):
+        # aiogram sends the file under a random attach:// name; it is the largest part
+        received["document"] = max((await drain(request)).values())
+        return web.json_response({"ok": True, "result": message_json()})
+
+    async def send_message(request):
+        await request.read()
+        return web.json_response({"ok": True, "result": message_json()})
+
+    async def process(request):
+        received.update(await drain(request))
+        if request.query.get("format") == "csv":
+            return web.FileResponse(os.path.join(data_dir, "result.csv"), headers={"Content-Type": "text/csv", "X-Metrics": json.dumps(METRICS)})
+        return web.FileResponse(os.path.join(data_dir, "result.json"), headers={"Content-Type": "application/json"})
+
+    async def stats(request):
+        return web.json_response(received)
+
+    app = web.Application(client_max_size=0)
+    app.router.add_get("/received", stats)
+    app.router.add_post(f"/bot{TOKEN}/getFile", get_file)
+    app.router.add_get(f"/file/bot{TOKEN}/{{path}}", download)
+    app.router.add_post(f"/bot{TOKEN}/sendDocument", send_document)
+    app.router.add_post(f"/bot{TOKEN}/sendMessage", send_message)
+    app.router.add_post("/process", process)
+    return app
+
+# ==================== PREVIOUS PATH ====================
+async def legacy_relay(main, message, docs: list, upload_dir: str) -> int:
+    """
+    The upload path before the streaming relay, kept for comparison.
+    Returns the bytes it wrote to disk.
+    """
+    from aiogram.types import FSInputFile
+    paths = []
+    for num, doc in enumerate(docs, 1):
+        file = await main.bot.get_file(doc["file_id"])
+        path = os.path.join(upload_dir, f"{message.from_user.id}_{num}_{int(time.time())}.csv")
+        await main.bot.download_file(file.file_path, path)
+        paths.append(path)
+    async with aiohttp.ClientSession() as session:
+        with open(paths[0], "rb") as f1, open(paths[1], "rb") as f2:
+            form = aiohttp.FormData()
+            form.add_field("file1", f1, filename="file1.csv")
+            form.add_field("file2", f2, filename="file2.csv")
+            async with session.post(main.BACKEND_URL, data=form) as resp:
+                text_result = await resp.text()
+
+    parsed = json.loads(text_result)
+    rows = parsed.get("predictions", [])
+    file_name = os.path.join(upload_dir, f"result_{int(time.time())}.csv")
+    with open(file_name, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    await message.answer_document(document=FSInputFile(file_name), caption="Готово! Результат во вложении (CSV).")
+    await message.answer(main.format_metrics(parsed.get("metrics")), parse_mode="Markdown")
+    written = sum(os.path.getsize(path) for path in paths + [file_name])
+    for path in paths + [file_name]:
+        os.remove(path)
+    return written
+
+# ==================== MEASUREMENT ====================
+async def check_received(base_url: str, data_dir: str, mode: str):
+    """
+    Fails unless the backend got both uploads whole and Telegram got the
+    whole result; for the previous path, the result as DictWriter writes it.
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.get(base_url + "/received") as resp:
+            received = await resp.json()
+    expected = {"file1": os.path.getsize(os.path.join(data_dir, "transactions.csv")), "file2": os.path.getsize(os.path.join(data_dir, "patterns.csv"))}
+    if mode == "stream":
+        expected["document"] = os.path.getsize(os.path.join(data_dir, "result.csv"))
+    else:
+        received.pop("document")
+    if received != expected:
+        raise SystemExit(f"{mode}: received {received}, expected {expected}")
+
+async def client(mode: str, base_url: str, repeat: int, data_dir: str) -> dict:
+    os.environ["BOT_TOKEN"], os.environ["BACKEND_URL"] = TOKEN, base_url + "/process"
+    os.environ["FSM_STORAGE_PATH"] = os.path.join(tempfile.mkdtemp(), "fsm.sqlite3")
+    import main
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import Chat, Message, User
+
+    main.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    await main.open_http_session()
+    message = Message(
+        message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"),
+        from_user=User(id=1, is_bot=False, first_name="bench"),
+    ).as_(main.bot)
+    docs = [{"file_id": "transactions.csv", "file_name": "transactions.csv"}, {"file_id": "patterns.csv", "file_name": "patterns.csv"}]
+
+    base_rss = peak_rss()
+    times, written = [], 0
+    with tempfile.TemporaryDirectory() as upload_dir:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if mode == "legacy":
+                written = await legacy_relay(main, message, docs, upload_dir)
+            else:
+                await main.send_to_backend(message, docs)
+            times.append(time.perf_counter() - start)
+            await check_received(base_url, data_dir, mode)
+    growth = peak_rss() - base_rss
+    await main.close_http_session()
+    await main.bot.session.close()
+    return {"median_ms": sorted(times)[len(times) // 2] * 1000, "peak_rss_growth": growth, "disk_bytes": written}
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--client", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    if args.serve:
+        web.run_app(stub_app(args.serve), host="127.0.0.1", port=args.port, print=None)
+        return
+    if args.client:
+        print(json.dumps(asyncio.run(client(args.client, base_url, args.repeat, args.data_dir))))
+        return
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        replicate(os.path.join(ROOT, "transactions_cleaned.csv"), args.rows, os.path.join(data_dir, "transactions.csv"))
+        replicate(os.path.join(ROOT, "patterns_cleaned.csv"), args.rows * 2 // 3, os.path.join(data_dir, "patterns.csv"))
+        write_results(args.rows, data_dir)
+        sizes = {name: os.path.getsize(os.path.join(data_dir, name)) / 2 ** 20 for name in sorted(os.listdir(data_dir))}
+        print(f"{args.rows} rows: " + ", ".join(f"{name} {size:.1f} MB" for name, size in sizes.items()))
+
+        server = subprocess.Popen([sys.executable, __file__, "--serve", data_dir, "--port", str(args.port)])
+        try:
+            time.sleep(1.5)
+            for mode in ("legacy", "stream"):
+                output = subprocess.run(
+                    [sys.executable, __file__, "--client", mode, "--port", str(args.port), "--repeat", str(args.repeat), "--data-dir", data_dir],
+                    capture_output=True, text=True, check=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(f"{mode:<7} median={result['median_ms']:8.1f}ms  peak RSS +{result['peak_rss_growth'] / 2 ** 20:7.1f} MB  "
+                      f"disk written {result['disk_bytes'] / 2 ** 20:7.1f} MB")
+        finally:
+            server.terminate()
+
+if __name__ == "__main__":
+    run()
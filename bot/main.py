@@ -3,18 +3,16 @@ import time
 import asyncio
 import aiohttp
 import json
-import csv
-from aiogram.types import FSInputFile
 
 from typing import Any, Dict, Awaitable, Callable, Union, List
 
 from aiogram import Bot, Dispatcher, F, BaseMiddleware
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Message
+from aiogram.types import Message, InputFile
 
 from states import CsvState
+from storage import SQLiteStorage
 
 BOT_TOKEN, BACKEND_URL = "", ""
 
@@ -27,11 +25,37 @@ else:
 
 
 
+# Форматы, которые принимает backend: CSV, Parquet и Arrow IPC (Feather v2)
+UPLOAD_EXTENSIONS = (".csv", ".parquet", ".arrow", ".feather", ".ipc")
+
+
+# Файл SQLite с состоянием FSM: присланный первый файл не теряется при перезапуске
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH", "fsm.sqlite3")
+# Пауза после последнего сообщения альбома, после которой альбом считается собранным
+ALBUM_LATENCY = float(os.getenv("ALBUM_LATENCY", 0.3))
+# Сколько альбомов собирается одновременно; сообщения сверх лимита обрабатываются по одному
+ALBUM_LIMIT = int(os.getenv("ALBUM_LIMIT", 1000))
+# Больше сообщений в альбоме Telegram не присылает
+ALBUM_MAX_SIZE = 10
+
+
 # ==================== MIDDLEWARE ДЛЯ АЛЬБОМОВ ====================
 class AlbumMiddleware(BaseMiddleware):
-    def __init__(self, latency: float = 0.3):
+    """
+    Собирает сообщения одного альбома (media group) и передаёт их хендлеру
+    одним вызовом, с первым сообщением. Альбом отправляется по таймеру —
+    через latency секунд после последнего сообщения — или сразу, как только
+    в нём max_size сообщений. Ждёт только вызов первого сообщения, остальные
+    возвращаются сразу. Одновременно собирается не больше max_albums альбомов.
+    """
+
+    def __init__(self, latency: float = ALBUM_LATENCY, max_albums: int = ALBUM_LIMIT, max_size: int = ALBUM_MAX_SIZE):
         self.latency = latency
+        self.max_albums = max_albums
+        self.max_size = max_size
         self.albums: Dict[str, List[Message]] = {}
+        self.ready: Dict[str, asyncio.Future] = {}
+        self.timers: Dict[str, asyncio.TimerHandle] = {}
 
     async def __call__(
         self,
@@ -46,26 +70,207 @@ class AlbumMiddleware(BaseMiddleware):
         if not media_group:
             return await handler(event, data)
 
-        # Добавляем сообщение в альбом
-        self.albums.setdefault(media_group, []).append(event)
+        # Альбом уже собирается: добавляем сообщение и переносим таймер
+        album = self.albums.get(media_group)
+        if album is not None:
+            album.append(event)
+            if len(album) >= self.max_size:
+                self.flush(media_group)
+            else:
+                self.schedule(media_group)
+            return
 
-        await asyncio.sleep(self.latency)
+        # Буфер полон → сообщение обрабатывается само по себе
+        if len(self.albums) >= self.max_albums:
+            return await handler(event, data)
 
-        # Передаём весь альбом только один раз — по последнему сообщению
-        if media_group in self.albums:
-            album = self.albums.pop(media_group)
-            data["album"] = album
-            return await handler(album[0], data)
+        self.albums[media_group] = [event]
+        ready = self.ready[media_group] = asyncio.get_running_loop().create_future()
+        self.schedule(media_group)
+        album = await ready
+        data["album"] = album
+        return await handler(album[0], data)
+
+    def schedule(self, media_group: str):
+        timer = self.timers.pop(media_group, None)
+        if timer is not None:
+            timer.cancel()
+        self.timers[media_group] = asyncio.get_running_loop().call_later(self.latency, self.flush, media_group)
+
+    def flush(self, media_group: str):
+        timer = self.timers.pop(media_group, None)
+        if timer is not None:
+            timer.cancel()
+        album = self.albums.pop(media_group)
+        ready = self.ready.pop(media_group)
+        # Вызов первого сообщения мог быть отменён (остановка бота)
+        if not ready.done():
+            ready.set_result(album)
 
 
 # ==================== НАСТРОЙКА ====================
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=SQLiteStorage(FSM_STORAGE_PATH))
 
 dp.message.outer_middleware(AlbumMiddleware())
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Одновременные соединения с backend
+BACKEND_CONNECTIONS = int(os.getenv("BACKEND_CONNECTIONS", 16))
+# Таймауты backend в секундах: на соединение и на паузу между кусками ответа.
+# Общего лимита нет — большой файл может считаться долго, пока данные идут
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", 10))
+BACKEND_READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", 600))
+# Размер кусков, которыми файлы идут из Telegram в backend и обратно
+RELAY_CHUNK_SIZE = 256 * 1024
+# Сколько запросов к backend идёт одновременно от всех пользователей; остальные ждут в очереди
+BACKEND_CONCURRENCY = int(os.getenv("BACKEND_CONCURRENCY", 4))
+# Сколько пар файлов один пользователь может держать в очереди вместе с обрабатываемой
+USER_QUEUE_LIMIT = int(os.getenv("USER_QUEUE_LIMIT", 3))
+# Сколько пар файлов всего может ждать в очереди
+QUEUE_LIMIT = int(os.getenv("QUEUE_LIMIT", 500))
+# Раз в сколько секунд ожидающим обновляется позиция в очереди
+QUEUE_UPDATE_INTERVAL = float(os.getenv("QUEUE_UPDATE_INTERVAL", 3))
+# Сколько сообщений с позицией правится за раз, чтобы не упереться в лимиты Telegram
+QUEUE_UPDATE_BATCH = 20
+
+# Общая сессия с пулом соединений, создаётся при запуске
+http_session: aiohttp.ClientSession | None = None
+
+
+@dp.startup()
+async def open_http_session():
+    global http_session
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=BACKEND_CONNECTIONS),
+        timeout=aiohttp.ClientTimeout(total=None, connect=BACKEND_CONNECT_TIMEOUT, sock_read=BACKEND_READ_TIMEOUT),
+    )
+    backend_queue.start()
+
+
+@dp.shutdown()
+async def close_http_session():
+    await backend_queue.stop()
+    await http_session.close()
+
+
+# ==================== ОЧЕРЕДЬ ЗАПРОСОВ К BACKEND ====================
+class BackendQueue:
+    """
+    Очередь пар файлов на отправку в backend. Одновременно идёт не больше
+    concurrency запросов и не больше одного на пользователя: следующие пары
+    того же пользователя ждут, не занимая место других. Хендлер только
+    ставит пару в очередь и сразу освобождается.
+
+    У каждой пары есть сообщение о статусе: пока она ждёт, в нём позиция
+    в очереди (обновляется раз в update_interval секунд), потом — ход
+    обработки.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = BACKEND_CONCURRENCY,
+        user_limit: int = USER_QUEUE_LIMIT,
+        limit: int = QUEUE_LIMIT,
+        update_interval: float = QUEUE_UPDATE_INTERVAL,
+    ):
+        self.concurrency = concurrency
+        self.user_limit = user_limit
+        self.limit = limit
+        self.update_interval = update_interval
+        # Ожидающие пары в порядке поступления
+        self.waiting: List[dict] = []
+        self.running_users: set = set()
+        self.tasks: set = set()
+        self.updater: asyncio.Task | None = None
+
+    def start(self):
+        self.updater = asyncio.create_task(self.update_positions())
+
+    async def stop(self):
+        """
+        Останавливает очередь. Ожидающим сообщается, что файлы нужно прислать заново.
+        """
+        if self.updater is not None:
+            self.updater.cancel()
+        for task in list(self.tasks):
+            task.cancel()
+        waiting, self.waiting = self.waiting, []
+        for job in waiting:
+            await self.show(job, "Бот перезапускается, отправьте файлы ещё раз.")
+
+    async def submit(self, message: Message, docs: List[dict]) -> bool:
+        """
+        Ставит пару файлов в очередь и отвечает сообщением о статусе.
+        Если очередь или лимит пользователя заполнены, пара не принимается.
+        Возвращает, принята ли пара.
+        """
+        user_id = message.from_user.id
+        if len(self.waiting) >= self.limit:
+            await message.answer("Очередь переполнена, отправьте файлы чуть позже.")
+            return False
+        queued = sum(job["user_id"] == user_id for job in self.waiting) + (user_id in self.running_users)
+        if queued >= self.user_limit:
+            await message.answer(f"У вас уже {queued} пар(ы) файлов в обработке. Дождитесь результата.")
+            return False
+
+        job = {"message": message, "docs": docs, "user_id": user_id, "status": None, "shown": None}
+        if len(self.running_users) < self.concurrency and user_id not in self.running_users:
+            text = "Файлы получены. Отправляю на backend..."
+        else:
+            job["shown"] = len(self.waiting) + 1
+            text = self.position_text(job["shown"])
+        job["status"] = await message.answer(text)
+        self.waiting.append(job)
+        self.dispatch()
+        return True
+
+    @staticmethod
+    def position_text(position: int) -> str:
+        return f"Файлы получены. Позиция в очереди: {position}."
+
+    def dispatch(self):
+        # Запускаем первые в очереди пары тех пользователей, у кого сейчас ничего не считается
+        i = 0
+        while len(self.running_users) < self.concurrency and i < len(self.waiting):
+            job = self.waiting[i]
+            if job["user_id"] in self.running_users:
+                i += 1
+                continue
+            del self.waiting[i]
+            self.running_users.add(job["user_id"])
+            task = asyncio.create_task(self.run(job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, job: dict):
+        try:
+            # Статус ожидавших показывает позицию; у остальных там уже «Отправляю»
+            if job["shown"] is not None:
+                await self.show(job, "Ваша очередь: файлы отправляются на backend...")
+            await send_to_backend(job["message"], job["docs"], lambda text: self.show(job, text))
+        finally:
+            self.running_users.discard(job["user_id"])
+            self.dispatch()
+
+    async def show(self, job: dict, text: str):
+        try:
+            await job["status"].edit_text(text)
+        except Exception:
+            # Статус — подсказка: если правка не прошла, обработка продолжается
+            pass
+
+    async def update_positions(self):
+        while True:
+            await asyncio.sleep(self.update_interval)
+            edits = []
+            for position, job in enumerate(self.waiting[:QUEUE_UPDATE_BATCH], 1):
+                if job["shown"] != position:
+                    job["shown"] = position
+                    edits.append(self.show(job, self.position_text(position)))
+            await asyncio.gather(*edits)
+
+
+backend_queue = BackendQueue()
 
 
 # ==================== КОМАНДА START ====================
@@ -115,7 +320,7 @@ async def start_cmd(message: Message, state: FSMContext):
 
 
     await message.answer(
-        "Отправьте два CSV-файла.\n"
+        "Отправьте два файла: CSV, Parquet или Arrow.\n"
         "Можно по одному, можно сразу оба одним сообщением." 
     )
 
@@ -123,14 +328,29 @@ async def start_cmd(message: Message, state: FSMContext):
     await message.answer(requirements2, parse_mode="HTML")
 
 
-# ==================== СОХРАНЕНИЕ ФАЙЛА ====================
-async def save_file(document, user_id: int, num: int) -> str:
-    file = await bot.get_file(document.file_id)
-    ts = int(time.time())
-    fname = f"{user_id}_{num}_{ts}.csv"
-    path = os.path.join(UPLOAD_DIR, fname)
-    await bot.download_file(file.file_path, path)
-    return path
+# ==================== ЧТЕНИЕ ФАЙЛА ИЗ TELEGRAM ====================
+async def telegram_stream(file_id: str):
+    """
+    Отдаёт файл из Telegram кусками по мере скачивания, без записи на диск.
+    """
+    file = await bot.get_file(file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    async for chunk in bot.session.stream_content(url=url, timeout=int(BACKEND_READ_TIMEOUT), chunk_size=RELAY_CHUNK_SIZE):
+        yield chunk
+
+
+class BackendResultFile(InputFile):
+    """
+    Ответ backend, который пересылается в Telegram по мере получения.
+    """
+
+    def __init__(self, response: aiohttp.ClientResponse, filename: str):
+        super().__init__(filename=filename, chunk_size=RELAY_CHUNK_SIZE)
+        self.response = response
+
+    async def read(self, bot: Bot):
+        async for chunk in self.response.content.iter_chunked(self.chunk_size):
+            yield chunk
 
 
 # ==================== ХЕНДЛЕР ПОЛУЧЕНИЯ CSV ====================
@@ -140,129 +360,106 @@ async def process_csv(message: Message, state: FSMContext, album: List[Message]
     if album is None:
         album = [message]
 
-    # Собираем все CSV документы
+    # Собираем все документы поддерживаемых форматов
     csv_docs = [
         msg.document for msg in album
-        if msg.document and msg.document.file_name.lower().endswith(".csv")
+        if msg.document and msg.document.file_name.lower().endswith(UPLOAD_EXTENSIONS)
     ]
 
     if not csv_docs:
-        return await message.answer("Отправьте только CSV файлы.")
+        return await message.answer("Отправьте файлы CSV, Parquet или Arrow.")
 
-    user_id = message.from_user.id
     data = await state.get_data()
+    # Файлы не скачиваются заранее: в состоянии хранится только file_id
+    docs = [{"file_id": doc.file_id, "file_name": doc.file_name} for doc in csv_docs]
 
     # ==== СОБРАНО ДВА СРАЗУ ====
-    if len(csv_docs) >= 2:
-        path1 = await save_file(csv_docs[0], user_id, 1)
-        path2 = await save_file(csv_docs[1], user_id, 2)
-
-        await message.answer("Получены два CSV файла. Отправляю на backend...")
-
-        result = await send_to_backend(path1, path2)
-        await send_csv_file(message, result)
-
-        for p in (path1, path2):
-            try: os.remove(p)
-            except: pass
-
-        await state.clear()
+    # Пара ставится в очередь, хендлер не ждёт ответа backend.
+    # Состояние сбрасывается, только если очередь пару приняла
+    if len(docs) >= 2:
+        if await backend_queue.submit(message, docs[:2]):
+            await state.clear()
         return
 
     # ==== ПЕРВЫЙ И ВТОРОЙ ПО ОДНОМУ ====
     file1 = data.get("file1")
 
     if not file1:
-        path1 = await save_file(csv_docs[0], user_id, 1)
-        await state.update_data(file1=path1)
-        return await message.answer("Первый файл получен. Отправьте второй CSV.")
+        await state.update_data(file1=docs[0])
+        return await message.answer("Первый файл получен. Отправьте второй.")
 
     else:
-        path2 = await save_file(csv_docs[0], user_id, 2)
-        await message.answer("Второй файл получен. Отправляю на backend...")
-
-        result = await send_to_backend(file1, path2)
-        await send_csv_file(message, result)
-
-        for p in (file1, path2):
-            try: os.remove(p)
-            except: pass
-
-        await state.clear()
+        # Не принята — первый файл остаётся, второй можно прислать позже
+        if await backend_queue.submit(message, [file1, docs[0]]):
+            await state.clear()
 
 
 # ==================== ОТПРАВКА НА БЭКЕНД ====================
-async def send_to_backend(file1: str, file2: str) -> str:
-    try:
-        async with aiohttp.ClientSession() as session:
-            with open(file1, "rb") as f1, open(file2, "rb") as f2:
-                form = aiohttp.FormData()
-                form.add_field("file1", f1, filename="file1.csv")
-                form.add_field("file2", f2, filename="file2.csv")
-
-                async with session.post(BACKEND_URL, data=form) as resp:
-                    return await resp.text()
-    except Exception as e:
-        return f"Ошибка: {e}"
-    
-    
-async def send_csv_file(message: Message, text_result: str):
-    import json
-    import csv
-    import os
-    import time
-    from aiogram.types import FSInputFile
-
+async def send_to_backend(message: Message, docs: List[dict], progress: Callable[[str], Awaitable[Any]] | None = None):
+    """
+    Пересылает файлы из Telegram в backend и результат обратно в чат.
+    Оба направления идут потоком: файлы не пишутся на диск и целиком
+    в памяти не держатся. Результат приходит в CSV, метрики — в заголовке X-Metrics.
+    progress, если передан, получает текст о ходе обработки.
+    """
+    async def report(text: str):
+        if progress is not None:
+            await progress(text)
+
+    form = aiohttp.FormData()
+    for num, doc in enumerate(docs, 1):
+        form.add_field(f"file{num}", telegram_stream(doc["file_id"]), filename=doc["file_name"])
+
+    started = time.perf_counter()
     try:
-        parsed = json.loads(text_result)
-        rows = parsed.get("predictions", [])
-        metrics = parsed.get("metrics")
-        pretty = format_metrics(metrics)
-
-        file_name = f"result_{int(time.time())}.csv"
-
-        with open(file_name, "w", encoding="utf-8", newline="") as f:
-            if rows:
-                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
-                writer.writeheader()
-                writer.writerows(rows)
-            else:
-                f.write("empty")
-
-        # создаём InputFile
-        file_to_send = FSInputFile(file_name)
-
-        await message.answer_document(
-            document=file_to_send,
-            caption="Готово! Результат во вложении (CSV)."
-        )
-        
-        await message.answer(pretty, parse_mode="Markdown")
-
+        async with http_session.post(BACKEND_URL, params={"format": "csv"}, data=form) as resp:
+            # Ошибки backend возвращает в JSON
+            if resp.content_type == "application/json":
+                body = await resp.json()
+                await report("Не удалось обработать файлы.")
+                return await message.answer(f"Ошибка: {body.get('error', body)}")
+            resp.raise_for_status()
+            # Заголовка может не быть, или он пустой
+            metrics_text = format_metrics(json.loads(resp.headers.get("X-Metrics") or "{}"))
+            await report("Модель отработала, пересылаю результат...")
+            await message.answer_document(
+                document=BackendResultFile(resp, f"result_{int(time.time())}.csv"),
+                caption="Готово! Результат во вложении (CSV)."
+            )
     except Exception as e:
-        await message.answer(f"Ошибка при сборке CSV: {e}")
-
-    finally:
-        if os.path.exists(file_name):
-            os.remove(file_name)
-
-def format_metrics(metrics: dict) -> str:
-    fraud = metrics.get("fraud", {})
-    nonfraud = metrics.get("nonfraud", {})
+        await report("Не удалось обработать файлы.")
+        return await message.answer(f"Ошибка: {e}")
+
+    await report(f"Готово за {time.perf_counter() - started:.1f} с.")
+    await message.answer(metrics_text, parse_mode="Markdown")
+
+def format_metrics(metrics: dict | None) -> str:
+    """
+    Текст с метриками из X-Metrics. Метрик нет, если в файле транзакций
+    не было колонки target, или backend их не прислал.
+    """
+    fraud = (metrics or {}).get("fraud") or {}
+    nonfraud = (metrics or {}).get("nonfraud") or {}
+    if not fraud and not nonfraud:
+        return "📊 Метрики не посчитаны: в файле транзакций нет колонки target."
+
+    def value(report: dict, name: str) -> str:
+        number = report.get(name)
+        return f"{number:.4f}" if isinstance(number, (int, float)) else "—"
 
     text = (
         "📊 *Итоговые метрики модели*\n\n"
         "🔴 *Мошенничество (fraud)*:\n"
-        f"• Точность (precision): {fraud.get('precision'):.4f}\n"
-        f"• Полнота (recall): {fraud.get('recall'):.4f}\n"
-        f"• F1: {fraud.get('f1-score'):.4f}\n"
-        f"• Кол-во примеров: {int(fraud.get('support', 0))}\n\n"
+        f"• Точность (precision): {value(fraud, 'precision')}\n"
+        f"• Полнота (recall): {value(fraud, 'recall')}\n"
+        f"• F1: {value(fraud, 'f1-score')}\n"
+        f"• Кол-во примеров: {int(fraud.get('support') or 0)}\n\n"
         
         "🟢 *Не мошенничество (nonfraud)*:\n"
-        f"• Точность (precision): {nonfraud.get('precision'):.4f}\n"
-        f"• Полнота (recall): {nonfraud.get('recall'):.4f}\n"
-        f"• F1: {nonfraud.get('f1-score'):.4f}\n"
-        f"• Кол-во примеров: {int(nonfraud.get('support', 0))}\n"
+        f"• Точность (precision): {value(nonfraud, 'precision')}\n"
+        f"• Полнота (recall): {value(nonfraud, 'recall')}\n"
+        f"• F1: {value(nonfraud, 'f1-score')}\n"
+        f"• Кол-во примеров: {int(nonfraud.get('support') or 0)}\n"
     )
 
     return text   
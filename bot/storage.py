@@ -0,0 +1,58 @@
+import json
+import sqlite3
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в локальном файле SQLite: состояние и данные (file_id уже
+    присланного файла) переживают перезапуск бота.
+
+    Каждый запрос читает или пишет одну строку по ключу и занимает десятки
+    микросекунд (WAL, без fsync на каждую запись), поэтому выполняется прямо
+    в цикле событий, без потоков.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')"
+        )
+
+    @staticmethod
+    def make_key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def read(self, key: StorageKey):
+        return self.connection.execute("SELECT state, data FROM fsm WHERE key = ?", (self.make_key(key),)).fetchone()
+
+    def write(self, key: StorageKey, column: str, value: Optional[str]):
+        db_key = self.make_key(key)
+        self.connection.execute(
+            f"INSERT INTO fsm (key, {column}) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}",
+            (db_key, value),
+        )
+        # Пустые записи не храним, чтобы таблица не росла с каждым пользователем
+        self.connection.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = '{}'", (db_key,))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self.write(key, "state", state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = self.read(key)
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self.write(key, "data", json.dumps(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = self.read(key)
+        return json.loads(row[1]) if row else {}
+
+    async def close(self) -> None:
+        self.connection.close()